@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Audio caches
+
+On-disk caches shared by the merge scripts. Static assets (daily intro,
+keyboard typing, end jingle) are keyed by content hash, so a changed source
+file is a different entry and stale entries simply age out of the LRU.
+Brief audio is keyed by brief id plus ETag/Content-Length and is linked into
+each run's working directory instead of being downloaded again.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+
+from mp3_frames import Mp3Info, scan_mp3
+
+logger = logging.getLogger("news-audio")
+
+# 缓存根目录，默认放在脚本同级的 .cache 目录
+CACHE_DIR = os.environ.get("NEWS_AUDIO_CACHE_DIR") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".cache"
+)
+ASSET_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 素材缓存上限 256MB
+BRIEF_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 简报音频缓存上限 2GB
+FICLONE = 0x40049409  # Linux reflink ioctl
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """计算文件内容的 sha256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(src, dest):
+    """把 src 放到 dest：优先硬链接，其次 reflink，最后普通复制"""
+    if os.path.exists(dest):
+        os.remove(dest)
+    try:
+        os.link(src, dest)
+        return "link"
+    except OSError:
+        pass
+    try:
+        import fcntl
+        with open(src, "rb") as fsrc, open(dest, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return "reflink"
+    except (OSError, ImportError):
+        pass
+    shutil.copyfile(src, dest)
+    return "copy"
+
+
+@contextmanager
+def file_lock(path, blocking=True):
+    """
+    基于 flock 的进程间文件锁；blocking=False 且锁已被占用时抛出 BlockingIOError
+    不支持 fcntl 的平台上不加锁
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _atomic_write(path, data):
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class AssetCache:
+    """
+    静态音频素材的磁盘缓存，以内容哈希为键
+    保存帧索引、转码成指定帧格式的MP3以及解码后的PCM，按最近使用时间淘汰
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=ASSET_CACHE_MAX_BYTES):
+        self.cache_dir = os.path.join(cache_dir or CACHE_DIR, "assets")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, digest, suffix):
+        return os.path.join(self.cache_dir, f"{digest}{suffix}")
+
+    def _touch(self, path):
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def _get(self, path):
+        if os.path.exists(path):
+            self._touch(path)
+            with self._lock:
+                self.hits += 1
+            return True
+        with self._lock:
+            self.misses += 1
+        return False
+
+    def frame_index(self, path, digest=None):
+        """返回素材的帧索引（Mp3Info），缓存命中时无需重新扫描"""
+        digest = digest or file_sha256(path)
+        index_path = self._path(digest, ".frames.json")
+        if self._get(index_path):
+            try:
+                with open(index_path, "r", encoding="utf-8") as f:
+                    return Mp3Info.from_dict(path, json.load(f))
+            except (OSError, ValueError, KeyError, TypeError):
+                logger.debug(f"[缓存] 帧索引损坏，重新扫描: {path}")
+        info = scan_mp3(path)
+        _atomic_write(index_path, json.dumps(info.to_dict()).encode("utf-8"))
+        self.evict()
+        return info
+
+    def get_or_create(self, path, variant, producer, digest=None):
+        """
+        返回素材某种派生形式（如转码后的MP3、解码后的PCM）的缓存文件路径
+        variant: 派生形式的标识，会拼进文件名
+        producer(src, dest): 缓存未命中时生成 dest，失败时返回 False 或抛出异常
+        """
+        digest = digest or file_sha256(path)
+        cached = self._path(digest, f"-{variant}")
+        if self._get(cached):
+            return cached
+        tmp = f"{cached}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            if producer(path, tmp) is False or not os.path.exists(tmp):
+                return None
+            os.replace(tmp, cached)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        logger.debug(f"[缓存] 写入素材缓存: {os.path.basename(cached)}")
+        self.evict(keep=cached)
+        return cached
+
+    def evict(self, keep=None):
+        """总大小超过上限时，按最近使用时间从旧到新删除缓存文件"""
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".tmp"):
+                    continue
+                full = os.path.join(self.cache_dir, name)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, full))
+                total += st.st_size
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for _, size, full in entries:
+                if total <= self.max_bytes:
+                    break
+                if full == keep:
+                    continue
+                try:
+                    os.remove(full)
+                    total -= size
+                    logger.debug(f"[缓存] 淘汰素材缓存: {os.path.basename(full)}")
+                except OSError:
+                    pass
+
+
+class BriefAudioCache:
+    """
+    简报音频的本地缓存，以简报 id 为键，记录 ETag 和文件大小用于校验
+    命中时以硬链接（或 reflink）放入工作目录，按总字节数做 LRU 淘汰
+    多个进程（定时任务、补跑、渲染服务）共用同一个缓存：save() 持有文件锁合并各自的改动
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=BRIEF_CACHE_MAX_BYTES):
+        self.cache_dir = os.path.join(cache_dir or CACHE_DIR, "briefs")
+        self.index_file = os.path.join(self.cache_dir, "index.json")
+        self.lock_file = os.path.join(self.cache_dir, "index.lock")
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._changed = set()  # 上次保存后本进程写入或使用过的简报 id
+        self._removed = {}  # 上次保存后本进程删除的简报 id -> 删除时间
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._index = self._load_index()
+
+    def _load_index(self):
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # 丢弃文件已不存在的条目
+        return {k: v for k, v in index.items()
+                if isinstance(v, dict) and os.path.exists(self._file(v.get("file", "")))}
+
+    def _file(self, name):
+        return os.path.join(self.cache_dir, name)
+
+    @staticmethod
+    def _filename(brief_id):
+        return hashlib.sha1(brief_id.encode("utf-8")).hexdigest() + ".mp3"
+
+    def lookup(self, brief_id):
+        """返回缓存条目（dict 副本），没有时返回 None"""
+        with self._lock:
+            entry = self._index.get(brief_id)
+            return dict(entry) if entry else None
+
+    def matches(self, brief_id, etag=None, size=None):
+        """判断缓存是否与远端对象一致：优先比较 ETag，其次比较 Content-Length"""
+        entry = self.lookup(brief_id)
+        if not entry:
+            return False
+        if etag and entry.get("etag"):
+            return etag == entry["etag"]
+        return bool(size) and size == entry.get("size")
+
+    def link_into(self, brief_id, dest):
+        """把缓存的音频放入工作目录，成功返回文件大小，未命中返回 None"""
+        with self._lock:
+            entry = self._index.get(brief_id)
+            if entry:
+                entry["last_used"] = time.time()
+                self._changed.add(brief_id)
+                self._dirty = True
+        if not entry:
+            with self._lock:
+                self.misses += 1
+            return None
+        try:
+            link_or_copy(self._file(entry["file"]), dest)
+        except OSError as e:
+            logger.warning(f"[缓存] 读取简报缓存失败: {brief_id} - {e}")
+            self.discard(brief_id)
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += entry.get("size", 0)
+        return entry.get("size", 0)
+
+    def content_hash(self, brief_id):
+        """缓存音频内容的 sha256（首次计算后记入索引），没有缓存时返回 None"""
+        entry = self.lookup(brief_id)
+        if not entry:
+            return None
+        if entry.get("sha256"):
+            return entry["sha256"]
+        try:
+            digest = file_sha256(self._file(entry["file"]))
+        except OSError:
+            return None
+        with self._lock:
+            current = self._index.get(brief_id)
+            if current and current.get("file") == entry["file"]:
+                current["sha256"] = digest
+                self._changed.add(brief_id)
+                self._dirty = True
+        return digest
+
+    def store(self, brief_id, src, etag=None, audio_url=None):
+        """把刚下载的文件加入缓存（硬链接，不额外占用空间）"""
+        name = self._filename(brief_id)
+        tmp = self._file(f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            link_or_copy(src, tmp)
+            os.replace(tmp, self._file(name))
+        except OSError as e:
+            logger.warning(f"[缓存] 写入简报缓存失败: {brief_id} - {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        with self._lock:
+            self._index[brief_id] = {
+                "file": name,
+                "etag": etag,
+                "size": os.path.getsize(src),
+                "audio_url": audio_url,
+                "last_used": time.time(),
+            }
+            self._changed.add(brief_id)
+            self._removed.pop(brief_id, None)
+            self._dirty = True
+
+    def discard(self, brief_id):
+        """删除某条简报的缓存"""
+        with self._lock:
+            entry = self._index.pop(brief_id, None)
+            self._changed.discard(brief_id)
+            self._removed[brief_id] = time.time()
+            self._dirty = True
+        if entry:
+            try:
+                os.remove(self._file(entry["file"]))
+            except OSError:
+                pass
+
+    def _evict(self):
+        """总大小超过上限时按最近使用时间淘汰（调用方持有索引的文件锁）"""
+        total = sum(e.get("size", 0) for e in self._index.values())
+        if total <= self.max_bytes:
+            return
+        for brief_id, entry in sorted(self._index.items(), key=lambda kv: kv[1].get("last_used", 0)):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._file(entry["file"]))
+            except OSError:
+                pass
+            total -= entry.get("size", 0)
+            del self._index[brief_id]
+            logger.debug(f"[缓存] 淘汰简报缓存: {brief_id}")
+
+    def _merge(self, on_disk):
+        """把本进程的改动合并进磁盘上的索引：同一条简报以最近使用的记录为准"""
+        for brief_id, removed_at in self._removed.items():
+            entry = on_disk.get(brief_id)
+            if entry and entry.get("last_used", 0) <= removed_at:
+                del on_disk[brief_id]
+        for brief_id in self._changed:
+            ours = self._index.get(brief_id)
+            theirs = on_disk.get(brief_id)
+            if ours is None:
+                continue
+            if theirs is None or theirs.get("last_used", 0) <= ours.get("last_used", 0):
+                on_disk[brief_id] = ours
+            elif ours.get("sha256") and (theirs.get("etag"), theirs.get("size")) == (ours.get("etag"), ours.get("size")):
+                theirs.setdefault("sha256", ours["sha256"])
+        return on_disk
+
+    def save(self):
+        """
+        把索引写回磁盘：持有文件锁重新读取磁盘上的索引并合并本进程的改动，
+        其它进程在此期间写入的条目不会丢失；淘汰也在合并后的索引上进行，不会删除其它进程刚用过的文件
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            with file_lock(self.lock_file):
+                self._index = self._merge(self._load_index())
+                self._changed.clear()
+                self._removed.clear()
+                self._evict()
+                _atomic_write(self.index_file, json.dumps(self._index, ensure_ascii=False).encode("utf-8"))
+            self._dirty = False
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+Historical backfill
+
+Regenerates the episodes of every window in a date range, e.g. after the
+jingles or the bitrate changed. All windows are planned from a single fetch
+of briefs.json and its time index; the briefs of all pending windows are
+downloaded once (a brief that falls into several overlapping windows is
+fetched a single time) and their frame indexes are scanned once. Windows are
+then merged and uploaded in parallel on a bounded worker pool.
+
+Progress is recorded per window in a state file under .cache/backfill/, so an
+interrupted backfill picks up where it stopped when run again with the same
+arguments (--restart regenerates everything).
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from merge_mp3_briefs import (
+    CACHE_DIR, DEFAULT_BRIEFS_JSON_URL, MAX_DOWNLOAD_CONCURRENCY, MERGE_LOCK_PATH, download_daily_intro,
+    download_mp3_files, file_lock,
+    filter_briefs_by_time_range, generate_summary_text, get_brief_cache, get_download_engine, get_duplicate_index,
+    get_feed_index, get_oss_uploader, logger, merge_mp3_files, scan_mp3,
+)
+from brief_dedup import dedup_briefs
+from cron_merge_mp3_briefs import TZ_BEIJING, WINDOW_TIMES, window_boundaries, window_start
+from audio_cache import _atomic_write
+
+BACKFILL_DIR = os.path.join(CACHE_DIR, "backfill")  # 每次补跑的进度文件
+BACKFILL_LOCK_PATH = os.path.join(CACHE_DIR, "backfill.lock")  # 同一时间只允许一个补跑进程
+AUDIO_FILES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "audio_files")
+DEFAULT_WORKERS = 2  # 同时合并上传的窗口数
+
+
+def parse_schedule(text):
+    """解析 06:50,16:50 形式的窗口时间表（北京时间）"""
+    times = []
+    for item in text.split(","):
+        try:
+            hour, minute = (int(v) for v in item.strip().split(":"))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"无效的窗口时间: {item}（格式 HH:MM）")
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise argparse.ArgumentTypeError(f"无效的窗口时间: {item}")
+        times.append((hour, minute))
+    return sorted(set(times))
+
+
+def parse_date(text):
+    try:
+        return datetime.strptime(text, "%Y-%m-%d").date()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的日期: {text}（格式 YYYY-MM-DD）")
+
+
+def plan_windows(first_day, last_day, times=WINDOW_TIMES, window_hours=None):
+    """
+    first_day 到 last_day（含）之间结束的所有窗口，从早到晚，返回 [(开始, 结束), ...]
+    window_hours 为空时窗口从上一个窗口结束时开始（与定时任务相同），否则为结束前 window_hours 小时（窗口可以重叠）
+    """
+    after = datetime(first_day.year, first_day.month, first_day.day, tzinfo=TZ_BEIJING) - timedelta(seconds=1)
+    until = datetime(last_day.year, last_day.month, last_day.day, tzinfo=TZ_BEIJING) + timedelta(days=1, seconds=-1)
+    windows = []
+    for end in window_boundaries(after, until, times):
+        start = end - timedelta(hours=window_hours) if window_hours else window_start(end, times)
+        windows.append((start, end))
+    return windows
+
+
+def window_timestamp(end):
+    """输出文件名中的时间戳，与 merge_mp3_briefs 指定区间时的规则相同"""
+    return datetime.fromtimestamp(end.timestamp()).strftime("%Y%m%d-%H%M")
+
+
+class BackfillState:
+    """补跑进度：{"windows": {窗口结束时间: {status, briefs, output_file, oss_url, ...}}}，每个窗口完成后原子写入"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+        self.data.setdefault("windows", {})
+
+    def done(self, end):
+        return (self.data["windows"].get(end.isoformat()) or {}).get("status") in ("done", "empty")
+
+    def update(self, end, **entry):
+        with self._lock:
+            self.data["windows"][end.isoformat()] = entry
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            _atomic_write(self.path, json.dumps(self.data, ensure_ascii=False, indent=2).encode("utf-8"))
+
+
+def state_path(args):
+    """同样的参数对应同一个进度文件，中断后重新运行即可续跑"""
+    schedule = "_".join(f"{h:02d}{m:02d}" for h, m in args.schedule)
+    hours = f"-{args.window_hours}h" if args.window_hours else ""
+    return os.path.join(BACKFILL_DIR, f"{args.first_day}_{args.last_day}-{schedule}{hours}.json")
+
+
+def drop_duplicates(briefs, duplicates):
+    """去掉原简报也在 briefs 中的重复简报"""
+    ids = {b.id for b in briefs}
+    return [b for b in briefs if duplicates.get(b.id) not in ids]
+
+
+def keep_outputs(paths):
+    """把补跑的输出移入 audio_files/，持有合并锁，不与定时任务同时改写同名文件；返回移动后的路径"""
+    moved = []
+    with file_lock(MERGE_LOCK_PATH):
+        for path in paths:
+            dest = os.path.join(AUDIO_FILES_DIR, os.path.basename(path))
+            shutil.move(path, dest)
+            moved.append(dest)
+    return moved
+
+
+def merge_window(start, end, briefs, files, pool, intro_file, args, state, out_dir):
+    """
+    合并并上传一个窗口，结果记录到进度文件，返回是否成功
+    输出先写在补跑自己的 out_dir 中（文件名与定时任务相同），需要保留时才移入 audio_files/
+    """
+    label = f"{start.isoformat()} ~ {end.isoformat()}"
+    timestamp = window_timestamp(end)
+    output_file = os.path.join(out_dir, f"news-{timestamp}.mp3")
+    summary_file = os.path.join(out_dir, f"summary-{timestamp}.md")
+    work_files = [output_file, summary_file]
+    paths = [files[b.id] for b in briefs if b.id in files]
+    if not paths:
+        logger.warning(f"[补跑] {label}: 没有成功下载的简报")
+        state.update(end, status="failed", briefs=len(briefs), error="没有成功下载的简报")
+        return False
+    try:
+        generate_summary_text(briefs, summary_file)
+        if not merge_mp3_files(paths, output_file, intro_file, mode=args.merge_mode, jobs=args.jobs, pool=pool):
+            raise RuntimeError("合并失败")
+        oss_url = md_oss_url = None
+        uploader = None if args.no_upload else get_oss_uploader()
+        if uploader is not None:
+            oss_url, md_oss_url = uploader.upload_many([output_file, summary_file])
+            if not oss_url:
+                raise RuntimeError("OSS上传失败")
+        if oss_url and not args.keep_files:
+            output_file = None
+        else:
+            output_file, summary_file = keep_outputs(work_files)
+    except Exception as e:
+        logger.error(f"[补跑] {label}: {e}")
+        state.update(end, status="failed", briefs=len(briefs), error=str(e))
+        return False
+    finally:
+        for path in work_files:
+            if os.path.exists(path):
+                os.remove(path)
+    state.update(end, status="done", start=start.isoformat(), briefs=len(paths),
+                 output_file=output_file, oss_url=oss_url, summary_url=md_oss_url)
+    logger.info(f"[补跑] {label}: {len(paths)}条简报 -> {oss_url or output_file}")
+    return True
+
+
+def backfill(args):
+    """补跑 args.first_day 到 args.last_day 的所有窗口，返回 (成功数, 失败数)"""
+    windows = plan_windows(args.first_day, args.last_day, args.schedule, args.window_hours)
+    state = BackfillState(state_path(args))
+    pending = [(start, end) for start, end in windows if args.restart or not state.done(end)]
+    logger.info(f"[补跑] 共{len(windows)}个窗口，待处理{len(pending)}个，进度文件: {state.path}")
+    if not pending:
+        return 0, 0
+
+    # 只获取一次 briefs.json，所有窗口用同一个时间索引
+    feed_index = get_feed_index(args.url, use_snapshot=not args.no_cache)
+    if feed_index is None:
+        logger.error("获取简报数据失败")
+        return 0, len(pending)
+    plans = [(start, end, filter_briefs_by_time_range(feed_index, start.isoformat(), end.isoformat()))
+             for start, end in pending]
+    for start, end, briefs in plans:
+        logger.info(f"[补跑] {start.isoformat()} ~ {end.isoformat()}: {len(briefs)}条简报")
+    if args.dry_run:
+        return 0, 0
+
+    # 所有窗口的简报去重后只下载一次，窗口重叠时共用同一个文件
+    union = list({b.id: b for _, _, briefs in plans for b in briefs}.values())
+    os.makedirs(AUDIO_FILES_DIR, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix="news-audio-backfill-")
+    out_dir = os.path.join(work_dir, "episodes")
+    os.makedirs(out_dir)
+    engine = get_download_engine(args.max_concurrency)
+    succeeded = failed = 0
+    try:
+        # 去重和下载会写入与定时任务共用的简报缓存索引和重复记录，持有合并锁
+        with file_lock(MERGE_LOCK_PATH):
+            # 音频重复的简报只下载保留的那一条；重复的那条在同一窗口中被去掉，
+            # 原简报不在它的窗口时仍然保留，使用原简报下载的文件
+            duplicates = {}
+            if not args.no_dedup:
+                union, duplicates = dedup_briefs(union, engine, cache=None if args.no_cache else get_brief_cache(),
+                                                 index=get_duplicate_index())
+                plans = [(start, end, drop_duplicates(briefs, duplicates)) for start, end, briefs in plans]
+            mp3_files = download_mp3_files(union, work_dir, use_cache=not args.no_cache, engine=engine) if union else []
+        downloaded = set(mp3_files)
+        files = {}
+        for i, brief in enumerate(union):
+            path = os.path.join(work_dir, f"{i+1}-{brief.id}.mp3")
+            if path in downloaded:
+                files[brief.id] = path
+        for dup_id, kept_id in duplicates.items():
+            if kept_id in files:
+                files[dup_id] = files[kept_id]
+        # 帧索引只扫描一次，各窗口合并时共用
+        pool = {}
+        for path in mp3_files:
+            try:
+                pool[path] = scan_mp3(path)
+            except OSError:
+                pass
+        # 每日介绍按窗口所在日期各下载一次
+        intros = {}
+        if not args.skip_intro:
+            for day in sorted({end.astimezone(TZ_BEIJING).date() for _, end, _ in plans}):
+                when = datetime(day.year, day.month, day.day, 12, tzinfo=TZ_BEIJING)
+                intros[day] = download_daily_intro(work_dir, engine, when=when)
+
+        futures = {}
+        with ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="backfill") as executor:
+            for start, end, briefs in plans:
+                if not briefs:
+                    state.update(end, status="empty", start=start.isoformat(), briefs=0)
+                    continue
+                intro_file = intros.get(end.astimezone(TZ_BEIJING).date())
+                futures[executor.submit(merge_window, start, end, briefs, files, pool, intro_file, args, state,
+                                        out_dir)] = end
+            try:
+                for future in as_completed(futures):
+                    if future.result():
+                        succeeded += 1
+                    else:
+                        failed += 1
+            except KeyboardInterrupt:
+                # 已开始的窗口会完成并记录，其余的下次续跑
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    logger.info(f"[补跑] 完成: 成功{succeeded}个窗口，失败{failed}个")
+    return succeeded, failed
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Regenerate the episodes of every window in a date range.")
+    parser.add_argument("first_day", type=parse_date, help="First day (Beijing time), YYYY-MM-DD")
+    parser.add_argument("last_day", type=parse_date, help="Last day (Beijing time, inclusive), YYYY-MM-DD")
+    parser.add_argument(
+        "--schedule",
+        type=parse_schedule,
+        default=WINDOW_TIMES,
+        help="Comma-separated window end times in Beijing time (default: 06:50,16:50 as in the cron job)"
+    )
+    parser.add_argument(
+        "--window-hours",
+        type=float,
+        default=None,
+        help="Make each window this many hours long instead of starting at the previous window end "
+             "(windows may overlap; shared briefs are still downloaded once)"
+    )
+    parser.add_argument(
+        "--workers", "-w",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Windows merged and uploaded at the same time (default: {DEFAULT_WORKERS})"
+    )
+    parser.add_argument(
+        "--url", "-u",
+        type=str,
+        default=DEFAULT_BRIEFS_JSON_URL,
+        help=f"URL of the briefs.json file (default: {DEFAULT_BRIEFS_JSON_URL})"
+    )
+    parser.add_argument(
+        "--merge-mode",
+        choices=["auto", "copy", "reencode", "parallel"],
+        default="auto",
+        help="Merge mode, as in merge_mp3_briefs.py (default: auto)"
+    )
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        default=None,
+        help="Processes used by --merge-mode parallel for each window (default: number of CPUs)"
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=MAX_DOWNLOAD_CONCURRENCY,
+        help=f"Upper bound for the adaptive download concurrency (default: {MAX_DOWNLOAD_CONCURRENCY})"
+    )
+    parser.add_argument("--skip-intro", action="store_true", help="Do not prepend the daily intro")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the local brief audio cache")
+    parser.add_argument("--no-dedup", action="store_true",
+                        help="Keep briefs whose audio duplicates another brief of the same window")
+    parser.add_argument("--no-upload", action="store_true", help="Only write the episodes to audio_files/")
+    parser.add_argument("--keep-files", action="store_true", help="Keep uploaded episodes in audio_files/")
+    parser.add_argument("--restart", action="store_true", help="Ignore recorded progress and redo every window")
+    parser.add_argument("--dry-run", action="store_true", help="Only print the planned windows")
+    args = parser.parse_args(argv)
+    if args.last_day < args.first_day:
+        parser.error("last_day 早于 first_day")
+    if args.workers < 1:
+        parser.error("--workers 至少为 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    try:
+        with file_lock(BACKFILL_LOCK_PATH, blocking=False):
+            _, failed = backfill(args)
+    except BlockingIOError:
+        logger.error("[补跑] 已有补跑进程在运行，退出")
+        return 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+MP3 News Briefs Merger benchmark
+
+Generates a synthetic briefs.json of configurable size and silent TTS-like MP3
+segments, serves them from a local HTTP server with configurable latency and
+bandwidth (Range and ETag aware), swaps the OSS bucket for an in-memory
+stand-in, and times each stage of merge_mp3_briefs: feed fetch, index and
+filters, downloads, merges and upload. Results are written as JSON so runs of
+different versions can be compared with --compare.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mp3_frames import BITRATES, SAMPLE_RATES, parse_frame_header
+
+SEGMENT_POOL = 8  # 不同时长的合成音频数量，简报按 id 轮流使用
+SERVE_CHUNK = 16 * 1024  # 限速时每次写出的字节数
+
+
+def silent_frame(sample_rate=32000, channels=1, bitrate=128):
+    """构造一个 MPEG1 Layer III 静音帧（侧信息和主数据全为 0，解码结果为静音）"""
+    sample_rate_index = SAMPLE_RATES["1"].index(sample_rate)
+    bitrate_index = BITRATES[("1", 3)].index(bitrate)
+    channel_mode = 3 if channels == 1 else 0
+    header = bytes((0xFF, 0xFB, (bitrate_index << 4) | (sample_rate_index << 2), channel_mode << 6))
+    return header + b"\x00" * (parse_frame_header(header).frame_length - 4)
+
+
+def make_segment(path, seconds, sample_rate=32000, channels=1, bitrate=128):
+    """写入指定时长的静音MP3（与 TTS 输出相同的帧格式）"""
+    frame = silent_frame(sample_rate, channels, bitrate)
+    count = int(seconds * sample_rate / 1152) + 1
+    with open(path, "wb") as f:
+        f.write(frame * count)
+    return os.path.getsize(path)
+
+
+def generate_feed(count, base_url, span_hours=24.0, seed=1):
+    """生成 count 条简报，发布时间均匀分布在最近 span_hours 小时内，从新到旧排列"""
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    step = span_hours * 3600 / max(count, 1)
+    categories = ["科技", "财经", "国际", "社会", "体育"]
+    items = []
+    for i in range(count):
+        brief_id = f"bench-{i:08d}"
+        published = now - timedelta(seconds=60 + i * step)
+        items.append({
+            "id": brief_id,
+            "title": f"合成简报 {i}",
+            "brief": "这是一条用于性能测试的合成简报。" * rng.randint(1, 4),
+            "category": categories[i % len(categories)],
+            "source": "bench",
+            "publishedAt": published.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            "audioUrl": f"{base_url}/audio/{i % SEGMENT_POOL}/{brief_id}.mp3",
+            "url": f"https://example.com/{brief_id}",
+        })
+    return items
+
+
+class BenchServer:
+    """本地 HTTP 服务：提供 briefs.json 和合成音频，支持 Range、ETag、固定延迟和限速"""
+
+    def __init__(self, feed_bytes, segments, latency=0.0, bandwidth=None):
+        self.feed_bytes = feed_bytes
+        self.feed_etag = '"%s"' % hashlib.md5(feed_bytes).hexdigest()
+        self.segments = segments
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.requests = 0
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+        bench = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _body(self):
+                if self.path.split("?")[0] == "/briefs.json":
+                    return bench.feed_bytes, bench.feed_etag, "application/json"
+                parts = self.path.split("/")
+                if len(parts) == 4 and parts[1] == "audio" and parts[2].isdigit():
+                    data, etag = bench.segments[int(parts[2]) % len(bench.segments)]
+                    return data, etag, "audio/mpeg"
+                return None, None, None
+
+            def _respond(self, send_body):
+                with bench._lock:
+                    bench.requests += 1
+                if bench.latency:
+                    time.sleep(bench.latency)
+                data, etag, content_type = self._body()
+                if data is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("ETag", etag)
+                    self.end_headers()
+                    return
+                start, end, status = 0, len(data), 200
+                byte_range = self.headers.get("Range")
+                if byte_range and self.headers.get("If-Range", etag) == etag and byte_range.startswith("bytes="):
+                    first, _, last = byte_range[6:].partition("-")
+                    start = int(first)
+                    end = int(last) + 1 if last else len(data)
+                    status = 206
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(end - start))
+                self.send_header("ETag", etag)
+                self.send_header("Accept-Ranges", "bytes")
+                if status == 206:
+                    self.send_header("Content-Range", f"bytes {start}-{end - 1}/{len(data)}")
+                self.end_headers()
+                if send_body:
+                    self._send(memoryview(data)[start:end])
+
+            def _send(self, view):
+                if not bench.bandwidth:
+                    self.wfile.write(view)
+                else:
+                    for i in range(0, len(view), SERVE_CHUNK):
+                        chunk = view[i:i + SERVE_CHUNK]
+                        self.wfile.write(chunk)
+                        time.sleep(len(chunk) / bench.bandwidth)
+                with bench._lock:
+                    bench.bytes_sent += len(view)
+
+            def do_GET(self):
+                self._respond(True)
+
+            def do_HEAD(self):
+                self._respond(False)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeBucket:
+    """内存中的 OSS Bucket，实现 OssUploader 用到的接口"""
+
+    bucket_name = "bench"
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+        self._next_id = 0
+
+    def put_object_from_file(self, key, filename):
+        with open(filename, "rb") as f:
+            data = f.read()
+        with self._lock:
+            self.objects[key] = data
+            self.bytes_received += len(data)
+
+    def head_object(self, key):
+        return SimpleNamespace(content_length=len(self.objects[key]))
+
+    def init_multipart_upload(self, key):
+        with self._lock:
+            self._next_id += 1
+            upload_id = f"upload-{self._next_id}"
+            self.uploads[upload_id] = {}
+        return SimpleNamespace(upload_id=upload_id)
+
+    def upload_part(self, key, upload_id, part_number, data):
+        data = bytes(data)
+        with self._lock:
+            self.uploads[upload_id][part_number] = data
+            self.bytes_received += len(data)
+        return SimpleNamespace(etag=hashlib.md5(data).hexdigest())
+
+    def upload_part_copy(self, source_bucket, source_key, byte_range, key, upload_id, part_number):
+        data = self.objects[source_key][byte_range[0]:byte_range[1] + 1]
+        with self._lock:
+            self.uploads[upload_id][part_number] = data
+        return SimpleNamespace(etag=hashlib.md5(data).hexdigest())
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        with self._lock:
+            stored = self.uploads.pop(upload_id)
+            self.objects[key] = b"".join(stored[p.part_number] for p in parts)
+
+    def abort_multipart_upload(self, key, upload_id):
+        with self._lock:
+            self.uploads.pop(upload_id, None)
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    """进程峰值 RSS（MB）；Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节"""
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+class StageTimer:
+    """记录每个阶段的耗时、CPU时间、吞吐量和内存峰值"""
+
+    def __init__(self, trace_allocations=False):
+        self.trace_allocations = trace_allocations
+        self.stages = []
+        if trace_allocations:
+            tracemalloc.start()
+
+    def run(self, name, fn, items=None, nbytes=None):
+        if self.trace_allocations:
+            tracemalloc.reset_peak()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        value = fn()
+        wall = time.perf_counter() - wall
+        cpu = time.process_time() - cpu
+        if callable(items):
+            items = items(value)
+        if callable(nbytes):
+            nbytes = nbytes(value)
+        record = {
+            "stage": name,
+            "seconds": round(wall, 4),
+            "cpu_seconds": round(cpu, 4),
+            "items": items,
+            "items_per_second": round(items / wall, 1) if items and wall > 0 else None,
+            "bytes": nbytes,
+            "mb_per_second": round(nbytes / wall / 1024 / 1024, 2) if nbytes and wall > 0 else None,
+            "peak_rss_mb": peak_rss_mb(),
+            "children_peak_rss_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        }
+        if self.trace_allocations:
+            record["tracemalloc_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 2)
+        self.stages.append(record)
+        print(f"{name:<24} {wall:>9.3f}s  cpu {cpu:>8.3f}s  items {items if items is not None else '-':>8}  "
+              f"rss {record['peak_rss_mb']:>7} MB", file=sys.stderr)
+        return value
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_size(value):
+    """解析 500K、2M 之类的字节数"""
+    if value is None:
+        return None
+    value = value.strip().upper()
+    units = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
+def compare(results, baseline_file):
+    """与之前的结果逐阶段比较耗时"""
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = {s["stage"]: s for s in json.load(f)["stages"]}
+    print(f"\n与 {baseline_file} 比较:", file=sys.stderr)
+    for stage in results["stages"]:
+        old = baseline.get(stage["stage"])
+        if not old or not old["seconds"]:
+            continue
+        ratio = stage["seconds"] / old["seconds"]
+        flag = "  <-- 变慢" if ratio > 1.2 else ""
+        print(f"{stage['stage']:<24} {old['seconds']:>9.3f}s -> {stage['seconds']:>9.3f}s  x{ratio:.2f}{flag}",
+              file=sys.stderr)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the MP3 news briefs merger on synthetic data.")
+    parser.add_argument("--briefs", type=int, default=10000, help="Number of briefs in the synthetic feed (default: 10000)")
+    parser.add_argument("--window", type=int, default=40, help="Briefs inside the merge window (default: 40)")
+    parser.add_argument("--segment-seconds", type=float, default=30.0, help="Average brief duration in seconds (default: 30)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Server latency per request in seconds (default: 0.02)")
+    parser.add_argument("--bandwidth", type=str, default=None, help="Per-connection bandwidth, e.g. 2M (default: unlimited)")
+    parser.add_argument("--merge-modes", type=str, default="copy,reencode", help="Comma separated merge modes to time (default: copy,reencode)")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also record Python allocation peaks per stage (slower)")
+    parser.add_argument("--output", "-o", type=str, default=None, help="Result file (default: bench-<timestamp>.json)")
+    parser.add_argument("--compare", type=str, default=None, help="Previous result file to compare against")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory")
+    parser.add_argument("--verbose", "-v", action="store_true", help="Show the merger's own log output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    workdir = tempfile.mkdtemp(prefix="news-audio-bench-")
+    # 缓存目录在导入合并脚本时确定，必须先设置
+    os.environ["NEWS_AUDIO_CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.environ.setdefault("TQDM_DISABLE", "1")
+    import logging
+    import merge_mp3_briefs as merger
+    from oss_uploader import OssUploader
+    if not args.verbose:
+        logging.getLogger("news-audio").setLevel(logging.WARNING)
+
+    timer = StageTimer(args.tracemalloc)
+    server = None
+    try:
+        rng = random.Random(1)
+        segments = []
+        for i in range(SEGMENT_POOL):
+            path = os.path.join(workdir, f"segment-{i}.mp3")
+            make_segment(path, args.segment_seconds * rng.uniform(0.6, 1.4))
+            with open(path, "rb") as f:
+                data = f.read()
+            segments.append((data, '"%s"' % hashlib.md5(data).hexdigest()))
+
+        # 先起服务拿到端口，再生成指向它的 briefs.json
+        server = BenchServer(b"", segments, args.latency, parse_size(args.bandwidth)).start()
+        span_hours = 24.0 * max(1, args.briefs // 1000)
+        feed = timer.run("generate_feed", lambda: generate_feed(args.briefs, server.base_url, span_hours),
+                         items=args.briefs)
+        feed_bytes = json.dumps(feed, ensure_ascii=False).encode("utf-8")
+        server.feed_bytes = feed_bytes
+        server.feed_etag = '"%s"' % hashlib.md5(feed_bytes).hexdigest()
+        del feed
+        feed_url = f"{server.base_url}/briefs.json"
+
+        merger.get_download_engine()
+        data = timer.run("fetch_briefs_json", lambda: merger.fetch_briefs_json(feed_url),
+                         items=len, nbytes=len(feed_bytes))
+        merger._feed_data.clear()
+        data = timer.run("fetch_briefs_json_304", lambda: merger.fetch_briefs_json(feed_url), items=len)
+        index = timer.run("build_index", lambda: merger.BriefIndex(data), items=len(data))
+
+        window_hours = span_hours * args.window / max(args.briefs, 1)
+        hours = max(1, int(window_hours + 0.999))
+        timer.run("filter_briefs_by_time", lambda: merger.filter_briefs_by_time(index, hours), items=len)
+        end = datetime.now(timezone.utc)
+        start = end - timedelta(hours=window_hours)
+        briefs = timer.run("filter_briefs_by_time_range",
+                           lambda: merger.filter_briefs_by_time_range(index, start.isoformat(), end.isoformat()),
+                           items=len)
+        briefs = briefs[:args.window]
+
+        download_dir = os.path.join(workdir, "download")
+        os.makedirs(download_dir)
+        files = timer.run(
+            "download_mp3_files",
+            lambda: merger.download_mp3_files(briefs, download_dir),
+            items=len, nbytes=lambda paths: sum(os.path.getsize(p) for p in paths),
+        )
+        cached_dir = os.path.join(workdir, "download-cached")
+        os.makedirs(cached_dir)
+        timer.run("download_mp3_files_cached", lambda: merger.download_mp3_files(briefs, cached_dir), items=len)
+
+        output_file = None
+        for mode in [m.strip() for m in args.merge_modes.split(",") if m.strip()]:
+            output_file = os.path.join(workdir, f"episode-{mode}.mp3")
+            timer.run(f"merge_mp3_files[{mode}]",
+                      lambda: merger.merge_mp3_files(files, output_file, mode=mode),
+                      items=len(files), nbytes=lambda ok: os.path.getsize(output_file) if ok else None)
+
+        bucket = FakeBucket()
+        merger._oss_uploader = OssUploader("bench", "bench", "bench", "bench", "https://bench.invalid",
+                                           bucket=bucket)
+        if output_file and os.path.exists(output_file):
+            size = os.path.getsize(output_file)
+            timer.run("upload_to_oss", lambda: merger.upload_to_oss(output_file), items=1, nbytes=size)
+
+        results = {
+            "meta": {
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "git_revision": git_revision(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "args": vars(args),
+                "feed_bytes": len(feed_bytes),
+                "server_requests": server.requests,
+                "server_bytes_sent": server.bytes_sent,
+            },
+            "stages": timer.stages,
+        }
+        output = args.output or f"bench-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {output}", file=sys.stderr)
+        if args.compare:
+            compare(results, args.compare)
+        return results
+    finally:
+        if server:
+            server.stop()
+        if args.keep:
+            print(f"工作目录: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Brief deduplication
+
+The feed sometimes carries the same story more than once under different
+ids. Before anything is downloaded, briefs are collapsed when their audio is
+the same, judged by (cheapest first) a persistent map of duplicates found in
+earlier runs, the normalized audio URL, the ETag and content hash of audio
+already in the brief cache, and for uncached briefs the ETag / Content-MD5 of
+a HEAD request. Of each group the earliest published brief is kept.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import run_metrics
+from audio_cache import CACHE_DIR, _atomic_write, file_lock
+
+logger = logging.getLogger("news-audio")
+
+DUPLICATES_FILE = os.path.join(CACHE_DIR, "duplicates.json")
+KEEP_DUPLICATES = 5000  # 持久映射中最多保留的重复记录数
+# 签名URL中每次都会变化的参数，比较地址时忽略；x-oss-process 等参数会改变返回的内容，不能忽略
+SIGNING_PARAMS = {"expires", "ossaccesskeyid", "signature", "security-token"}
+OSS_SIGNING_PREFIXES = ("x-oss-signature", "x-oss-credential", "x-oss-date", "x-oss-expires",
+                        "x-oss-security-token", "x-oss-additional-headers")
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def normalize_audio_url(url):
+    """比较用的音频地址：协议和主机小写，去掉默认端口、片段、签名参数，其余查询参数排序"""
+    parts = urlsplit((url or "").strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+                   if k.lower() not in SIGNING_PARAMS and not k.lower().startswith(OSS_SIGNING_PREFIXES))
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+
+def normalize_etag(etag):
+    """去掉弱校验前缀和引号，大写（OSS 的 ETag 是大写的 MD5）"""
+    if not etag:
+        return None
+    etag = etag.strip()
+    if etag.startswith("W/"):
+        etag = etag[2:]
+    return etag.strip('"').upper() or None
+
+
+class DuplicateIndex:
+    """已知重复简报的持久映射：{重复的 id: {"of": 保留的 id, "by": 判定依据, "seen_at": 时间}}"""
+
+    def __init__(self, path=DUPLICATES_FILE):
+        self.path = path
+        self.lock_file = f"{path}.lock"
+        self._lock = threading.Lock()
+        self._changed = set()  # 上次保存后本进程记录的 id
+        self._entries = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, brief_id):
+        with self._lock:
+            entry = self._entries.get(brief_id)
+            return dict(entry) if entry else None
+
+    def record(self, brief_id, of, by):
+        with self._lock:
+            entry = self._entries.get(brief_id)
+            if entry and entry.get("of") == of:
+                return
+            self._entries[brief_id] = {"of": of, "by": by, "seen_at": time.time()}
+            self._changed.add(brief_id)
+
+    def save(self):
+        """
+        持有文件锁重新读取磁盘上的记录，合并本进程新记录的重复后写回（其它进程的记录不会丢失），
+        只保留最近的 KEEP_DUPLICATES 条
+        """
+        with self._lock:
+            if not self._changed:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with file_lock(self.lock_file):
+                entries = self._read()
+                entries.update((brief_id, self._entries[brief_id]) for brief_id in self._changed)
+                if len(entries) > KEEP_DUPLICATES:
+                    entries = dict(sorted(entries.items(), key=lambda kv: kv[1].get("seen_at", 0))[-KEEP_DUPLICATES:])
+                _atomic_write(self.path, json.dumps(entries, ensure_ascii=False, indent=2).encode("utf-8"))
+            self._entries = entries
+            self._changed.clear()
+
+
+def _probe(engine, brief):
+    """HEAD 请求音频，返回指纹列表；失败时返回空列表（按不重复处理）"""
+    try:
+        response = engine.head(brief.audio_url)
+        response.close()
+    except Exception as e:
+        logger.debug(f"[去重] HEAD 失败: {brief.audio_url} - {e}")
+        return []
+    if response.status_code >= 400:
+        return []
+    keys = []
+    etag = normalize_etag(response.headers.get("ETag"))
+    if etag:
+        keys.append(("etag", etag))
+    if response.headers.get("Content-MD5"):
+        keys.append(("md5", response.headers["Content-MD5"].strip()))
+    return keys
+
+
+def dedup_briefs(briefs, engine=None, cache=None, index=None, probe=True):
+    """
+    去掉音频重复的简报，返回 (保留的简报（原顺序）, {重复的 id: 保留的 id})
+    同一段音频保留最早发布的一条；probe=False 时不发送 HEAD 请求
+    发现的重复记录到 index（DuplicateIndex），以后的运行不必再请求
+    """
+    if len(briefs) < 2:
+        return list(briefs), {}
+    present = {b.id for b in briefs}
+    oldest_first = sorted(briefs, key=lambda b: b.published_date.timestamp() if b.published_date else 0)
+    duplicates = {}
+
+    # 已知的重复：保留的简报也在本次列表中时直接去掉
+    if index is not None:
+        for brief in oldest_first:
+            known = index.get(brief.id)
+            if known and known["of"] in present and known["of"] != brief.id and known["of"] not in duplicates:
+                duplicates[brief.id] = known["of"]
+
+    fingerprints = {}
+    unprobed = []
+    for brief in oldest_first:
+        if brief.id in duplicates:
+            continue
+        keys = [("url", normalize_audio_url(brief.audio_url))]
+        entry = cache.lookup(brief.id) if cache else None
+        if entry:
+            if normalize_etag(entry.get("etag")):
+                keys.append(("etag", normalize_etag(entry["etag"])))
+            digest = cache.content_hash(brief.id)
+            if digest:
+                keys.append(("sha256", digest))
+        else:
+            unprobed.append(brief)
+        fingerprints[brief.id] = keys
+
+    # 只剩一条待比较的简报时不必再发送 HEAD 请求
+    if probe and engine is not None and unprobed and len(fingerprints) > 1:
+        # 同一地址只请求一次（最早的那条），其余的按地址就能判定为重复
+        urls = {}
+        for brief in oldest_first:
+            if brief.id in fingerprints:
+                urls.setdefault(fingerprints[brief.id][0], brief)
+        targets = [b for b in unprobed if urls[fingerprints[b.id][0]] is b]
+        run_metrics.count("dedup_head_requests", len(targets))
+        for brief, keys in zip(targets, engine.map(lambda b: _probe(engine, b), targets, ok=lambda r: r is not None)):
+            fingerprints[brief.id] += keys or []
+
+    canonical = {}  # 指纹 -> 保留的简报 id
+    for brief in oldest_first:
+        keys = fingerprints.get(brief.id)
+        if keys is None:
+            continue
+        match = next(((canonical[key], key[0]) for key in keys if key in canonical), None)
+        if match:
+            duplicates[brief.id] = match[0]
+            if index is not None:
+                index.record(brief.id, match[0], match[1])
+            logger.info(f"[去重] {brief.title} ({brief.id}) 与 {match[0]} 的音频相同（{match[1]}），跳过")
+            continue
+        for key in keys:
+            canonical.setdefault(key, brief.id)
+
+    if index is not None:
+        try:
+            index.save()
+        except OSError as e:
+            logger.warning(f"[去重] 保存重复简报记录失败: {e}")
+    if duplicates:
+        logger.info(f"[去重] {len(briefs)}条简报中有{len(duplicates)}条重复")
+    return [b for b in briefs if b.id not in duplicates], duplicates
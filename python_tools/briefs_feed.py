@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+briefs.json feed helpers
+
+Keeps a parsed local snapshot of briefs.json in SQLite together with the
+ETag/Last-Modified validators of the last download, so unchanged feeds are
+answered with a 304 and loaded straight from disk. BriefIndex sorts the feed
+by publish time once so window queries are answered with bisect.
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import calendar
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+from audio_cache import CACHE_DIR
+
+logger = logging.getLogger("news-audio")
+
+
+def _parse_iso_fallback(value):
+    from dateutil import parser as dtparser
+    try:
+        dt = dtparser.parse(value)
+        if dt.tzinfo is None:
+            return calendar.timegm(dt.timetuple()) + dt.microsecond / 1e6
+        # 时区偏移超出 ±24 小时时 dateutil 能解析，但 timestamp() 会报错
+        return dt.timestamp()
+    except (ValueError, TypeError, OverflowError):
+        return None
+
+
+def parse_iso_timestamp(value):
+    """
+    把 ISO-8601 时间字符串解析为 UTC epoch 秒，无时区信息时按 UTC 处理
+    只按固定格式切片解析（YYYY-MM-DDTHH:MM:SS[.fff][Z|±HH:MM]），其它格式回退到 dateutil
+    """
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        if (len(value) < 19 or value[4] != "-" or value[7] != "-" or value[10] not in "Tt "
+                or value[13] != ":" or value[16] != ":"):
+            raise ValueError(value)
+        year, month, day = int(value[0:4]), int(value[5:7]), int(value[8:10])
+        hour, minute, second = int(value[11:13]), int(value[14:16]), int(value[17:19])
+        if not (1 <= month <= 12 and 1 <= day <= calendar.monthrange(year, month)[1]
+                and hour < 24 and minute < 60 and second < 60):
+            raise ValueError(value)
+        pos = 19
+        fraction = 0.0
+        if pos < len(value) and value[pos] in ".,":
+            end = pos + 1
+            while end < len(value) and value[end].isdigit():
+                end += 1
+            if end == pos + 1:
+                raise ValueError(value)
+            fraction = float("0." + value[pos + 1:end])
+            pos = end
+        zone = value[pos:]
+        if zone in ("", "Z", "z"):
+            offset = 0
+        elif zone[0] in "+-" and len(zone) in (3, 5, 6):
+            digits = zone[1:].replace(":", "")
+            if len(digits) not in (2, 4) or not digits.isdigit() or (len(zone) == 6 and zone[3] != ":"):
+                raise ValueError(value)
+            if int(digits[:2]) > 23 or int(digits[2:] or 0) > 59:
+                raise ValueError(value)
+            offset = int(digits[:2]) * 3600 + int(digits[2:] or 0) * 60
+            if zone[0] == "-":
+                offset = -offset
+        else:
+            raise ValueError(value)
+        return calendar.timegm((year, month, day, hour, minute, second)) - offset + fraction
+    except ValueError:
+        return _parse_iso_fallback(value)
+
+
+class BriefIndex:
+    """
+    按发布时间排序的简报索引
+    每条 publishedAt 只解析一次，epoch 存在紧凑数组中，时间区间查询用二分查找，
+    耗时与结果数量成正比，而不是与 briefs.json 的总条数成正比
+    """
+
+    def __init__(self, briefs_data):
+        parsed = []
+        self.invalid = 0
+        for pos, item in enumerate(briefs_data):
+            epoch = parse_iso_timestamp(item.get("publishedAt", "")) if isinstance(item, dict) else None
+            if epoch is None:
+                self.invalid += 1
+                continue
+            # 同一时间的简报保持 briefs.json 中的先后顺序
+            parsed.append((epoch, -pos, item))
+        parsed.sort(key=lambda x: (x[0], x[1]))
+        self.epochs = array("d", (p[0] for p in parsed))
+        self.items = [p[2] for p in parsed]
+        self.total = len(briefs_data)
+
+    def __len__(self):
+        return len(self.items)
+
+    def span(self, start_epoch, end_epoch, include_end=False):
+        """返回 [start, end)（include_end 时为 [start, end]）在排序数组中的下标区间"""
+        lo = bisect_left(self.epochs, start_epoch)
+        hi = bisect_right(self.epochs, end_epoch) if include_end else bisect_left(self.epochs, end_epoch)
+        return lo, max(lo, hi)
+
+    def query(self, start_epoch, end_epoch, include_end=False):
+        """返回区间内的 (epoch, 简报dict) 列表，按发布时间从新到旧排列"""
+        lo, hi = self.span(start_epoch, end_epoch, include_end)
+        return [(self.epochs[i], self.items[i]) for i in range(hi - 1, lo - 1, -1)]
+
+
+SNAPSHOT_SCHEMA = "2"  # 快照表结构版本，不一致时丢弃旧快照重新下载
+
+
+def _brief_key(item, data):
+    # 没有 id 和地址的条目按内容取键，不依赖在 briefs.json 中的位置；
+    # 数字 id 转成字符串，与从 TEXT 列读回的键一致
+    key = item.get("id") or item.get("audioUrl") or item.get("url")
+    return str(key) if key else "#" + hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+
+class BriefsSnapshot:
+    """briefs.json 的本地解析快照，按简报 id 增量更新"""
+
+    def __init__(self, url, cache_dir=None):
+        self.url = url
+        cache_dir = cache_dir or CACHE_DIR
+        os.makedirs(cache_dir, exist_ok=True)
+        name = hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+        self.path = os.path.join(cache_dir, f"feed-{name}.sqlite")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            if self._meta("schema") != SNAPSHOT_SCHEMA:
+                # 旧快照按位置排序，新条目插在开头会改写所有行；丢弃后下次完整下载
+                self._conn.execute("DROP TABLE IF EXISTS briefs")
+                self._conn.execute("DELETE FROM meta")
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('schema', ?)", (SNAPSHOT_SCHEMA,))
+            # published 是发布时间（epoch），与 id 一起决定读出顺序，新增简报不会改动其它行
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS briefs (id TEXT PRIMARY KEY, published REAL, data TEXT NOT NULL)"
+            )
+
+    def _meta(self, key):
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    @property
+    def etag(self):
+        with self._lock:
+            return self._meta("etag")
+
+    def validators(self):
+        """返回条件请求头（If-None-Match / If-Modified-Since），快照为空时返回空字典"""
+        with self._lock:
+            if self._meta("url") != self.url or self._meta("count") is None:
+                return {}
+            headers = {}
+            etag = self._meta("etag")
+            last_modified = self._meta("last_modified")
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+            return headers
+
+    def load(self):
+        """读出全部简报，按发布时间从新到旧（与 briefs.json 相同），同一时间按 id"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT data FROM briefs ORDER BY published IS NULL, published DESC, id"
+            ).fetchall()
+        # 拼成一个 JSON 数组一次解析，比逐条 json.loads 快得多
+        return json.loads("[" + ",".join(row[0] for row in rows) + "]")
+
+    def update(self, items, etag=None, last_modified=None):
+        """
+        用新下载的 briefs.json 更新快照：只写入新增和变化的条目，删除已下线的条目
+        返回 (新增数, 变化数, 删除数)
+        """
+        with self._lock, self._conn:
+            existing = dict(self._conn.execute("SELECT id, data FROM briefs"))
+            seen = {}
+            added = changed = 0
+            for item in items:
+                if not isinstance(item, dict):
+                    # 与 BriefIndex 一致：不是对象的条目无法使用，不写入快照
+                    continue
+                data = json.dumps(item, ensure_ascii=False, separators=(",", ":"))
+                key = _brief_key(item, data)
+                # 重复的 id 按出现次数区分
+                count = seen.get(key, 0)
+                seen[key] = count + 1
+                if count:
+                    key = f"{key}#{count}"
+                    seen[key] = 1
+                old = existing.get(key)
+                if old == data:
+                    continue
+                published = parse_iso_timestamp(item.get("publishedAt", ""))
+                if old is None:
+                    added += 1
+                else:
+                    changed += 1
+                self._conn.execute("INSERT OR REPLACE INTO briefs (id, published, data) VALUES (?, ?, ?)",
+                                   (key, published, data))
+            removed = [k for k in existing if k not in seen]
+            self._conn.executemany("DELETE FROM briefs WHERE id = ?", ((k,) for k in removed))
+            meta = {
+                "url": self.url,
+                "etag": etag or "",
+                "last_modified": last_modified or "",
+                "count": str(len(items)),
+            }
+            self._conn.executemany("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", meta.items())
+        return added, changed, len(removed)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,55 +1,163 @@
+import os
 import sys
+import json
 import time
+import argparse
 from datetime import datetime, timedelta, timezone
-from merge_mp3_briefs import main as merge_main
-import subprocess
-import os
+from merge_mp3_briefs import CACHE_DIR, file_lock, prefetch_briefs, run_merge
+
+# 每天两次：06:50 和 16:50（北京时间）
+WINDOW_TIMES = [(6, 50), (16, 50)]
+TZ_BEIJING = timezone(timedelta(hours=8))
+STATE_FILE = os.path.join(CACHE_DIR, "cron-state.json")  # 记录最近一次成功合并的窗口
+CRON_LOCK_PATH = os.path.join(CACHE_DIR, "cron.lock")  # 保证只有一个定时任务进程
+MAX_CATCHUP_WINDOWS = 4  # 启动时最多补跑的窗口数（两天）
+DEFAULT_POLL_INTERVAL = 300  # 预取模式下轮询 briefs.json 的间隔（秒）
+MIN_POLL_INTERVAL = 15  # 临近窗口结束时的最短轮询间隔（秒）
+
+
+def window_boundaries(after, until, times=WINDOW_TIMES):
+    """返回 (after, until] 之间的所有窗口结束时间，从早到晚；times 为每天的 (时, 分)，北京时间"""
+    boundaries = []
+    day = after.astimezone(TZ_BEIJING).date()
+    last_day = until.astimezone(TZ_BEIJING).date()
+    while day <= last_day:
+        for h, m in times:
+            t = datetime(day.year, day.month, day.day, h, m, tzinfo=TZ_BEIJING)
+            if after < t <= until:
+                boundaries.append(t)
+        day += timedelta(days=1)
+    return sorted(boundaries)
+
+
+def next_boundary(now):
+    """下一个窗口结束时间（严格晚于 now）"""
+    return window_boundaries(now, now + timedelta(days=2))[0]
 
-def run_once_and_schedule():
-    # 不再启动时立即合并一次，只设置定时任务
-    print(f"[定时任务] 启动定时任务: {datetime.now(timezone(timedelta(hours=8))).strftime('%Y-%m-%d %H:%M:%S')}")
 
+def window_start(end_dt, times=WINDOW_TIMES):
+    """窗口结束时间对应的开始时间，即上一个窗口结束时间"""
+    return window_boundaries(end_dt - timedelta(days=2), end_dt - timedelta(seconds=1), times)[-1]
 
-    # 每天两次：06:50 和 16:50（北京时间）
-    target_hours_minutes = [(6, 50), (16, 50)]
-    tz_beijing = timezone(timedelta(hours=8))
+
+def load_state():
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_FILE), exist_ok=True)
+    tmp = f"{STATE_FILE}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, STATE_FILE)
+
+
+def merge_window(end_dt, rolling=False, profile=None):
+    """合并以 end_dt 结束的窗口，成功后记录到状态文件"""
+    start_iso = window_start(end_dt).isoformat()
+    end_iso = end_dt.isoformat()
+    now = datetime.now(TZ_BEIJING)
+    print(f"[定时任务] 开始自动合并新闻音频: {now.strftime('%Y-%m-%d %H:%M:%S')} 合并区间: {start_iso} ~ {end_iso}")
+    try:
+        # 在本进程内合并：连接池、缓存、简报索引和 OSS 客户端在两次合并之间保持可用
+        result = run_merge(start=start_iso, end=end_iso, rolling=rolling, profile=profile)
+        if result["success"]:
+            save_state({"last_window_end": end_iso})
+            print(f"[定时任务] 合并任务完成: {datetime.now(TZ_BEIJING).strftime('%Y-%m-%d %H:%M:%S')}，"
+                  f"窗口结束后 {time.time() - end_dt.timestamp():.1f} 秒")
+        else:
+            print(f"[定时任务] 合并任务失败: {now.strftime('%Y-%m-%d %H:%M:%S')}", file=sys.stderr)
+    except Exception as e:
+        print(f"[定时任务] 合并任务异常: {e}", file=sys.stderr)
+
+
+def catch_up(rolling=False, profile=None):
+    """补跑停机期间错过的窗口（按状态文件中最近一次成功的窗口计算）"""
+    last = load_state().get("last_window_end")
+    if not last:
+        return
+    missed = window_boundaries(datetime.fromisoformat(last), datetime.now(TZ_BEIJING))
+    if not missed:
+        return
+    if len(missed) > MAX_CATCHUP_WINDOWS:
+        print(f"[定时任务] 错过 {len(missed)} 个窗口，只补跑最近 {MAX_CATCHUP_WINDOWS} 个")
+        missed = missed[-MAX_CATCHUP_WINDOWS:]
+    for end_dt in missed:
+        print(f"[定时任务] 补跑错过的窗口: {end_dt.isoformat()}")
+        merge_window(end_dt, rolling, profile)
+
+
+def wait_for_boundary(end_dt, prefetch=False, poll_interval=DEFAULT_POLL_INTERVAL, rolling=False):
+    """
+    等到窗口结束；预取模式下在等待期间轮询 briefs.json，把新发布的简报音频提前下载到缓存，
+    临近窗口结束时缩短轮询间隔，结束时只剩最后几条需要下载；rolling 时同时追加到滚动节目
+    """
+    start_epoch = window_start(end_dt).timestamp()
     while True:
-        now = datetime.now(tz_beijing)
-        now_seconds = now.hour * 3600 + now.minute * 60 + now.second
-        # 计算距离下一个目标时间的秒数
-        next_times = []
-        for h, m in target_hours_minutes:
-            t_seconds = h * 3600 + m * 60
-            if t_seconds > now_seconds:
-                next_times.append((t_seconds - now_seconds, h, m))
-        if not next_times:
-            # 今天的都过了，跳到明天的第一个
-            h, m = target_hours_minutes[0]
-            t_seconds = h * 3600 + m * 60
-            next_times.append((24 * 3600 - now_seconds + t_seconds, h, m))
-        sleep_seconds, next_h, next_m = min(next_times)
-        print(f"[定时任务] 距离下次合并还有 {sleep_seconds // 3600} 小时 {sleep_seconds % 3600 // 60} 分钟")
-        time.sleep(sleep_seconds)
-        # 计算合并区间
-        now = datetime.now(tz_beijing)
-        if next_h == 6 and next_m == 50:
-            # 合并前一天16:50到当天6:50
-            start_dt = (now - timedelta(days=1)).replace(hour=16, minute=50, second=0, microsecond=0)
-            end_dt = now.replace(hour=6, minute=50, second=0, microsecond=0)
+        remaining = end_dt.timestamp() - time.time()
+        if remaining <= 0:
+            return
+        if prefetch:
+            try:
+                prefetch_briefs(start_epoch, end_dt.timestamp(), rolling=rolling)
+            except Exception as e:
+                print(f"[定时任务] 预取异常: {e}", file=sys.stderr)
+            remaining = end_dt.timestamp() - time.time()
+            interval = poll_interval if remaining > 2 * poll_interval else max(MIN_POLL_INTERVAL, remaining / 2)
         else:
-            # 合并当天6:50到16:50
-            start_dt = now.replace(hour=6, minute=50, second=0, microsecond=0)
-            end_dt = now.replace(hour=16, minute=50, second=0, microsecond=0)
-        start_iso = start_dt.isoformat()
-        end_iso = end_dt.isoformat()
-        print(f"[定时任务] 开始自动合并新闻音频: {now.strftime('%Y-%m-%d %H:%M:%S')} 合并区间: {start_iso} ~ {end_iso}")
-        try:
-            # 通过命令行参数调用 main（兼容 argparse）
-            cmd = [sys.executable, os.path.join(os.path.dirname(__file__), "merge_mp3_briefs.py"), "--start", start_iso, "--end", end_iso]
-            ret = subprocess.run(cmd, check=True)
-            print(f"[定时任务] 合并任务完成: {now.strftime('%Y-%m-%d %H:%M:%S')}")
-        except Exception as e:
-            print(f"[定时任务] 合并任务异常: {e}", file=sys.stderr)
+            interval = remaining
+        time.sleep(max(0, min(interval, remaining)))
+
+
+def run_once_and_schedule(prefetch=False, poll_interval=DEFAULT_POLL_INTERVAL, rolling=False, profile=None):
+    # 不再启动时立即合并一次，只补跑错过的窗口并设置定时任务
+    print(f"[定时任务] 启动定时任务: {datetime.now(TZ_BEIJING).strftime('%Y-%m-%d %H:%M:%S')}"
+          f"{'（预取模式）' if prefetch else ''}")
+    catch_up(rolling, profile)
+    while True:
+        end_dt = next_boundary(datetime.now(TZ_BEIJING))
+        sleep_seconds = int(end_dt.timestamp() - time.time())
+        print(f"[定时任务] 距离下次合并还有 {sleep_seconds // 3600} 小时 {sleep_seconds % 3600 // 60} 分钟")
+        wait_for_boundary(end_dt, prefetch, poll_interval, rolling)
+        merge_window(end_dt, rolling, profile)
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Merge news briefs at 06:50 and 16:50 (Beijing time).")
+    parser.add_argument(
+        "--prefetch",
+        action="store_true",
+        help="Poll briefs.json during the window and download new briefs ahead of the boundary"
+    )
+    parser.add_argument(
+        "--rolling",
+        action="store_true",
+        help="Build each window as a rolling episode that only appends new briefs"
+    )
+    parser.add_argument(
+        "--poll-interval",
+        type=int,
+        default=DEFAULT_POLL_INTERVAL,
+        help=f"Seconds between briefs.json polls in prefetch mode (default: {DEFAULT_POLL_INTERVAL})"
+    )
+    parser.add_argument(
+        "--profile",
+        choices=["full", "sample"],
+        default=None,
+        help="Profile each merge (sample is cheap enough to leave enabled)"
+    )
+    return parser.parse_args(argv)
+
 
 if __name__ == "__main__":
-    run_once_and_schedule()
+    args = parse_arguments()
+    try:
+        with file_lock(CRON_LOCK_PATH, blocking=False):
+            run_once_and_schedule(args.prefetch, args.poll_interval, args.rolling, args.profile)
+    except BlockingIOError:
+        print("[定时任务] 已有定时任务在运行，退出", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Download engine
+
+An asyncio-driven downloader: a sliding window of in-flight requests over a
+pooled keep-alive requests.Session. The window grows and shrinks with observed
+latency and error rate (AIMD), and an optional token bucket caps the total
+bytes per second across all transfers. Single files are downloaded into a
+.part file, resumed with Range requests after connection errors, retried with
+jittered backoff and verified against Content-Length before being renamed.
+"""
+
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger("news-audio")
+
+CHUNK_SIZE = 64 * 1024
+MAX_RETRIES = 4  # 单个文件的最大重试次数
+BACKOFF_BASE = 1.0  # 退避基数（秒）
+BACKOFF_CAP = 30.0  # 单次退避上限（秒）
+RETRY_STATUS = (408, 429, 500, 502, 503, 504)
+
+# status: HTTP 状态码（200/206/304），或 "skipped"（skip_if 判定无需下载）
+DownloadResult = namedtuple("DownloadResult", "status size etag headers")
+
+
+class RetryableError(IOError):
+    """可以重试的下载错误（连接中断、长度不符、5xx 等）"""
+
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class RateLimiter:
+    """令牌桶限速，所有下载线程共享"""
+
+    def __init__(self, bytes_per_second, burst=None):
+        self.rate = float(bytes_per_second)
+        self.capacity = float(burst or max(bytes_per_second, CHUNK_SIZE))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """取走 amount 个字节的令牌，不足时阻塞等待"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= amount or self._tokens >= self.capacity:
+                    self._tokens -= amount
+                    return
+                wait = (amount - self._tokens) / self.rate
+            time.sleep(min(wait, 1.0))
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD 并发控制
+    连续成功且延迟正常时并发数 +1；延迟明显升高时 -1；出错时减半
+    """
+
+    def __init__(self, initial=2, minimum=1, maximum=8):
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.limit = min(max(initial, minimum), self.maximum)
+        self._baseline = None
+        self._ewma = None
+        self._successes = 0
+        self._lock = threading.Lock()
+
+    def record_latency(self, seconds):
+        """记录首字节延迟"""
+        with self._lock:
+            self._baseline = seconds if self._baseline is None else min(self._baseline, seconds)
+            self._ewma = seconds if self._ewma is None else 0.8 * self._ewma + 0.2 * seconds
+            if self._ewma > 3 * max(self._baseline, 0.05) and self.limit > self.minimum:
+                self.limit -= 1
+                self._ewma = self._baseline * 2
+                logger.debug(f"[下载] 延迟升高，并发数降为 {self.limit}")
+
+    def record_result(self, ok):
+        """记录一次下载结果"""
+        with self._lock:
+            if not ok:
+                self._successes = 0
+                if self.limit > self.minimum:
+                    self.limit = max(self.minimum, self.limit // 2)
+                    logger.debug(f"[下载] 出现错误，并发数降为 {self.limit}")
+                return
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.maximum:
+                self._successes = 0
+                self.limit += 1
+                logger.debug(f"[下载] 并发数升为 {self.limit}")
+
+
+class DownloadEngine:
+    """共享连接池的下载引擎，可在多次运行之间复用"""
+
+    def __init__(self, initial_concurrency=2, max_concurrency=8, bytes_per_second=None, timeout=60):
+        self.timeout = timeout
+        self.concurrency = AdaptiveConcurrency(initial_concurrency, 1, max_concurrency)
+        self.rate_limiter = RateLimiter(bytes_per_second) if bytes_per_second else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="download")
+        self.bytes_downloaded = 0
+        self._lock = threading.Lock()
+
+    def get(self, url, headers=None, stream=True, **kwargs):
+        """通过共享连接池发送 GET 请求，并记录首字节延迟"""
+        response = self.session.get(url, headers=headers, stream=stream, timeout=self.timeout, **kwargs)
+        self.concurrency.record_latency(response.elapsed.total_seconds())
+        return response
+
+    def head(self, url, headers=None, **kwargs):
+        """通过共享连接池发送 HEAD 请求"""
+        response = self.session.head(url, headers=headers, timeout=self.timeout, allow_redirects=True, **kwargs)
+        self.concurrency.record_latency(response.elapsed.total_seconds())
+        return response
+
+    def iter_content(self, response, chunk_size=CHUNK_SIZE):
+        """按块读取响应内容，受全局限速控制"""
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            if not chunk:
+                continue
+            if self.rate_limiter:
+                self.rate_limiter.consume(len(chunk))
+            with self._lock:
+                self.bytes_downloaded += len(chunk)
+            yield chunk
+
+    def download(self, url, path, headers=None, skip_if=None, desc=None, max_retries=MAX_RETRIES):
+        """
+        断点续传下载 url 到 path，返回 DownloadResult
+        先写入 path.part；连接中断时带 Range/If-Range 续传，按抖动指数退避重试；
+        校验 Content-Length 后原子改名为 path
+        headers 中的条件请求返回 304 时不写文件；skip_if(response) 为真时放弃下载
+        """
+        part = f"{path}.part"
+        if os.path.exists(part):
+            os.remove(part)
+        expected = None
+        etag = None
+        attempt = 0
+        while True:
+            offset = os.path.getsize(part) if os.path.exists(part) else 0
+            request_headers = dict(headers or {})
+            if offset:
+                # 续传时不再做条件请求，只按 ETag 保证续传的是同一个对象
+                request_headers.pop("If-None-Match", None)
+                request_headers.pop("If-Modified-Since", None)
+                request_headers["Range"] = f"bytes={offset}-"
+                if etag:
+                    request_headers["If-Range"] = etag
+            try:
+                response = self.get(url, headers=request_headers)
+                with response:
+                    if response.status_code == 304:
+                        return DownloadResult(304, 0, response.headers.get("ETag"), response.headers)
+                    if response.status_code in RETRY_STATUS:
+                        raise RetryableError(f"HTTP {response.status_code}")
+                    if response.status_code == 416 and offset and expected == offset:
+                        os.replace(part, path)
+                        return DownloadResult(200, offset, etag, response.headers)
+                    response.raise_for_status()
+                    if offset and response.status_code == 206:
+                        match = _CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+                        if not match or int(match.group(1)) != offset:
+                            os.remove(part)
+                            raise RetryableError("续传范围不匹配，重新下载")
+                        if match.group(3) != "*":
+                            expected = int(match.group(3))
+                        mode = "ab"
+                    else:
+                        if skip_if and skip_if(response):
+                            return DownloadResult("skipped", 0, response.headers.get("ETag"), response.headers)
+                        offset = 0
+                        length = response.headers.get("Content-Length")
+                        # 压缩传输时 Content-Length 是压缩后的大小，无法用于校验
+                        encoded = response.headers.get("Content-Encoding", "identity") != "identity"
+                        expected = int(length) if length and not encoded else None
+                        mode = "wb"
+                    etag = response.headers.get("ETag") or etag
+                    progress_bar = None
+                    if desc:
+                        from tqdm import tqdm
+                        progress_bar = tqdm(total=expected, initial=offset, unit="B", unit_scale=True, desc=desc)
+                    try:
+                        with open(part, mode) as f:
+                            for chunk in self.iter_content(response):
+                                f.write(chunk)
+                                if progress_bar:
+                                    progress_bar.update(len(chunk))
+                    finally:
+                        if progress_bar:
+                            progress_bar.close()
+                    size = os.path.getsize(part)
+                    if expected is not None and size != expected:
+                        raise RetryableError(f"文件不完整: {size}/{expected} 字节")
+                    os.replace(part, path)
+                    return DownloadResult(response.status_code, size, etag, response.headers)
+            except (RetryableError, requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                attempt += 1
+                if attempt > max_retries:
+                    if os.path.exists(part):
+                        os.remove(part)
+                    raise
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                received = os.path.getsize(part) if os.path.exists(part) else 0
+                logger.warning(f"[下载] {url} 第{attempt}/{max_retries}次重试（{delay:.1f}秒后），"
+                               f"已下载 {received} 字节: {e}")
+                time.sleep(delay)
+            except Exception:
+                if os.path.exists(part):
+                    os.remove(part)
+                raise
+
+    async def run_async(self, fn, *args):
+        """在下载线程池中执行 fn(*args)，供调用方自己的事件循环使用"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    async def _run_one(self, fn, index, item):
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._executor, fn, item)
+        except Exception as e:
+            logger.error(f"[下载] 任务异常: {e}")
+            result = None
+        return index, result
+
+    async def _map(self, fn, items, ok):
+        results = [None] * len(items)
+        pending = deque(enumerate(items))
+        running = set()
+        while pending or running:
+            # 滑动窗口：有空位就立即补上新的请求，而不是等整批完成
+            while pending and len(running) < self.concurrency.limit:
+                index, item = pending.popleft()
+                running.add(asyncio.ensure_future(self._run_one(fn, index, item)))
+            done, running = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                index, result = task.result()
+                results[index] = result
+                self.concurrency.record_result(result is not None and ok(result))
+        return results
+
+    def map(self, fn, items, ok=bool):
+        """
+        并发执行 fn(item)，按输入顺序返回结果
+        ok(result) 判断单次结果是否成功，用于调整并发数
+        """
+        items = list(items)
+        if not items:
+            return []
+        return asyncio.run(self._map(fn, items, ok))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
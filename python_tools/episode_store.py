@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Rolling episodes
+
+An episode under construction for one time window, kept on disk between
+runs. body.mp3 holds the raw frames of every brief added so far, appended in
+arrival order; manifest.json records which brief ids are included and where
+each one's frames live in the body. Adding new briefs only appends their
+frames. finalize() splices the segments in episode order (newest first) with
+the intro, typing separators and end jingle into a fresh output file, and
+records each brief's byte and frame offsets in that output.
+"""
+
+import os
+import json
+import shutil
+import logging
+
+import run_metrics
+from audio_cache import CACHE_DIR, _atomic_write
+from mp3_frames import Mp3FrameWriter, Mp3Info
+
+logger = logging.getLogger("news-audio")
+
+MANIFEST_VERSION = 1
+COMPACT_RATIO = 0.5  # 已移除片段占 body 的比例超过一半时压缩
+
+
+class RollingEpisode:
+    """按时间窗口持久保存的半成品节目：只追加新简报的帧，定稿时按节目顺序拼接"""
+
+    def __init__(self, key, store_dir=None):
+        self.key = key
+        self.dir = os.path.join(store_dir or os.path.join(CACHE_DIR, "episodes"), key)
+        self.body_path = os.path.join(self.dir, "body.mp3")
+        self.frames_path = os.path.join(self.dir, "body.frames.json")
+        self.manifest_path = os.path.join(self.dir, "manifest.json")
+        os.makedirs(self.dir, exist_ok=True)
+        self.manifest = self._load()
+        self._segments = {seg["id"]: seg for seg in self.manifest["segments"]}
+        self.pending = None  # 最近一次定稿的布局，上传成功后由 publish() 记入清单
+
+    def _empty(self):
+        return {"version": MANIFEST_VERSION, "key": self.key, "body_size": 0, "segments": [], "next_seq": 0,
+                "published": None}
+
+    def _load(self):
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            with open(self.frames_path, "r", encoding="utf-8") as f:
+                self.body = Mp3Info.from_dict(self.body_path, json.load(f))
+            if manifest.get("version") != MANIFEST_VERSION:
+                raise ValueError(manifest.get("version"))
+            # 上次追加后没来得及写清单时，body 末尾会多出未登记的字节，截掉即可
+            with open(self.body_path, "r+b") as f:
+                f.truncate(manifest["body_size"])
+            return manifest
+        except (OSError, ValueError, KeyError, TypeError):
+            if os.path.exists(self.manifest_path):
+                logger.warning(f"[滚动合并] 清单损坏，重新开始: {self.manifest_path}")
+            self.body = Mp3Info(self.body_path)
+            with open(self.body_path, "wb"):
+                pass
+            return self._empty()
+
+    @property
+    def template(self):
+        """body 的帧格式（Mp3Info），还没有内容时为 None"""
+        return self.body if self.body.header else None
+
+    @property
+    def segments(self):
+        return list(self.manifest["segments"])
+
+    def __contains__(self, brief_id):
+        return brief_id in self._segments
+
+    def __len__(self):
+        return len(self._segments)
+
+    def segment(self, brief_id):
+        return self._segments.get(brief_id)
+
+    def append(self, brief_id, info, **meta):
+        """
+        把 info 的全部音频帧追加到 body，并登记为 brief_id 的片段
+        meta 会原样写入清单（如 audio_url、etag、published_at）
+        """
+        if self.template and info.format_key != self.template.format_key:
+            raise ValueError(f"帧格式不一致，无法追加: {info}")
+        if brief_id in self._segments:
+            self.remove(brief_id)
+        if not self.body.header:
+            self.body.header = info.header
+        first_frame = self.body.frame_count
+        offset = self.manifest["body_size"]
+        position = offset
+        # 单条简报只有几百KB，整个读入后按帧切片
+        with open(info.path, "rb") as src:
+            data = src.read()
+        with open(self.body_path, "r+b") as body:
+            body.seek(offset)
+            for i in range(info.frame_count):
+                start, size = info.frame_offsets[i], info.frame_sizes[i]
+                if start + size > len(data):
+                    raise IOError(f"读取帧数据失败: {info.path}")
+                body.write(data[start:start + size])
+                self.body.frame_offsets.append(position)
+                self.body.frame_sizes.append(size)
+                position += size
+        self.body.bitrates.update(info.bitrates)
+        self.body.file_size = position
+        # seq 每次追加都不同，同一简报的音频被替换后也能与已发布的版本区分
+        seq = self.manifest.get("next_seq", 0)
+        self.manifest["next_seq"] = seq + 1
+        segment = dict(meta, id=brief_id, seq=seq, first_frame=first_frame, frame_count=info.frame_count,
+                       offset=offset, size=position - offset)
+        self.manifest["segments"].append(segment)
+        self.manifest["body_size"] = position
+        self._segments[brief_id] = segment
+        logger.info(f"[滚动合并] 追加片段 {brief_id}: {info.frame_count}帧")
+        return segment
+
+    def remove(self, brief_id):
+        """移除片段（帧数据留在 body 中，压缩时才真正删除）"""
+        segment = self._segments.pop(brief_id, None)
+        if segment:
+            self.manifest["segments"].remove(segment)
+            logger.info(f"[滚动合并] 移除片段 {brief_id}")
+        return segment
+
+    def save(self):
+        """先写帧索引再写清单；清单里的 body_size 决定哪些字节有效"""
+        if self.manifest["body_size"] > 0:
+            live = sum(seg["size"] for seg in self.manifest["segments"])
+            if live < self.manifest["body_size"] * COMPACT_RATIO:
+                self.compact()
+        _atomic_write(self.frames_path, json.dumps(self.body.to_dict()).encode("utf-8"))
+        _atomic_write(self.manifest_path, json.dumps(self.manifest, ensure_ascii=False).encode("utf-8"))
+
+    def compact(self):
+        """重写 body，只保留仍在清单中的片段"""
+        tmp = f"{self.body_path}.tmp"
+        body = Mp3Info(self.body_path)
+        body.header = self.body.header
+        position = 0
+        with open(self.body_path, "rb") as src, open(tmp, "wb") as dst:
+            for segment in self.manifest["segments"]:
+                src.seek(segment["offset"])
+                dst.write(src.read(segment["size"]))
+                first = segment["first_frame"]
+                segment["first_frame"] = body.frame_count
+                segment["offset"] = position
+                for i in range(first, first + segment["frame_count"]):
+                    body.frame_offsets.append(position)
+                    body.frame_sizes.append(self.body.frame_sizes[i])
+                    position += self.body.frame_sizes[i]
+        body.bitrates = set(self.body.bitrates)
+        body.file_size = position
+        os.replace(tmp, self.body_path)
+        self.body = body
+        self.manifest["body_size"] = position
+        logger.info(f"[滚动合并] 压缩 body: {len(self._segments)}个片段, {position} 字节")
+
+    def finalize(self, output_file, order, intro=None, typing=None, end=None):
+        """
+        按 order（简报 id 列表，节目顺序）拼接输出文件，简报之间插入打字音效
+        intro/typing/end 为与 body 同格式的 Mp3Info，可为 None
+        返回输出中每条简报的位置列表，并记为 pending；上传成功后调用 publish() 才写入清单
+        """
+        if not self.template:
+            raise ValueError("滚动节目为空，无法定稿")
+        writer = Mp3FrameWriter(output_file, self.template)
+        placed = []
+        try:
+            if intro:
+                writer.append(intro)
+            for brief_id in order:
+                segment = self._segments.get(brief_id)
+                if not segment:
+                    continue
+                if typing and placed:
+                    writer.append(typing)
+                first, count = writer.append(self.body, segment["first_frame"],
+                                             segment["first_frame"] + segment["frame_count"])
+                placed.append({
+                    "id": brief_id,
+                    "seq": segment.get("seq"),
+                    "frame": first,
+                    "frames": count,
+                    "offset": writer.byte_offset(first),
+                    "size": writer.byte_offset(first + count) - writer.byte_offset(first),
+                })
+            if not placed:
+                raise ValueError("滚动节目中没有可用的片段")
+            if end:
+                writer.append(end)
+            writer.close()
+        except Exception:
+            writer.abort()
+            raise
+        self.pending = {"output_file": output_file, "segments": placed}
+        run_metrics.set_value("output_duration_seconds", round(writer.duration, 3))
+        logger.info(f"[滚动合并] 定稿: {len(placed)}条简报, {writer.frame_count}帧, 时长 {writer.duration:.1f}秒")
+        return placed
+
+    def publish(self, **info):
+        """
+        最近一次定稿的输出已上传：把它的布局和 info（object_name、url、size 等）记为 published
+        上传失败时不调用，清单中仍是旧对象和旧对象的布局
+        """
+        if self.pending is None:
+            raise ValueError("没有待发布的定稿")
+        self.manifest["published"] = dict(self.pending, **info)
+        self.pending = None
+
+    def published_layout(self):
+        """已发布节目中的 {简报 id: 片段 seq}"""
+        return {seg["id"]: seg.get("seq") for seg in (self.manifest.get("published") or {}).get("segments", [])}
+
+    def discard(self):
+        """删除整个滚动节目"""
+        shutil.rmtree(self.dir, ignore_errors=True)
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+HLS packed-audio segmenter
+
+Splits a merged MP3 episode into HLS packed-audio segments (RFC 8216 §3.4)
+without decoding: segments are byte ranges of whole MP3 frames taken from
+the frame index, each prefixed with the ID3 PRIV timestamp tag that packed
+audio requires. Cuts are forced at brief boundaries, whose frame positions
+come from the merge step, so a player can jump to any brief by loading a
+single segment; long briefs are split evenly into segments no longer than
+the target duration. Writes index.m3u8 and chapters.json (brief id, title,
+start time and segment) next to the segments.
+"""
+
+import os
+import json
+import math
+import shutil
+import struct
+
+from mp3_frames import scan_mp3
+
+SEGMENT_SECONDS = 6.0  # 目标分段时长（秒）
+PLAYLIST_NAME = "index.m3u8"
+CHAPTERS_NAME = "chapters.json"
+PTS_CLOCK = 90000  # MPEG-2 时间戳时钟频率
+TIMESTAMP_OWNER = b"com.apple.streaming.transportStreamTimestamp"
+
+
+def _syncsafe(value):
+    return bytes(((value >> 21) & 0x7F, (value >> 14) & 0x7F, (value >> 7) & 0x7F, value & 0x7F))
+
+
+def id3_timestamp_tag(seconds):
+    """packed audio 分段开头的 ID3v2.4 标签，PRIV 帧中是 33 位 MPEG-2 时间戳（90kHz）"""
+    pts = int(round(seconds * PTS_CLOCK)) & ((1 << 33) - 1)
+    payload = TIMESTAMP_OWNER + b"\x00" + struct.pack(">Q", pts)
+    frame = b"PRIV" + _syncsafe(len(payload)) + b"\x00\x00" + payload
+    return b"ID3\x04\x00\x00" + _syncsafe(len(frame)) + frame
+
+
+def plan_segments(frame_count, cuts, frames_per_segment):
+    """
+    把 [0, frame_count) 帧分段：cuts（帧号）处必须切开，
+    两个切点之间按不超过 frames_per_segment 帧平均分成若干段
+    返回 [(起始帧, 结束帧), ...]
+    """
+    points = sorted({c for c in cuts if 0 < c < frame_count} | {0, frame_count})
+    segments = []
+    for start, end in zip(points, points[1:]):
+        count = -(-(end - start) // frames_per_segment)
+        for i in range(count):
+            segments.append((start + (end - start) * i // count, start + (end - start) * (i + 1) // count))
+    return segments
+
+
+def write_hls(episode_file, out_dir, chapters=None, segment_seconds=SEGMENT_SECONDS, name_prefix="segment"):
+    """
+    把 episode_file 切成 HLS 分段，写入 out_dir（原有内容会被替换）
+    chapters: [{"id", "title", "frame"}]，每条简报在输出中的起始帧号（不含 Xing 头帧）
+    返回 out_dir 中生成的文件列表，播放列表在第一个
+    """
+    info = scan_mp3(episode_file)
+    if not info.frame_count:
+        raise ValueError(f"没有可用的MP3帧: {episode_file}")
+    frame_seconds = info.header.samples / info.sample_rate
+    frames_per_segment = max(1, int(segment_seconds / frame_seconds))
+    chapters = sorted(chapters or [], key=lambda c: c["frame"])
+    segments = plan_segments(info.frame_count, [c["frame"] for c in chapters], frames_per_segment)
+
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    os.makedirs(out_dir)
+    files = []
+    lines = []
+    starts = []
+    with open(episode_file, "rb") as src:
+        for i, (first, end) in enumerate(segments):
+            name = f"{name_prefix}-{i:05d}.mp3"
+            offset = info.frame_offsets[first]
+            size = info.frame_offsets[end - 1] + info.frame_sizes[end - 1] - offset
+            src.seek(offset)
+            with open(os.path.join(out_dir, name), "wb") as dst:
+                dst.write(id3_timestamp_tag(first * frame_seconds))
+                dst.write(src.read(size))
+            files.append(os.path.join(out_dir, name))
+            starts.append(first)
+            title = next((c.get("title") or "" for c in chapters if c["frame"] == first), "")
+            lines.append(f"#EXTINF:{(end - first) * frame_seconds:.3f},{' '.join(title.split())}")
+            lines.append(name)
+
+    target = max(math.ceil((end - first) * frame_seconds) for first, end in segments)
+    playlist = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:3",
+        f"#EXT-X-TARGETDURATION:{target}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+    ] + lines + ["#EXT-X-ENDLIST", ""]
+    playlist_path = os.path.join(out_dir, PLAYLIST_NAME)
+    with open(playlist_path, "w", encoding="utf-8") as f:
+        f.write("\n".join(playlist))
+
+    chapters_path = os.path.join(out_dir, CHAPTERS_NAME)
+    with open(chapters_path, "w", encoding="utf-8") as f:
+        json.dump([
+            {
+                "id": c.get("id"),
+                "title": c.get("title"),
+                "start": round(c["frame"] * frame_seconds, 3),
+                "segment": starts.index(c["frame"]) if c["frame"] in starts else None,
+            }
+            for c in chapters
+        ], f, ensure_ascii=False, indent=2)
+    return [playlist_path, chapters_path] + files
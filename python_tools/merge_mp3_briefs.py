@@ -10,20 +10,24 @@ import os
 import sys
 import json
 import time
+import asyncio
 import argparse
 import tempfile
 import logging
 import subprocess
+import shutil
+import sqlite3
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from urllib.parse import urlparse
 from concurrent.futures import ThreadPoolExecutor
-import requests
-from dateutil import parser
-from tqdm import tqdm
-from pydub import AudioSegment
-import urllib.request
-import oss2  # 阿里云 OSS Python SDK
+from mp3_frames import Mp3FrameWriter, scan_mp3, validate_mp3
+from audio_cache import CACHE_DIR, AssetCache, BriefAudioCache, file_lock, file_sha256
+from briefs_feed import BriefIndex, BriefsSnapshot, parse_iso_timestamp
+from episode_store import RollingEpisode
+from hls_segmenter import write_hls
+from brief_dedup import DuplicateIndex, dedup_briefs
+import run_metrics
 
 # 配置日志输出
 logging.basicConfig(
@@ -41,7 +45,21 @@ if OSS_ENDPOINT and OSS_TEXT_BUCKET:
 else:
     DEFAULT_BRIEFS_JSON_URL = "https://oj-news-text-jp.oss-ap-northeast-1.aliyuncs.com/briefs.json"
 DEFAULT_TIMEOUT = 60  # 60秒
-MAX_WORKERS = 2  # 并行下载的最大线程数，适合于2核服务器
+MAX_WORKERS = 2  # 初始并发下载数，适合于2核服务器
+MAX_DOWNLOAD_CONCURRENCY = 6  # 自适应并发的上限
+PCM_SAMPLE_WIDTH = 2  # 重编码时使用 16bit PCM
+PCM_CHUNK_SIZE = 64 * 1024  # 写入编码管道的块大小
+LAME_ENCODER_DELAY = 1105  # ffmpeg libmp3lame 输出相对输入延后的采样数（编码器延迟 + 解码器延迟）
+PIPELINE_MAX_BUFFERED = 4  # 流水线合并时最多缓冲的已下载未合并简报数
+PARALLEL_BITRATE = "128k"  # 并行重编码的输出码率（与 ffmpeg libmp3lame 默认一致）
+PARALLEL_PREROLL_FRAMES = 4  # 分块编码时每块前后多编码的帧数，使编码器状态与整段编码一致
+PARALLEL_MIN_CHUNK_FRAMES = 256  # 每块至少的帧数（约 9 秒），块太小时预编码开销占比过高
+TYPING_AUDIO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "keyboard-typing.mp3")
+END_AUDIO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "end.mp3")
+MERGE_LOCK_PATH = os.path.join(CACHE_DIR, "merge.lock")  # 同一时间只允许一次合并
+QUARANTINE_DIR = os.path.join(CACHE_DIR, "quarantine")  # 重新下载后仍然损坏的简报音频
+QUARANTINE_KEEP = 50  # 隔离目录中最多保留的文件数
+METRICS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics")  # 运行指标，与 audio_files 同级
 
 # 每日介绍音频URL格式
 OSS_AUDIO_BUCKET = os.environ.get("OSS_AUDIO_BUCKET")
@@ -53,7 +71,7 @@ else:
 
 class Brief:
     """简报数据结构"""
-    def __init__(self, data):
+    def __init__(self, data, published_date=None):
         self.id = data.get("id", "")
         self.title = data.get("title", "")
         self.brief = data.get("brief", "")
@@ -64,17 +82,12 @@ class Brief:
         # 本地环境下修正音频URL（oss-ap-northeast-1-internal -> oss-ap-northeast-1）
         if self.audio_url and is_local_env():
             self.audio_url = self.audio_url.replace("oss-ap-northeast-1-internal", "oss-ap-northeast-1")
-        # 解析发布时间
-        try:
-            # 确保解析出的时间是UTC时区感知的
-            dt = parser.parse(self.published_at)
-            if dt.tzinfo is None:
-                # 如果时间没有时区信息，添加UTC时区
-                self.published_date = dt.replace(tzinfo=timezone.utc)
-            else:
-                self.published_date = dt
-        except (ValueError, TypeError):
-            self.published_date = None
+        # 解析发布时间（UTC时区感知；索引中已解析过时直接复用）
+        if published_date is None:
+            epoch = parse_iso_timestamp(self.published_at)
+            if epoch is not None:
+                published_date = datetime.fromtimestamp(epoch, timezone.utc)
+        self.published_date = published_date
     
     def is_valid(self):
         """检查简报是否有效"""
@@ -89,8 +102,8 @@ def is_local_env():
     return not os.environ.get("OSS_ENDPOINT")
 
 
-def parse_arguments():
-    """解析命令行参数"""
+def parse_arguments(argv=None):
+    """解析命令行参数（argv 为 None 时使用 sys.argv）"""
     parser = argparse.ArgumentParser(description="Download and merge MP3 news briefs.")
     parser.add_argument(
         "--hours", "-t", 
@@ -136,7 +149,98 @@ def parse_arguments():
         action="store_true", 
         help="Keep generated files in audio_files directory after processing"
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not use the local brief audio cache or briefs.json snapshot"
+    )
+    parser.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="Keep briefs whose audio duplicates another brief in the window "
+             "(by default they are dropped by normalized URL, ETag/Content-MD5 and content hash before downloading)"
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=MAX_DOWNLOAD_CONCURRENCY,
+        help=f"Upper bound of adaptive download concurrency (default: {MAX_DOWNLOAD_CONCURRENCY})"
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=str,
+        default=None,
+        help="Global download bandwidth limit in bytes/s, e.g. 500K or 2M (default: unlimited)"
+    )
+    parser.add_argument(
+        "--merge-mode",
+        choices=["auto", "copy", "reencode", "parallel"],
+        default="auto",
+        help="auto: frame-level copy when formats match, otherwise re-encode; "
+             "parallel: decode and encode on --jobs processes (default: auto)"
+    )
+    parser.add_argument(
+        "--rendition",
+        dest="renditions",
+        action="append",
+        type=parse_rendition,
+        default=None,
+        metavar="NAME:BITRATE:CHANNELS:CONTAINER",
+        help="Extra output rendition encoded from the same decode and uploaded in the same run, "
+             "e.g. mobile:48k:1:mp3 or web:96k:2:m4a (repeatable; containers: mp3, m4a, opus)"
+    )
+    parser.add_argument(
+        "--episode",
+        dest="episodes",
+        action="append",
+        type=parse_episode_definition,
+        default=None,
+        metavar="NAME:CATEGORIES[:ORDER]",
+        help="Extra per-category episode built alongside the full one from the same downloads, "
+             "e.g. economy:经济,财经 or tech:科技:oldest (repeatable; categories comma-separated, * for all; "
+             "order newest or oldest)"
+    )
+    parser.add_argument(
+        "--hls",
+        action="store_true",
+        help="Also publish an HLS packed-audio rendition (index.m3u8 + MP3 segments) cut on brief boundaries, "
+             "with a chapters.json for seeking to each brief"
+    )
+    parser.add_argument(
+        "--jobs", "-j",
+        type=int,
+        default=None,
+        help="Processes used by --merge-mode parallel (default: number of CPUs)"
+    )
+    parser.add_argument(
+        "--rolling",
+        action="store_true",
+        help="Keep a per-window episode on disk and only append briefs that are new since the last run (requires --start/--end)"
+    )
+    parser.add_argument(
+        "--delta",
+        action="store_true",
+        help="Update the already published rolling episode of the window: replace only corrected or withdrawn briefs (requires --start/--end)"
+    )
+    parser.add_argument(
+        "--no-pipeline",
+        action="store_true",
+        help="Download all briefs first and merge afterwards instead of merging while downloading"
+    )
+    parser.add_argument(
+        "--metrics-dir",
+        type=str,
+        default=METRICS_DIR,
+        help="Directory for the JSON run records and the node_exporter textfile (default: metrics/ next to audio_files/)"
+    )
+    parser.add_argument(
+        "--profile",
+        choices=["full", "sample"],
+        default=None,
+        help="Profile each stage: full = cProfile + tracemalloc per stage, sample = low-overhead stack sampling; "
+             "reports go to profile-<timestamp>/ next to the output"
+    )
+    return parser.parse_args(argv)
 
 
 def format_filesize(size_bytes):
@@ -149,13 +253,50 @@ def format_filesize(size_bytes):
         return f"{size_bytes/(1024*1024):.2f} MB"
 
 
-def fetch_briefs_json(url, timeout=DEFAULT_TIMEOUT):
-    """获取briefs.json文件"""
+_feed_snapshots = {}
+_feed_data = {}  # url -> (ETag, 简报列表)，常驻进程中跨运行复用
+_feed_indexes = {}  # url -> (简报列表, BriefIndex)
+
+
+def get_feed_snapshot(url):
+    """返回 briefs.json 的本地快照；缓存目录不可用时返回 None"""
+    if url not in _feed_snapshots:
+        try:
+            _feed_snapshots[url] = BriefsSnapshot(url)
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"[缓存] 简报快照不可用: {e}")
+            _feed_snapshots[url] = None
+    return _feed_snapshots[url]
+
+
+def fetch_briefs_json(url, timeout=DEFAULT_TIMEOUT, use_snapshot=True):
+    """
+    获取briefs.json文件
+    带 If-None-Match / If-Modified-Since 条件请求；未变化（304）时直接读取本地快照，
+    变化时只把新增和修改的条目合并进快照
+    """
+    import requests
+    from tqdm import tqdm
     logger.info(f"正在获取简报数据：{url}")
     start_time = time.time()
+    snapshot = get_feed_snapshot(url) if use_snapshot else None
     
     try:
-        response = requests.get(url, timeout=timeout, stream=True)
+        headers = snapshot.validators() if snapshot else {}
+        response = get_download_engine().session.get(url, timeout=timeout, stream=True, headers=headers)
+        if response.status_code == 304 and snapshot:
+            response.close()
+            run_metrics.count("feed_not_modified")
+            cached = _feed_data.get(url)
+            if cached and cached[0] == snapshot.etag:
+                # 常驻进程中 briefs.json 未变化时直接复用上次解析的结果
+                logger.info(f"简报数据未变化，复用内存中的数据：{len(cached[1])}条")
+                return cached[1]
+            briefs_data = snapshot.load()
+            _feed_data[url] = (snapshot.etag, briefs_data)
+            duration = time.time() - start_time
+            logger.info(f"简报数据未变化，使用本地快照：{len(briefs_data)}条，耗时：{duration:.2f}秒")
+            return briefs_data
         response.raise_for_status()
         
         # 获取总大小（如果有）
@@ -170,20 +311,30 @@ def fetch_briefs_json(url, timeout=DEFAULT_TIMEOUT):
                 unit_scale=True,
                 desc='下载简报数据'
             )
-        chunks = []
-        downloaded = 0
-        for chunk in response.iter_content(chunk_size=8192):
+        content = bytearray()
+        for chunk in response.iter_content(chunk_size=64 * 1024):
             if chunk:
-                chunks.append(chunk)
-                downloaded += len(chunk)
+                content += chunk
                 if progress_bar:
                     progress_bar.update(len(chunk))
         if progress_bar:
             progress_bar.close()
-        content = b''.join(chunks)
         duration = time.time() - start_time
-        logger.info(f"简报数据获取完成，大小：{format_filesize(downloaded)}，耗时：{duration:.2f}秒")
-        return json.loads(content)
+        logger.info(f"简报数据获取完成，大小：{format_filesize(len(content))}，耗时：{duration:.2f}秒")
+        run_metrics.count("feed_bytes", len(content))
+        briefs_data = json.loads(content)
+        if snapshot and isinstance(briefs_data, list):
+            try:
+                added, changed, removed = snapshot.update(
+                    briefs_data,
+                    etag=response.headers.get("ETag"),
+                    last_modified=response.headers.get("Last-Modified"),
+                )
+                logger.info(f"简报快照已更新：新增{added}条，修改{changed}条，删除{removed}条")
+                _feed_data[url] = (snapshot.etag, briefs_data)
+            except sqlite3.Error as e:
+                logger.warning(f"[缓存] 更新简报快照失败: {e}")
+        return briefs_data
     except requests.exceptions.HTTPError as e:
         logger.error(f"获取简报数据失败: HTTP错误 {e.response.status_code} - {e.response.reason}")
         logger.error(f"响应内容: {e.response.text}")
@@ -193,40 +344,44 @@ def fetch_briefs_json(url, timeout=DEFAULT_TIMEOUT):
         return None
 
 
+def get_feed_index(url, use_snapshot=True):
+    """获取 briefs.json 并按发布时间建立索引；数据未变化时复用上次建立的索引，失败返回 None"""
+    briefs_data = fetch_briefs_json(url, use_snapshot=use_snapshot)
+    if briefs_data is None:
+        return None
+    cached = _feed_indexes.get(url)
+    if cached and cached[0] is briefs_data:
+        return cached[1]
+    index = BriefIndex(briefs_data)
+    _feed_indexes[url] = (briefs_data, index)
+    return index
+
+
+def _as_index(briefs_data):
+    return briefs_data if isinstance(briefs_data, BriefIndex) else BriefIndex(briefs_data)
+
+
 def filter_briefs_by_time(briefs_data, hours):
-    """按时间过滤简报"""
+    """按时间过滤简报（briefs_data 可以是原始列表或 BriefIndex）"""
     now = datetime.now(timezone.utc)
     start_time = now - timedelta(hours=hours)
     
     logger.info(f"过滤{hours}小时内的简报 ({start_time.isoformat()} 到 {now.isoformat()})")
     
+    index = _as_index(briefs_data)
+    lo, hi = index.span(start_time.timestamp(), now.timestamp(), include_end=True)
     filtered_briefs = []
     skipped_count = {
-        "no_date": 0,
-        "too_old": 0,
-        "too_new": 0,
+        "no_date": index.invalid,
+        "too_old": lo,
+        "too_new": len(index) - hi,
         "no_audio": 0,
         "invalid": 0
     }
     
-    # 解析并过滤简报
-    for item in briefs_data:
-        brief = Brief(item)
-        
-        if not brief.published_date:
-            logger.debug(f"跳过无效日期的简报: {brief.title}")
-            skipped_count["no_date"] += 1
-            continue
-            
-        if brief.published_date < start_time:
-            logger.debug(f"跳过较早的简报: {brief.title} ({brief.published_date.isoformat()})")
-            skipped_count["too_old"] += 1
-            continue
-            
-        if brief.published_date > now:
-            logger.debug(f"跳过未来的简报: {brief.title} ({brief.published_date.isoformat()})")
-            skipped_count["too_new"] += 1
-            continue
+    # 只遍历时间窗口内的简报（已按发布时间从新到旧排列）
+    for epoch, item in index.query(start_time.timestamp(), now.timestamp(), include_end=True):
+        brief = Brief(item, datetime.fromtimestamp(epoch, timezone.utc))
             
         if not brief.audio_url:
             logger.debug(f"跳过无音频URL的简报: {brief.title}")
@@ -240,9 +395,6 @@ def filter_briefs_by_time(briefs_data, hours):
             
         filtered_briefs.append(brief)
     
-    # 按发布时间从新到旧排序
-    filtered_briefs.sort(key=lambda x: x.published_date, reverse=True)
-    
     logger.info(f"找到{len(filtered_briefs)}条符合条件的简报")
     logger.info(f"跳过的简报统计: 无日期={skipped_count['no_date']}, 太早={skipped_count['too_old']}, "
                 f"太新={skipped_count['too_new']}, 无音频={skipped_count['no_audio']}, "
@@ -256,69 +408,196 @@ def filter_briefs_by_time(briefs_data, hours):
 
 
 def filter_briefs_by_time_range(briefs_data, start_iso, end_iso):
-    """按时间区间过滤简报（ISO8601字符串，含时区）"""
-    from dateutil import parser as dtparser
-    start_dt = dtparser.parse(start_iso)
-    end_dt = dtparser.parse(end_iso)
-    filtered = []
-    for b in briefs_data:
-        try:
-            dt = dtparser.parse(b.get("publishedAt", ""))
-            if start_dt <= dt < end_dt:
-                filtered.append(b)
-        except Exception:
-            continue
-    return filtered
+    """按时间区间 [start, end) 过滤简报（ISO8601字符串，含时区），返回 Brief 列表，从新到旧"""
+    start_epoch = parse_iso_timestamp(start_iso)
+    end_epoch = parse_iso_timestamp(end_iso)
+    if start_epoch is None or end_epoch is None:
+        raise ValueError(f"无法解析时间区间: {start_iso} ~ {end_iso}")
+    index = _as_index(briefs_data)
+    return [Brief(item, datetime.fromtimestamp(epoch, timezone.utc))
+            for epoch, item in index.query(start_epoch, end_epoch)]
 
 
-def download_mp3_file(brief, index, total, temp_dir):
-    """下载单个MP3文件"""
+def download_mp3_file(brief, index, total, temp_dir, cache=None, engine=None):
+    """
+    下载单个MP3文件；缓存中有相同 ETag 的音频时直接链接到工作目录
+    下载后只解析帧头校验（不解码）：损坏或截断时丢弃缓存重新下载一次，仍然损坏则移入隔离目录并返回失败
+    返回 (文件路径, 大小, 是否成功, 远端 ETag)
+    """
     filename = f"{index+1}-{brief.id}.mp3"
     filepath = os.path.join(temp_dir, filename)
     
     logger.info(f"下载 {index+1}/{total}: {brief.title}")
     logger.info(f"音频URL: {brief.audio_url}")
     
+    engine = engine or get_download_engine()
     try:
-        start_time = time.time()
-        
-        # 发送请求获取文件
-        response = requests.get(brief.audio_url, stream=True, timeout=DEFAULT_TIMEOUT)
-        response.raise_for_status()
-        
-        # 获取文件大小
-        file_size = int(response.headers.get('content-length', 0))
-        
-        # 设置进度条
-        progress_bar = tqdm(
-            total=file_size,
-            unit='B',
-            unit_scale=True,
-            desc=f"下载 #{index+1}"
-        )
-        
-        # 分块下载
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
-                    progress_bar.update(len(chunk))
-        
-        progress_bar.close()
-        
-        duration = time.time() - start_time
-        download_speed = file_size / (duration * 1024 * 1024) if duration > 0 else 0
-        
-        logger.info(f"文件 {index+1}/{total} 下载完成，耗时: {duration:.2f}秒, "
-                   f"大小: {format_filesize(file_size)}, 速度: {download_speed:.2f} MB/s")
-        
-        return filepath, file_size, True
+        file_size, expected_size, etag = _fetch_mp3_file(brief, index, total, filepath, cache, engine)
+        with run_metrics.stage("validate"):
+            _, problems = validate_mp3(filepath, expected_size)
+        if problems:
+            logger.warning(f"[校验] {index+1}/{total} {brief.title} 音频损坏: {'；'.join(problems)}，重新下载")
+            run_metrics.count("validation_refetches")
+            if cache:
+                cache.discard(brief.id)
+            os.remove(filepath)
+            file_size, expected_size, etag = _fetch_mp3_file(brief, index, total, filepath, cache, engine)
+            with run_metrics.stage("validate"):
+                _, problems = validate_mp3(filepath, expected_size)
+            if problems:
+                logger.error(f"[校验] {index+1}/{total} {brief.title} 重新下载后仍然损坏: {'；'.join(problems)}")
+                if cache:
+                    cache.discard(brief.id)
+                quarantine_file(filepath, brief, problems)
+                return filepath, 0, False, None
+        return filepath, file_size, True, etag
     except Exception as e:
         logger.error(f"下载文件失败 {index+1}/{total}: {brief.title} - {str(e)}")
-        return filepath, 0, False
+        run_metrics.count("download_failures")
+        # 不在工作目录中留下不完整的文件
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        return filepath, 0, False, None
 
 
-def download_mp3_files(briefs, temp_dir):
+def quarantine_file(path, brief, problems):
+    """把损坏的简报音频移入隔离目录（附带原因），供排查；只保留最近 QUARANTINE_KEEP 个"""
+    run_metrics.count("quarantined")
+    try:
+        os.makedirs(QUARANTINE_DIR, exist_ok=True)
+        dest = os.path.join(QUARANTINE_DIR, f"{int(time.time())}-{brief.id}.mp3")
+        shutil.move(path, dest)
+        with open(f"{dest[:-4]}.json", "w", encoding="utf-8") as f:
+            json.dump({"id": brief.id, "title": brief.title, "audio_url": brief.audio_url,
+                       "published_at": brief.published_at, "problems": problems,
+                       "quarantined_at": datetime.now(timezone.utc).isoformat()}, f, ensure_ascii=False, indent=2)
+        logger.warning(f"[校验] 已隔离: {dest}")
+        files = sorted(f for f in os.listdir(QUARANTINE_DIR) if f.endswith(".mp3"))
+        for old in files[:-QUARANTINE_KEEP]:
+            for victim in (old, f"{old[:-4]}.json"):
+                try:
+                    os.remove(os.path.join(QUARANTINE_DIR, victim))
+                except OSError:
+                    pass
+    except OSError as e:
+        logger.warning(f"[校验] 隔离文件失败: {e}")
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _fetch_mp3_file(brief, index, total, filepath, cache, engine):
+    """
+    把简报音频放到 filepath（缓存命中时链接，否则下载），返回 (文件大小, 预期大小, 远端 ETag)
+    预期大小是缓存记录的大小或下载时校验过的 Content-Length，用于发现缓存文件被截断
+    """
+    start_time = time.time()
+    
+    # 有缓存时发送条件请求，未变化的音频只返回 304
+    headers = {}
+    entry = cache.lookup(brief.id) if cache else None
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    
+    def cache_matches(response):
+        return bool(entry) and cache.matches(brief.id, response.headers.get("ETag"),
+                                             int(response.headers.get("content-length", 0)))
+    
+    # 先删除旧文件，避免改写与缓存共享的硬链接
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    result = engine.download(brief.audio_url, filepath, headers=headers,
+                             skip_if=cache_matches, desc=f"下载 #{index+1}")
+    if result.status in (304, "skipped"):
+        file_size = cache.link_into(brief.id, filepath)
+        if file_size is not None:
+            logger.info(f"文件 {index+1}/{total} 命中缓存，大小: {format_filesize(file_size)}")
+            run_metrics.count("cache_hits")
+            run_metrics.count("cache_bytes_saved", file_size)
+            return file_size, entry.get("size") if entry else None, result.etag or (entry or {}).get("etag")
+        result = engine.download(brief.audio_url, filepath, desc=f"下载 #{index+1}")
+    file_size = result.size
+    run_metrics.count("download_bytes", file_size)
+    
+    if cache:
+        run_metrics.count("cache_misses")
+        cache.store(brief.id, filepath, etag=result.etag, audio_url=brief.audio_url)
+    
+    duration = time.time() - start_time
+    download_speed = file_size / (duration * 1024 * 1024) if duration > 0 else 0
+    
+    logger.info(f"文件 {index+1}/{total} 下载完成，耗时: {duration:.2f}秒, "
+               f"大小: {format_filesize(file_size)}, 速度: {download_speed:.2f} MB/s")
+    
+    return file_size, file_size, result.etag
+
+
+_brief_cache = None
+
+
+def get_brief_cache():
+    """返回进程内共享的简报音频缓存；缓存目录不可用时返回 None"""
+    global _brief_cache
+    if _brief_cache is None:
+        try:
+            _brief_cache = BriefAudioCache()
+        except OSError as e:
+            logger.warning(f"[缓存] 简报音频缓存不可用: {e}")
+            _brief_cache = False
+    return _brief_cache or None
+
+
+_duplicate_index = None
+
+
+def get_duplicate_index():
+    """返回进程内共享的重复简报记录"""
+    global _duplicate_index
+    if _duplicate_index is None:
+        _duplicate_index = DuplicateIndex()
+    return _duplicate_index
+
+
+_download_engines = {}  # (最大并发数, 限速) -> DownloadEngine
+_download_engine = None  # 最近一次按参数取得的引擎
+
+
+def get_download_engine(max_concurrency=None, bytes_per_second=None):
+    """
+    返回进程内共享的下载引擎（连接池在多次调用之间复用）
+    相同的最大并发数和限速共用一个引擎，参数不同时另建一个，不会沿用第一次调用的设置；
+    不指定 max_concurrency 时返回最近使用的引擎（还没有时按默认参数创建）
+    """
+    global _download_engine
+    if max_concurrency is None:
+        if _download_engine is not None:
+            return _download_engine
+        max_concurrency = MAX_DOWNLOAD_CONCURRENCY
+    key = (max_concurrency, bytes_per_second)
+    engine = _download_engines.get(key)
+    if engine is None:
+        from downloader import DownloadEngine
+        engine = _download_engines[key] = DownloadEngine(
+            initial_concurrency=MAX_WORKERS,
+            max_concurrency=max_concurrency,
+            bytes_per_second=bytes_per_second,
+            timeout=DEFAULT_TIMEOUT,
+        )
+    _download_engine = engine
+    return engine
+
+
+def parse_rate(value):
+    """解析限速参数，如 500K、2M、1048576（字节/秒）"""
+    if not value:
+        return None
+    units = {"K": 1024, "M": 1024 * 1024, "G": 1024 * 1024 * 1024}
+    value = value.strip().upper().rstrip("B").rstrip("/S")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(float(value))
+
+
+def download_mp3_files(briefs, temp_dir, use_cache=True, engine=None):
     """并行下载所有MP3文件"""
     if not briefs:
         logger.warning("没有找到符合条件的简报")
@@ -326,66 +605,27 @@ def download_mp3_files(briefs, temp_dir):
     
     logger.info(f"开始下载{len(briefs)}个MP3文件到临时目录: {temp_dir}")
     
-    # 存储下载结果
-    download_results = []
     total_size = 0
     success_count = 0
     fail_count = 0
     
     start_time = time.time()
+    cache = get_brief_cache() if use_cache else None
+    engine = engine or get_download_engine()
     
-    # 对于小数量文件，使用串行下载来减轻服务器压力
-    if len(briefs) <= 3:
-        logger.info("文件数量少，使用串行下载")
-        for i, brief in enumerate(briefs):
-            filepath, file_size, success = download_mp3_file(brief, i, len(briefs), temp_dir)
-            download_results.append((filepath, file_size, success))
-            
-            if success:
-                success_count += 1
-                total_size += file_size
-            else:
-                fail_count += 1
-                
-            # 每个下载之间添加短暂停顶，避免服务器压力突增
-            time.sleep(0.5)
-    else:
-        # 文件较多时，分批并行下载
-        logger.info(f"文件数量较多 ({len(briefs)})，使用分批并行下载")
-        
-        # 将文件分成多个批次，每批最多 MAX_WORKERS 个文件
-        batch_size = MAX_WORKERS
-        for batch_start in range(0, len(briefs), batch_size):
-            batch_end = min(batch_start + batch_size, len(briefs))
-            batch = briefs[batch_start:batch_end]
-            
-            logger.info(f"处理批次 {batch_start//batch_size + 1}/{(len(briefs) + batch_size - 1)//batch_size}: "
-                       f"文件 {batch_start+1}-{batch_end} / {len(briefs)}")
-            
-            # 并行处理当前批次
-            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-                futures = []
-                for i, brief in enumerate(batch):
-                    # 计算全局索引
-                    global_idx = batch_start + i
-                    future = executor.submit(download_mp3_file, brief, global_idx, len(briefs), temp_dir)
-                    futures.append(future)
-                
-                # 收集当前批次的结果
-                for future in futures:
-                    filepath, file_size, success = future.result()
-                    download_results.append((filepath, file_size, success))
-                    
-                    if success:
-                        success_count += 1
-                        total_size += file_size
-                    else:
-                        fail_count += 1
-            
-            # 批次之间添加间隔，给服务器休息时间
-            if batch_end < len(briefs):
-                logger.info(f"批次间休息 1 秒")
-                time.sleep(1)
+    # 滑动窗口并发下载：连接池复用，并发数随延迟和错误率自动调整
+    download_results = engine.map(
+        lambda job: download_mp3_file(job[1], job[0], len(briefs), temp_dir, cache, engine),
+        enumerate(briefs),
+        ok=lambda result: result[2],
+    )
+    download_results = [r if r else (None, 0, False, None) for r in download_results]
+    for filepath, file_size, success, _ in download_results:
+        if success:
+            success_count += 1
+            total_size += file_size
+        else:
+            fail_count += 1
     
     # 过滤出成功下载的文件
     successful_files = [result[0] for result in download_results if result[2]]
@@ -399,78 +639,1253 @@ def download_mp3_files(briefs, temp_dir):
     logger.info(f"总大小: {format_filesize(total_size)}")
     logger.info(f"总耗时: {total_duration:.2f}秒")
     logger.info(f"平均下载速度: {avg_speed:.2f} MB/s")
+    logger.info(f"当前并发数: {engine.concurrency.limit}")
+    if cache:
+        logger.info(f"缓存命中: {cache.hits}, 节省流量: {format_filesize(cache.bytes_saved)}")
+        try:
+            cache.save()
+        except OSError as e:
+            logger.warning(f"[缓存] 保存简报缓存索引失败: {e}")
     
     return successful_files
 
 
-def download_daily_intro(temp_dir):
-    """下载每日介绍音频"""
-    now = datetime.now(timezone.utc)
+def prefetch_briefs(start_epoch, end_epoch, url=DEFAULT_BRIEFS_JSON_URL, engine=None, rolling=False):
+    """
+    预取时间区间内新发布的简报音频到本地缓存（定时任务在窗口期间调用）
+    已在缓存中的简报不再请求，正式合并时只需条件请求确认未变化
+    rolling 时直接追加到该窗口的滚动节目，窗口结束时只剩定稿
+    返回本次新缓存（或追加）的简报数
+    """
+    cache = get_brief_cache()
+    if cache is None:
+        return 0
+    feed_index = get_feed_index(url)
+    if feed_index is None:
+        return 0
+    briefs = [Brief(item, datetime.fromtimestamp(epoch, timezone.utc))
+              for epoch, item in feed_index.query(start_epoch, end_epoch)]
+    if rolling:
+        scratch_dir = tempfile.mkdtemp(prefix="news-audio-prefetch-")
+        try:
+            with file_lock(MERGE_LOCK_PATH):
+                episode = RollingEpisode(rolling_episode_key(start_epoch, end_epoch))
+                appended = update_rolling_episode(episode, [b for b in briefs if b.is_valid()],
+                                                  scratch_dir, engine=engine)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+        logger.info(f"[预取] 窗口内{len(briefs)}条简报，滚动节目新增{appended}条")
+        return appended
+    pending = [b for b in briefs if b.is_valid() and cache.lookup(b.id) is None]
+    if not pending:
+        logger.info(f"[预取] 窗口内{len(briefs)}条简报均已缓存")
+        return 0
+    engine = engine or get_download_engine()
+    scratch_dir = tempfile.mkdtemp(prefix="news-audio-prefetch-")
+    try:
+        results = engine.map(
+            lambda job: download_mp3_file(job[1], job[0], len(pending), scratch_dir, cache, engine),
+            list(enumerate(pending)),
+            ok=lambda r: r[2],
+        )
+        fetched = [r[0] for r in results if r and r[2]]
+        # 顺便按简报的帧格式准备好转码后的音效，合并时直接命中素材缓存
+        if fetched:
+            template = scan_mp3(fetched[0])
+            if template.frame_count:
+                for path, name in ((TYPING_AUDIO_PATH, "typing"), (END_AUDIO_PATH, "end")):
+                    if os.path.exists(path):
+                        load_asset_frames(path, template, name)
+    finally:
+        for name in os.listdir(scratch_dir):
+            os.remove(os.path.join(scratch_dir, name))
+        os.rmdir(scratch_dir)
+        cache.save()
+    logger.info(f"[预取] 窗口内{len(briefs)}条简报，新缓存{len(fetched)}条")
+    return len(fetched)
+
+
+def download_daily_intro(temp_dir, engine=None, when=None):
+    """下载每日介绍音频（与简报共用下载引擎和连接池）；when 指定哪一天的介绍（补跑历史节目），默认今天"""
+    now = when.astimezone(timezone.utc) if when else datetime.now(timezone.utc)
     # 转换为北京时间 (UTC+8)
     beijing_time = now + timedelta(hours=8)
     date_str = beijing_time.strftime("%Y%m%d")
     
     # 构建介绍音频URL
     intro_url = DAILY_INTRO_URL_TEMPLATE.format(date=date_str)
-    intro_file = os.path.join(temp_dir, "daily-intro.mp3")
+    intro_file = os.path.join(temp_dir, f"daily-intro-{date_str}.mp3" if when else "daily-intro.mp3")
+    engine = engine or get_download_engine()
     
     logger.info(f"尝试下载每日介绍音频: {intro_url}")
+    with run_metrics.stage("intro"):
+        try:
+            # 下载文件
+            engine.download(intro_url, intro_file)
+            logger.info(f"每日介绍音频下载成功: {intro_file}")
+            return intro_file
+        except Exception as e:
+            logger.warning(f"下载每日介绍音频失败: {str(e)}")
+            return None
+
+
+def ffmpeg_binary():
+    """ffmpeg 可执行文件路径（与 pydub 使用同一个；首次调用时才导入 pydub）"""
+    from pydub import AudioSegment
+    return AudioSegment.converter
+
+
+def conform_mp3(src, template, dest):
+    """
+    把音频转码成与 template（Mp3Info）相同的帧格式，供帧级拼接使用
+    只用于片头、音效等短素材，成功返回 True
+    """
+    header = template.header
+    bitrate = max(template.bitrates) if template.bitrates else 128
+    cmd = [
+        ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y",
+        "-i", src,
+        "-vn", "-map_metadata", "-1",
+        "-ar", str(header.sample_rate),
+        "-ac", str(header.channels),
+        "-codec:a", "libmp3lame",
+        "-b:a", f"{bitrate}k",
+        "-write_xing", "0",
+        "-id3v2_version", "0",
+        "-f", "mp3", dest,
+    ]
     try:
-        # 下载文件
-        urllib.request.urlretrieve(intro_url, intro_file)
-        logger.info(f"每日介绍音频下载成功: {intro_file}")
-        return intro_file
-    except Exception as e:
-        logger.warning(f"下载每日介绍音频失败: {str(e)}")
-        return None
+        subprocess.run(cmd, check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        stderr = getattr(e, "stderr", b"") or b""
+        logger.warning(f"[合并] 素材格式转换失败: {src}, 错误: {e} {stderr.decode(errors='ignore').strip()}")
+        return False
+    return True
+
+
+_asset_cache = None
+
+
+def get_asset_cache():
+    """返回进程内共享的素材缓存；缓存目录不可用时返回 None"""
+    global _asset_cache
+    if _asset_cache is None:
+        try:
+            _asset_cache = AssetCache()
+        except OSError as e:
+            logger.warning(f"[缓存] 素材缓存不可用: {e}")
+            _asset_cache = False
+    return _asset_cache or None
+
+
+def load_asset_frames(path, template, name):
+    """
+    读取素材（片头、打字音效、结尾）的帧索引
+    格式与 template 不一致时使用转码后的版本，帧索引和转码结果都按内容哈希缓存
+    """
+    cache = get_asset_cache()
+    digest = file_sha256(path) if cache else None
+    info = cache.frame_index(path, digest) if cache else scan_mp3(path)
+    if info.format_key == template.format_key and info.frame_count:
+        return info
+    logger.info(f"[合并] {name} 格式与新闻音频不一致，转码后拼接: {info}")
+    header = template.header
+    bitrate = max(template.bitrates) if template.bitrates else 128
+    variant = f"mpeg{header.version}-l{header.layer}-{header.sample_rate}-{header.channels}-{bitrate}k.mp3"
+    if cache:
+        conformed = cache.get_or_create(
+            path, variant, lambda src, dest: conform_mp3(src, template, dest), digest
+        )
+        info = cache.frame_index(conformed, f"{digest}-{variant}") if conformed else None
+    else:
+        conformed = os.path.join(tempfile.gettempdir(), f"news-audio-{name}-{variant}")
+        info = scan_mp3(conformed) if conform_mp3(path, template, conformed) else None
+    if info and info.format_key == template.format_key and info.frame_count:
+        return info
+    logger.warning(f"[合并] 素材无法转换为相同格式，跳过: {path}")
+    return None
+
+
+def load_asset_pcm(path, sample_rate, channels):
+    """解码素材为 PCM，结果按内容哈希缓存，避免每次运行都启动 ffmpeg 解码"""
+    cache = get_asset_cache()
+    if not cache:
+        return decode_mp3_to_pcm(path, sample_rate, channels)
+
+    def produce(src, dest):
+        with open(dest, "wb") as f:
+            f.write(decode_mp3_to_pcm(src, sample_rate, channels))
+
+    cached = cache.get_or_create(path, f"pcm-s16le-{sample_rate}-{channels}.raw", produce)
+    with open(cached, "rb") as f:
+        return f.read()
+
+
+def conform_to_template(info, template, work_dir):
+    """把格式不一致的新闻音频转码成 template 的帧格式，返回转码后文件的 Mp3Info，失败返回 None"""
+    conformed = os.path.join(work_dir, f"conformed-{os.path.basename(info.path)}")
+    if conform_mp3(info.path, template, conformed):
+        info = scan_mp3(conformed)
+        if info.format_key == template.format_key and info.frame_count:
+            return info
+    logger.error(f"[合并] 跳过无法转换格式的文件: {info.path}")
+    return None
+
+
+class FrameCopyEpisode:
+    """
+    逐条追加的帧级拼接输出：不解码、不重编码，直接复制MP3帧，结束时写入新的 Xing/Info 头
+    片头、打字音效、结尾音频格式不一致时使用缓存的转码版本；
+    指定 conform_dir 时，格式不一致的新闻音频也会单独转码成相同格式再拼接
+    """
+
+    def __init__(self, output_file, template, typing_path=None, end_path=None, conform_dir=None):
+        if template.header is None or template.header.layer != 3:
+            raise ValueError(f"不支持的帧格式，无法帧级拼接: {template}")
+        self.output_file = output_file
+        self.template = template
+        self.conform_dir = conform_dir
+        self.end_path = end_path
+        self.typing_path = typing_path
+        self.typing = self._load_asset(typing_path, "typing")
+        self.count = 0
+        self.placed = []  # 每条新闻音频在输出中的起始帧号
+        self.writer = Mp3FrameWriter(output_file, template)
+
+    def _load_asset(self, path, name):
+        if not path or not os.path.exists(path):
+            return None
+        return load_asset_frames(path, self.template, name)
+
+    @property
+    def duration(self):
+        return self.writer.duration
+
+    def add_intro(self, path):
+        """在开头插入每日介绍"""
+        info = self._load_asset(path, "intro")
+        if info:
+            self.writer.append(info)
+            logger.info(f"[合并] 插入每日介绍: {path}")
+
+    def add_brief(self, path, index=None, info=None):
+        """追加一条新闻音频（简报之间自动插入打字音效），成功返回 True"""
+        label = f"第{index+1}条" if index is not None else os.path.basename(path)
+        try:
+            info = info or scan_mp3(path)
+        except OSError as e:
+            logger.error(f"[合并] 跳过损坏文件: {path}, 错误: {e}")
+            run_metrics.count("merge_skipped")
+            return False
+        if not info.frame_count:
+            logger.error(f"[合并] 跳过损坏文件: {path}, 错误: 未找到有效的MP3帧")
+            run_metrics.count("merge_skipped")
+            return False
+        if info.format_key != self.template.format_key or not info.copy_safe:
+            if not self.conform_dir:
+                logger.error(f"[合并] 格式不一致，无法帧级拼接: {info}")
+                return False
+            logger.info(f"[合并] {label}格式不一致，单独转码后拼接: {info}")
+            run_metrics.count("briefs_conformed")
+            info = conform_to_template(info, self.template, self.conform_dir)
+            if info is None:
+                run_metrics.count("merge_skipped")
+                return False
+        if self.typing and self.count > 0:
+            self.writer.append(self.typing)
+            logger.info(f"[合并] 插入打字音效: {self.typing_path}")
+        first, count = self.writer.append(info)
+        self.placed.append({"index": index, "path": path, "frame": first, "frames": count})
+        self.count += 1
+        logger.info(f"[合并] 加入{label}: {path}")
+        return True
+
+    def finish(self):
+        """追加结尾音频并写入 Xing/Info 头"""
+        if not self.count:
+            logger.error("[合并] 没有可用的新闻音频")
+            self.abort()
+            return False
+        end = self._load_asset(self.end_path, "end")
+        if end:
+            self.writer.append(end)
+            logger.info(f"[合并] 结尾插入 end.mp3")
+        with run_metrics.stage("export"):
+            self.writer.close()
+        run_metrics.set_value("output_duration_seconds", round(self.writer.duration, 3))
+        logger.info(f"[合并] 帧级拼接完成: {self.writer.frame_count}帧, 时长 {self.writer.duration:.1f}秒, "
+                    f"大小 {format_filesize(os.path.getsize(self.output_file))}")
+        return True
+
+    def abort(self):
+        self.writer.abort()
+
+
+def finish_episode(episode, placements=None):
+    """
+    完成节目；成功且给了 placements 时追加每条新闻音频的位置
+    {"index", "path", "frame"}，frame 是在输出中的起始帧号（不含 Xing 头帧），不需要再次解码
+    """
+    if not episode.finish():
+        return False
+    if placements is not None:
+        placements.extend(episode.placed)
+    return True
+
+
+def merge_mp3_files_by_frames(mp3_files, output_file, intro_file=None, typing_path=None, end_path=None,
+                              placements=None, pool=None):
+    """
+    帧级拼接合并：不解码、不重编码，直接复制MP3帧并写入新的 Xing/Info 头
+    所有新闻音频必须是同一种帧格式（采样率、声道、MPEG版本），否则返回 False 交由重编码路径处理
+    片头、打字音效、结尾音频格式不一致时，单独转码成相同格式后再拼接
+    placements: 可选列表，成功时追加每条新闻音频在输出中的起始帧（见 finish_episode）
+    pool: 可选 {路径: Mp3Info}，已扫描过的帧索引，多期节目共用
+    """
+    segments = []
+    for f in mp3_files:
+        try:
+            info = pool.get(f) if pool else None
+            info = info or scan_mp3(f)
+        except OSError as e:
+            logger.error(f"[合并] 跳过损坏文件: {f}, 错误: {e}")
+            continue
+        if not info.frame_count:
+            logger.error(f"[合并] 跳过损坏文件: {f}, 错误: 未找到有效的MP3帧")
+            continue
+        segments.append(info)
+    if not segments:
+        logger.error("[合并] 没有可用的新闻音频")
+        return False
+
+    formats = {info.format_key for info in segments}
+    if len(formats) > 1:
+        logger.info(f"[合并] 新闻音频格式不一致 ({len(formats)} 种)，无法帧级拼接")
+        return False
+    template = segments[0]
+    unsafe = [info for info in segments if not info.copy_safe]
+    if unsafe:
+        # 不是 Layer III 或流中途改变格式（帧头校验时发现），只能重编码
+        logger.info(f"[合并] 不支持的帧格式，无法帧级拼接: {unsafe[0]}")
+        return False
+
+    episode = FrameCopyEpisode(output_file, template, typing_path, end_path)
+    try:
+        if intro_file and os.path.exists(intro_file):
+            episode.add_intro(intro_file)
+        for i, info in enumerate(segments):
+            episode.add_brief(info.path, i, info)
+        return finish_episode(episode, placements)
+    except Exception:
+        episode.abort()
+        raise
+
+
+class PcmEncoder:
+    """
+    长期运行的 ffmpeg 编码进程：PCM（s16le）通过管道持续写入，直接编码成MP3
+    整个节目从不在内存中完整存在
+    """
+
+    def __init__(self, output_file, sample_rate, channels, bitrate=None, frames_only=False, output_args=None):
+        """
+        frames_only: 只输出独立可解码的MP3帧（关闭 bit reservoir，不写 Xing 头和 ID3），
+        供分块并行编码后逐帧拼接
+        output_args: 自定义编码和容器参数（如其它码率、声道、AAC），替代默认的 MP3 编码参数
+        """
+        self.output_file = output_file
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.bytes_written = 0
+        cmd = [
+            ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y",
+            "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "-i", "pipe:0",
+        ]
+        if output_args:
+            cmd += list(output_args) + [output_file]
+        else:
+            cmd += ["-codec:a", "libmp3lame"]
+            if bitrate:
+                cmd += ["-b:a", str(bitrate)]
+            if frames_only:
+                cmd += ["-reservoir", "0", "-write_xing", "0", "-id3v2_version", "0"]
+            cmd += ["-f", "mp3", output_file]
+        self._stderr = tempfile.TemporaryFile()
+        self._proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=self._stderr)
+
+    @property
+    def duration(self):
+        """已写入的PCM时长（秒）"""
+        return self.bytes_written / (self.sample_rate * self.channels * PCM_SAMPLE_WIDTH)
+
+    def write(self, pcm):
+        view = memoryview(pcm)
+        for start in range(0, len(view), PCM_CHUNK_SIZE):
+            self._proc.stdin.write(view[start:start + PCM_CHUNK_SIZE])
+        self.bytes_written += len(view)
+
+    def close(self):
+        """结束输入并等待编码完成"""
+        try:
+            self._proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        code = self._proc.wait()
+        self._stderr.seek(0)
+        message = self._stderr.read().decode(errors="ignore").strip()
+        self._stderr.close()
+        if code != 0:
+            raise RuntimeError(f"ffmpeg 编码失败 (返回码 {code}): {message}")
+
+    def abort(self):
+        """中止编码并删除输出文件"""
+        self._proc.kill()
+        self._proc.wait()
+        self._stderr.close()
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
+
+
+def decode_mp3_to_pcm(path, sample_rate, channels):
+    """用 ffmpeg 把单个音频文件解码成指定采样率/声道的 s16le PCM"""
+    cmd = [
+        ffmpeg_binary(), "-hide_banner", "-loglevel", "error",
+        "-i", path, "-vn",
+        "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "pipe:1",
+    ]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0 or not result.stdout:
+        raise RuntimeError(result.stderr.decode(errors="ignore").strip() or "解码结果为空")
+    return result.stdout
+
+
+class StreamingEpisode:
+    """
+    逐条追加的流式重编码输出：每条音频单独解码，PCM 写入同一个编码进程
+    峰值内存约为单条音频解码后的大小，与简报数量无关
+    """
+
+    def __init__(self, output_file, sample_rate, channels, typing_path=None, end_path=None):
+        self.output_file = output_file
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.typing_path = typing_path
+        self.end_path = end_path
+        self.count = 0
+        self.placed = []
+        logger.info(f"[合并] 流式重编码: {sample_rate}Hz, {channels}声道")
+        # 打字音效很短，只解码一次并复用
+        self.typing_pcm = None
+        if typing_path and os.path.exists(typing_path):
+            try:
+                self.typing_pcm = load_asset_pcm(typing_path, sample_rate, channels)
+            except Exception as e:
+                logger.warning(f"[合并] 打字音效损坏: {e}")
+        self.encoder = PcmEncoder(output_file, sample_rate, channels)
+
+    @property
+    def duration(self):
+        return self.encoder.duration
+
+    def add_intro(self, path):
+        """在开头插入每日介绍"""
+        try:
+            self.encoder.write(load_asset_pcm(path, self.sample_rate, self.channels))
+            logger.info(f"[合并] 插入每日介绍: {path}")
+        except Exception as e:
+            logger.warning(f"[合并] 每日介绍音频损坏: {e}")
 
+    def add_brief(self, path, index=None, info=None):
+        """解码并追加一条新闻音频（简报之间自动插入打字音效），成功返回 True"""
+        label = f"第{index+1}条" if index is not None else os.path.basename(path)
+        try:
+            pcm = decode_mp3_to_pcm(path, self.sample_rate, self.channels)
+        except Exception as e:
+            logger.error(f"[合并] 跳过损坏文件: {path}, 错误: {e}")
+            run_metrics.count("merge_skipped")
+            return False
+        # 仅在简报之间插入打字音效
+        if self.typing_pcm and self.count > 0:
+            self.encoder.write(self.typing_pcm)
+            logger.info(f"[合并] 插入打字音效: {self.typing_path}")
+        self.placed.append({"index": index, "path": path,
+                            "frame": encoded_frame_index(self.encoder.bytes_written, self.sample_rate, self.channels)})
+        self.encoder.write(pcm)
+        self.count += 1
+        logger.info(f"[合并] 加入{label}: {path}")
+        return True
+
+    def finish(self):
+        """追加结尾音频并等待编码完成"""
+        if not self.count:
+            logger.error("[合并] 没有可用的新闻音频")
+            self.abort()
+            return False
+        # 结尾插入 end.mp3
+        if self.end_path and os.path.exists(self.end_path):
+            try:
+                self.encoder.write(load_asset_pcm(self.end_path, self.sample_rate, self.channels))
+                logger.info(f"[合并] 结尾插入 end.mp3")
+            except Exception as e:
+                logger.warning(f"[合并] 结尾音频损坏: {e}")
+        # 等待 ffmpeg 编码完剩余的数据
+        with run_metrics.stage("export"):
+            self.encoder.close()
+        run_metrics.set_value("output_duration_seconds", round(self.encoder.duration, 3))
+        logger.info(f"[合并] 已输出: {self.output_file}，时长 {self.encoder.duration:.1f}秒")
+        return True
 
-def merge_mp3_files(mp3_files, output_file, intro_file=None):
+    def abort(self):
+        self.encoder.abort()
+
+
+def encoded_frame_index(pcm_bytes, sample_rate, channels):
+    """PCM 中第 pcm_bytes 字节处的采样经 libmp3lame 编码后所在的帧号（不含 Xing 头帧）"""
+    frame_samples = 1152 if sample_rate >= 32000 else 576
+    return (pcm_bytes // (PCM_SAMPLE_WIDTH * channels) + LAME_ENCODER_DELAY) // frame_samples
+
+
+def decode_mp3_to_file(path, sample_rate, channels, dest):
+    """用 ffmpeg 把音频解码成 s16le PCM 文件，返回字节数"""
+    cmd = [
+        ffmpeg_binary(), "-hide_banner", "-loglevel", "error", "-y",
+        "-i", path, "-vn",
+        "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), dest,
+    ]
+    result = subprocess.run(cmd, capture_output=True)
+    if result.returncode != 0 or not os.path.exists(dest) or not os.path.getsize(dest):
+        raise RuntimeError(result.stderr.decode(errors="ignore").strip() or "解码结果为空")
+    return os.path.getsize(dest)
+
+
+def iter_pcm(pieces, start, end):
+    """按顺序拼接的 PCM 片段（bytes 或 PCM 文件路径）中 [start, end) 字节的内容，分块返回"""
+    position = 0
+    for piece in pieces:
+        size = len(piece) if isinstance(piece, (bytes, bytearray)) else os.path.getsize(piece)
+        lo, hi = max(start, position), min(end, position + size)
+        if lo < hi:
+            if isinstance(piece, (bytes, bytearray)):
+                yield memoryview(piece)[lo - position:hi - position]
+            else:
+                with open(piece, "rb") as f:
+                    f.seek(lo - position)
+                    remaining = hi - lo
+                    while remaining > 0:
+                        chunk = f.read(min(PCM_CHUNK_SIZE * 16, remaining))
+                        if not chunk:
+                            break
+                        remaining -= len(chunk)
+                        yield chunk
+        position += size
+        if position >= end:
+            return
+
+
+class ParallelEpisode:
+    """
+    多核并行重编码输出：
+    每条新闻音频加入时立即提交到解码池（每个任务一个 ffmpeg 解码进程），与下载重叠进行；
+    finish() 时把整段 PCM 按帧边界切成若干块，由多个 ffmpeg 编码进程同时编码，再逐帧拼接成一个文件。
+    每块在前后各多编码几帧（预编码），只保留与整段编码时位置相同的帧，编码器延迟因此自然对齐；
+    关闭 bit reservoir，使每帧不依赖前一帧的数据，块与块之间没有空隙或杂音。
+    add_brief 只负责提交解码任务，解码失败的简报在 finish() 时跳过
     """
-    使用pydub合并MP3文件
+
+    def __init__(self, output_file, sample_rate, channels, typing_path=None, end_path=None,
+                 jobs=None, work_dir=None, bitrate=PARALLEL_BITRATE):
+        self.output_file = output_file
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.typing_path = typing_path
+        self.end_path = end_path
+        self.jobs = max(1, jobs or os.cpu_count() or 1)
+        self.bitrate = bitrate
+        self.work_dir = tempfile.mkdtemp(prefix="parallel-", dir=work_dir)
+        self.count = 0
+        self.intro_pcm = None
+        self.briefs = []  # (序号, 路径, 解码 future, PCM 文件)
+        self.placed = []
+        self.duration = 0.0
+        logger.info(f"[合并] 并行重编码: {sample_rate}Hz, {channels}声道, {self.jobs}个进程")
+        self.typing_pcm = None
+        if typing_path and os.path.exists(typing_path):
+            try:
+                self.typing_pcm = load_asset_pcm(typing_path, sample_rate, channels)
+            except Exception as e:
+                logger.warning(f"[合并] 打字音效损坏: {e}")
+        self._executor = ThreadPoolExecutor(max_workers=self.jobs, thread_name_prefix="decode")
+
+    def add_intro(self, path):
+        """在开头插入每日介绍"""
+        try:
+            self.intro_pcm = load_asset_pcm(path, self.sample_rate, self.channels)
+            logger.info(f"[合并] 插入每日介绍: {path}")
+        except Exception as e:
+            logger.warning(f"[合并] 每日介绍音频损坏: {e}")
+
+    def add_brief(self, path, index=None, info=None):
+        """提交一条新闻音频的解码任务"""
+        dest = os.path.join(self.work_dir, f"{len(self.briefs)}.pcm")
+        future = self._executor.submit(decode_mp3_to_file, path, self.sample_rate, self.channels, dest)
+        self.briefs.append((index, path, future, dest))
+        self.count += 1
+        return True
+
+    def _timeline(self):
+        """等待全部解码完成，按节目顺序返回 PCM 片段列表"""
+        pieces = [self.intro_pcm] if self.intro_pcm else []
+        position = len(self.intro_pcm or b"")
+        merged = 0
+        for index, path, future, dest in self.briefs:
+            try:
+                size = future.result()
+            except Exception as e:
+                logger.error(f"[合并] 跳过损坏文件: {path}, 错误: {e}")
+                run_metrics.count("merge_skipped")
+                continue
+            if self.typing_pcm and merged > 0:
+                pieces.append(self.typing_pcm)
+                position += len(self.typing_pcm)
+            # 分块编码的帧与整段编码时位置相同，起始帧的算法与流式编码一致
+            self.placed.append({"index": index, "path": path,
+                                "frame": encoded_frame_index(position, self.sample_rate, self.channels)})
+            pieces.append(dest)
+            position += size
+            merged += 1
+        if not merged:
+            return None
+        if self.end_path and os.path.exists(self.end_path):
+            try:
+                pieces.append(load_asset_pcm(self.end_path, self.sample_rate, self.channels))
+                logger.info(f"[合并] 结尾插入 end.mp3")
+            except Exception as e:
+                logger.warning(f"[合并] 结尾音频损坏: {e}")
+        return pieces
+
+    def _encode_chunk(self, pieces, index, first_frame, last_frame, total_bytes, frame_bytes):
+        """编码 [first_frame - 预编码, last_frame + 预编码) 帧对应的PCM，返回 (Mp3Info, 保留的起止帧)"""
+        lead = min(first_frame, PARALLEL_PREROLL_FRAMES)
+        start = (first_frame - lead) * frame_bytes
+        end = min(total_bytes, (last_frame + PARALLEL_PREROLL_FRAMES) * frame_bytes)
+        chunk_file = os.path.join(self.work_dir, f"chunk-{index}.mp3")
+        encoder = PcmEncoder(chunk_file, self.sample_rate, self.channels, self.bitrate, frames_only=True)
+        try:
+            for data in iter_pcm(pieces, start, end):
+                encoder.write(data)
+            encoder.close()
+        except Exception:
+            encoder.abort()
+            raise
+        return scan_mp3(chunk_file), lead
+
+    def finish(self):
+        """等待解码完成，分块并行编码并拼接输出"""
+        try:
+            pieces = self._timeline()
+            if not pieces:
+                logger.error("[合并] 没有可用的新闻音频")
+                self.abort()
+                return False
+            with run_metrics.stage("export"):
+                self._encode(pieces)
+        except Exception:
+            self.abort()
+            raise
+        self._cleanup()
+        run_metrics.set_value("output_duration_seconds", round(self.duration, 3))
+        logger.info(f"[合并] 已输出: {self.output_file}，时长 {self.duration:.1f}秒")
+        return True
+
+    def _encode(self, pieces):
+        sample_bytes = PCM_SAMPLE_WIDTH * self.channels
+        frame_samples = 1152 if self.sample_rate >= 32000 else 576  # MPEG1 / MPEG2(.5) Layer III
+        frame_bytes = frame_samples * sample_bytes
+        total_bytes = sum(len(p) if isinstance(p, (bytes, bytearray)) else os.path.getsize(p) for p in pieces)
+        total_frames = -(-total_bytes // frame_bytes)
+        chunk_frames = max(PARALLEL_MIN_CHUNK_FRAMES, -(-total_frames // self.jobs))
+        bounds = [(i, min(i + chunk_frames, total_frames)) for i in range(0, total_frames, chunk_frames)]
+        logger.info(f"[合并] 分{len(bounds)}块并行编码: 共{total_frames}帧")
+        futures = [
+            self._executor.submit(self._encode_chunk, pieces, i, first, last, total_bytes, frame_bytes)
+            for i, (first, last) in enumerate(bounds)
+        ]
+        chunks = [future.result() for future in futures]
+        writer = Mp3FrameWriter(self.output_file, chunks[0][0])
+        try:
+            for i, ((info, lead), (first, last)) in enumerate(zip(chunks, bounds)):
+                if info.format_key != chunks[0][0].format_key:
+                    raise RuntimeError(f"分块编码格式不一致: {info}")
+                # 最后一块保留编码器冲刷出的尾部帧
+                end = info.frame_count if i == len(bounds) - 1 else min(info.frame_count, lead + last - first)
+                writer.append(info, lead, end)
+            writer.close()
+        except Exception:
+            writer.abort()
+            raise
+        self.duration = total_bytes / (self.sample_rate * sample_bytes)
+
+    def _cleanup(self):
+        self._executor.shutdown(wait=True)
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def abort(self):
+        for _, _, future, _ in self.briefs:
+            future.cancel()
+        self._cleanup()
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
+
+
+def merge_mp3_files_parallel(mp3_files, output_file, intro_file=None, typing_path=None, end_path=None, jobs=None,
+                             placements=None):
+    """多核并行解码和分块编码合并，输出格式取所有输入中最高的采样率和声道数"""
+    sample_rate, channels = detect_output_format([intro_file, typing_path, end_path] + list(mp3_files))
+    episode = ParallelEpisode(output_file, sample_rate, channels, typing_path, end_path, jobs,
+                              os.path.dirname(os.path.abspath(output_file)))
+    try:
+        if intro_file and os.path.exists(intro_file):
+            episode.add_intro(intro_file)
+        for i, f in enumerate(mp3_files):
+            episode.add_brief(f, i)
+        return finish_episode(episode, placements)
+    except Exception:
+        episode.abort()
+        raise
+
+
+def detect_output_format(paths):
+    """取所有输入中最高的采样率和声道数（与 pydub 拼接时的规则一致）"""
+    sample_rate, channels = 0, 0
+    for path in paths:
+        if not path or not os.path.exists(path):
+            continue
+        try:
+            info = scan_mp3(path)
+        except OSError:
+            continue
+        if info.header:
+            sample_rate = max(sample_rate, info.sample_rate)
+            channels = max(channels, info.channels)
+    return sample_rate or 44100, channels or 2
+
+
+def merge_mp3_files_streaming(mp3_files, output_file, intro_file=None, typing_path=None, end_path=None,
+                              placements=None):
+    """
+    流式重编码合并：逐个解码音频，把PCM写入同一个编码进程
+    输出格式取所有输入中最高的采样率和声道数
+    """
+    sample_rate, channels = detect_output_format([intro_file, typing_path, end_path] + list(mp3_files))
+    episode = StreamingEpisode(output_file, sample_rate, channels, typing_path, end_path)
+    try:
+        if intro_file and os.path.exists(intro_file):
+            episode.add_intro(intro_file)
+        for i, f in enumerate(mp3_files):
+            episode.add_brief(f, i)
+        return finish_episode(episode, placements)
+    except Exception:
+        episode.abort()
+        raise
+
+
+def merge_mp3_files(mp3_files, output_file, intro_file=None, mode="auto", jobs=None, placements=None, pool=None):
+    """
+    合并MP3文件
     mp3_files: 新闻音频列表
     output_file: 输出文件
     intro_file: 可选，开头插入的每日介绍音频
+    mode: auto（优先帧级拼接，格式不一致时回退到重编码）/ copy（仅帧级拼接）/ reencode（流式解码重编码）/
+          parallel（用 jobs 个进程并行解码和分块编码）
+    placements: 可选列表，成功时追加每条新闻音频在输出中的位置，用于切分 HLS 分段
+    pool: 可选 {路径: Mp3Info}，帧级拼接时不再重复扫描
     结尾自动追加 end.mp3（如存在）
     简报之间自动插入 keyboard-typing.mp3（如存在），但第一个和最后一个之间不加
     """
-    from pydub import AudioSegment
-    import os
-    merged = None
-    # 插入每日介绍
-    if intro_file and os.path.exists(intro_file):
-        merged = AudioSegment.from_mp3(intro_file)
-        logger.info(f"[合并] 插入每日介绍: {intro_file}")
-    # 加载打字音效
-    typing_path = os.path.join(os.path.dirname(__file__), "keyboard-typing.mp3")
-    typing_audio = AudioSegment.from_mp3(typing_path) if os.path.exists(typing_path) else None
-    # 合并新闻音频，只有在中间插入打字音效
-    for i, f in enumerate(mp3_files):
+    if mode in ("auto", "copy"):
         try:
-            seg = AudioSegment.from_mp3(f)
-            if merged is None:
-                merged = seg
-            else:
-                # 仅在不是第一个且不是最后一个前插入打字音效
-                if typing_audio and i > 0:
-                    merged += typing_audio
-                    logger.info(f"[合并] 插入打字音效: {typing_path}")
-                merged += seg
-            logger.info(f"[合并] 加入第{i+1}条: {f}")
+            if merge_mp3_files_by_frames(mp3_files, output_file, intro_file, TYPING_AUDIO_PATH, END_AUDIO_PATH,
+                                         placements, pool):
+                logger.info(f"[合并] 已输出: {output_file}")
+                return True
         except Exception as e:
-            logger.error(f"[合并] 跳过损坏文件: {f}, 错误: {e}")
-    # 结尾插入 end.mp3
-    end_path = os.path.join(os.path.dirname(__file__), "end.mp3")
-    if os.path.exists(end_path):
+            logger.warning(f"[合并] 帧级拼接失败: {e}")
+        if mode == "copy":
+            logger.error("[合并] 帧级拼接不可用")
+            return False
+        logger.info("[合并] 回退到解码重编码合并")
+
+    if mode == "parallel":
+        return merge_mp3_files_parallel(mp3_files, output_file, intro_file, TYPING_AUDIO_PATH, END_AUDIO_PATH, jobs,
+                                        placements)
+    return merge_mp3_files_streaming(mp3_files, output_file, intro_file, TYPING_AUDIO_PATH, END_AUDIO_PATH,
+                                     placements)
+
+
+class Rendition:
+    """
+    额外输出的一个版本，如移动端低码率单声道
+    命令行格式 name:bitrate:channels:container，如 mobile:48k:1:mp3、web:96k:2:m4a、opus:32k:1:opus
+    """
+
+    # 容器 -> (编码器参数, ffmpeg 格式, 扩展名)
+    CONTAINERS = {
+        "mp3": (["-codec:a", "libmp3lame"], "mp3", "mp3"),
+        "m4a": (["-codec:a", "aac", "-movflags", "+faststart"], "mp4", "m4a"),
+        "opus": (["-codec:a", "libopus", "-ar", "48000"], "ogg", "opus"),
+    }
+
+    def __init__(self, name, bitrate="64k", channels=None, container="mp3"):
+        if container not in self.CONTAINERS:
+            raise ValueError(f"不支持的容器: {container}（可选 {', '.join(self.CONTAINERS)}）")
+        self.name = name
+        self.bitrate = bitrate
+        self.channels = channels
+        self.container = container
+
+    @classmethod
+    def parse(cls, spec):
+        """解析 name:bitrate:channels:container，后面的字段可以省略"""
+        parts = spec.split(":")
+        if not parts[0] or len(parts) > 4 or not parts[0].replace("-", "").replace("_", "").isalnum():
+            raise ValueError(f"无效的输出版本: {spec}（格式 name:bitrate:channels:container）")
+        bitrate = parts[1] if len(parts) > 1 and parts[1] else "64k"
+        if len(parts) > 2 and parts[2] and not parts[2].isdigit():
+            raise ValueError(f"无效的声道数: {spec}")
+        channels = int(parts[2]) if len(parts) > 2 and parts[2] else None
+        container = parts[3] if len(parts) > 3 and parts[3] else "mp3"
+        return cls(parts[0], bitrate, channels, container)
+
+    def output_path(self, output_file):
+        """与主输出同目录，如 news-20250426-0650-mobile.mp3"""
+        base = os.path.splitext(output_file)[0]
+        return f"{base}-{self.name}.{self.CONTAINERS[self.container][2]}"
+
+    def output_args(self):
+        codec_args, fmt, _ = self.CONTAINERS[self.container]
+        args = list(codec_args) + ["-b:a", self.bitrate]
+        if self.channels:
+            args += ["-ac", str(self.channels)]
+        return args + ["-map_metadata", "-1", "-f", fmt]
+
+    def __repr__(self):
+        return f"{self.name}:{self.bitrate}:{self.channels or ''}:{self.container}"
+
+
+def parse_rendition(spec):
+    """命令行 --rendition 的解析函数"""
+    try:
+        return Rendition.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def encode_renditions(source, renditions, output_file=None):
+    """
+    把 source 只解码一次，PCM 同时写入每个版本各自的编码进程（并行编码）
+    返回 {版本名: 文件路径}，单个版本失败时跳过
+    """
+    if not renditions:
+        return {}
+    output_file = output_file or source
+    info = scan_mp3(source)
+    sample_rate, channels = (info.sample_rate, info.channels) if info.header else (44100, 2)
+    encoders = {}
+    for rendition in renditions:
         try:
-            end_audio = AudioSegment.from_mp3(end_path)
-            merged += end_audio
-            logger.info(f"[合并] 结尾插入 end.mp3")
+            encoders[rendition.name] = PcmEncoder(rendition.output_path(output_file), sample_rate, channels,
+                                                  output_args=rendition.output_args())
+        except OSError as e:
+            logger.error(f"[多版本] 无法启动编码器 {rendition}: {e}")
+    cmd = [
+        ffmpeg_binary(), "-hide_banner", "-loglevel", "error",
+        "-i", source, "-vn", "-f", "s16le", "-ar", str(sample_rate), "-ac", str(channels), "pipe:1",
+    ]
+    decoder = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    try:
+        while encoders:
+            chunk = decoder.stdout.read(PCM_CHUNK_SIZE * 4)
+            if not chunk:
+                break
+            for name, encoder in list(encoders.items()):
+                try:
+                    encoder.write(chunk)
+                except OSError as e:
+                    logger.error(f"[多版本] 编码 {name} 失败: {e}")
+                    encoder.abort()
+                    del encoders[name]
+    except BaseException:
+        decoder.kill()
+        for encoder in encoders.values():
+            encoder.abort()
+        raise
+    finally:
+        decoder.stdout.close()
+    if decoder.wait() != 0:
+        logger.error(f"[多版本] 解码失败: {source}")
+        for encoder in encoders.values():
+            encoder.abort()
+        return {}
+    outputs = {}
+    for name, encoder in encoders.items():
+        try:
+            encoder.close()
+        except RuntimeError as e:
+            logger.error(f"[多版本] 编码 {name} 失败: {e}")
+            continue
+        outputs[name] = encoder.output_file
+        logger.info(f"[多版本] 已输出 {name}: {encoder.output_file}，"
+                    f"大小 {format_filesize(os.path.getsize(encoder.output_file))}")
+    return outputs
+
+
+class EpisodeDefinition:
+    """
+    与完整节目一起生成的分类节目，使用同一次下载的简报音频
+    命令行格式 name:categories[:order]，categories 用逗号分隔（* 表示全部分类），
+    order 为 newest（从新到旧，与完整节目相同）或 oldest，如 economy:经济,财经、tech:科技:oldest
+    """
+
+    ORDERS = ("newest", "oldest")
+
+    def __init__(self, name, categories=None, order="newest"):
+        if order not in self.ORDERS:
+            raise ValueError(f"不支持的排序: {order}（可选 {', '.join(self.ORDERS)}）")
+        self.name = name
+        # None 表示不按分类过滤
+        self.categories = {c.strip().casefold() for c in categories} if categories else None
+        self.order = order
+
+    @classmethod
+    def parse(cls, spec):
+        parts = spec.split(":")
+        if not parts[0] or len(parts) > 3 or not parts[0].replace("-", "").replace("_", "").isalnum():
+            raise ValueError(f"无效的节目定义: {spec}（格式 name:categories[:order]）")
+        if len(parts) < 2 or not parts[1].strip():
+            raise ValueError(f"节目定义缺少分类: {spec}")
+        categories = [c for c in parts[1].split(",") if c.strip()]
+        if "*" in (c.strip() for c in categories):
+            categories = None
+        order = parts[2] if len(parts) > 2 and parts[2] else "newest"
+        return cls(parts[0], categories, order)
+
+    def select(self, briefs):
+        """从窗口内的简报（从新到旧）中选出本期节目的简报，按节目顺序返回"""
+        selected = [b for b in briefs
+                    if self.categories is None or (b.category or "").strip().casefold() in self.categories]
+        return list(reversed(selected)) if self.order == "oldest" else selected
+
+    def output_path(self, output_file):
+        """与完整节目同目录，如 news-20250426-0650-economy.mp3、summary-20250426-0650-economy.md"""
+        base, ext = os.path.splitext(output_file)
+        return f"{base}-{self.name}{ext}"
+
+    def __repr__(self):
+        return f"{self.name}:{','.join(sorted(self.categories)) if self.categories else '*'}:{self.order}"
+
+
+def parse_episode_definition(spec):
+    """命令行 --episode 的解析函数"""
+    try:
+        return EpisodeDefinition.parse(spec)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+
+def merge_episodes(briefs, mp3_files, output_file, definitions, intro_file=None, mode="auto", jobs=None,
+                   placements=None):
+    """
+    用同一批下载好的简报音频并发生成完整节目（output_file）和 definitions 中的各分类节目
+    每个文件只扫描一次帧索引，所有节目共用
+    返回 (完整节目是否成功, {节目名: (输出文件, 收录的简报列表)})，没有简报或合并失败的分类节目不在其中
+    """
+    downloaded = set(mp3_files)
+    files = {}
+    for i, brief in enumerate(briefs):
+        path = os.path.join(os.path.dirname(mp3_files[0]), f"{i+1}-{brief.id}.mp3") if mp3_files else None
+        if path in downloaded:
+            files[brief.id] = path
+    pool = {}
+    for path in mp3_files:
+        try:
+            pool[path] = scan_mp3(path)
+        except OSError:
+            pass  # 合并时记录并跳过
+
+    builds = [(None, output_file, list(mp3_files), placements)]
+    selections = {}
+    for definition in definitions:
+        selected = [b for b in definition.select(briefs) if b.id in files]
+        if not selected:
+            logger.warning(f"[分类节目] {definition.name} 在窗口内没有可用的简报，跳过")
+            continue
+        logger.info(f"[分类节目] {definition.name}: {len(selected)}条简报")
+        selections[definition.name] = selected
+        builds.append((definition.name, definition.output_path(output_file), [files[b.id] for b in selected], None))
+
+    def build(job):
+        name, path, paths, positions = job
+        try:
+            return merge_mp3_files(paths, path, intro_file, mode=mode, jobs=jobs, placements=positions, pool=pool)
         except Exception as e:
-            logger.warning(f"[合并] 结尾音频损坏: {e}")
-    merged.export(output_file, format="mp3")
+            logger.error(f"[分类节目] 合并 {name or '完整节目'} 失败: {e}")
+            return False
+
+    # 各节目之间没有依赖，并发生成（帧级拼接主要是磁盘IO，重编码时各自使用 ffmpeg 进程）
+    with ThreadPoolExecutor(max_workers=len(builds), thread_name_prefix="episode") as executor:
+        results = list(executor.map(build, builds))
+    outputs = {}
+    for (name, path, _, _), ok in zip(builds[1:], results[1:]):
+        if ok:
+            outputs[name] = (path, selections[name])
+    return results[0], outputs
+
+
+def open_episode(output_file, first_brief, intro_file=None, mode="auto", conform_dir=None, jobs=None):
+    """
+    根据第一条可用的新闻音频创建逐条追加的输出（流水线合并使用）
+    auto/copy 模式使用帧级拼接，以第一条音频的格式为准，其余格式不一致的音频单独转码；
+    reencode 模式使用流式重编码，parallel 模式边下载边并行解码，最后分块并行编码
+    """
+    if mode not in ("reencode", "parallel"):
+        try:
+            template = scan_mp3(first_brief)
+            if template.copy_safe:
+                return FrameCopyEpisode(output_file, template, TYPING_AUDIO_PATH, END_AUDIO_PATH, conform_dir)
+        except OSError:
+            pass
+        if mode == "copy":
+            raise ValueError(f"帧级拼接不可用: {first_brief}")
+    sample_rate, channels = detect_output_format([intro_file, TYPING_AUDIO_PATH, END_AUDIO_PATH, first_brief])
+    if mode == "parallel":
+        return ParallelEpisode(output_file, sample_rate, channels, TYPING_AUDIO_PATH, END_AUDIO_PATH, jobs, conform_dir)
+    return StreamingEpisode(output_file, sample_rate, channels, TYPING_AUDIO_PATH, END_AUDIO_PATH)
+
+
+def download_and_merge(briefs, temp_dir, output_file, with_intro=True, mode="auto",
+                       use_cache=True, engine=None, max_buffered=PIPELINE_MAX_BUFFERED, jobs=None, placements=None,
+                       intro_when=None):
+    """
+    流水线下载与合并：下载仍并发进行，第 i 条简报及其之前的简报都到达后立即写入输出，
+    网络和CPU同时工作，总耗时约为 max(下载, 合并) 而不是两者之和
+    已下载但尚未合并的简报数不超过 max_buffered（背压）
+    返回成功合并的简报音频列表，合并失败时返回空列表
+    placements 同 merge_mp3_files，index 是简报在 briefs 中的序号
+    intro_when 同 download_daily_intro 的 when
+    """
+    if not briefs:
+        logger.warning("没有找到符合条件的简报")
+        return []
+    engine = engine or get_download_engine()
+    cache = get_brief_cache() if use_cache else None
+    logger.info(f"开始流水线下载与合并: {len(briefs)}条简报，最多缓冲{max_buffered}条")
+    start_time = time.time()
+    merged_files = asyncio.run(_download_and_merge(
+        briefs, temp_dir, output_file, with_intro, mode, cache, engine, max_buffered, jobs, placements, intro_when
+    ))
+    logger.info(f"流水线完成: 合并{len(merged_files)}/{len(briefs)}条，总耗时 {time.time() - start_time:.2f}秒")
+    if cache:
+        try:
+            cache.save()
+        except OSError as e:
+            logger.warning(f"[缓存] 保存简报缓存索引失败: {e}")
+    return merged_files
+
+
+async def _download_and_merge(briefs, temp_dir, output_file, with_intro, mode, cache, engine, max_buffered, jobs,
+                              placements, intro_when):
+    loop = asyncio.get_running_loop()
+    total = len(briefs)
+    results = [None] * total
+    arrived = [asyncio.Event() for _ in range(total)]
+    wakeup = asyncio.Event()
+    state = {"merged": 0}
+    # 合并在单独的线程中串行执行，不占用下载线程
+    merge_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="merge")
+
+    def merge_step(fn, *args):
+        # 合并线程上的耗时累加到 merge 阶段
+        with run_metrics.stage("merge"):
+            return fn(*args)
+
+    async def fetch(i):
+        result = await engine.run_async(download_mp3_file, briefs[i], i, total, temp_dir, cache, engine)
+        engine.concurrency.record_result(result[2])
+        results[i] = result
+        arrived[i].set()
+        wakeup.set()
+
+    async def produce():
+        running = set()
+        next_index = 0
+        while True:
+            wakeup.clear()
+            running = {task for task in running if not task.done()}
+            while (next_index < total and len(running) < engine.concurrency.limit
+                   and next_index < state["merged"] + max_buffered):
+                running.add(asyncio.ensure_future(fetch(next_index)))
+                next_index += 1
+            if next_index >= total and not running:
+                return
+            await wakeup.wait()
+
+    async def consume():
+        intro_file = None
+        if with_intro:
+            intro_file = await engine.run_async(download_daily_intro, temp_dir, engine, intro_when)
+        episode = None
+        merged_files = []
+        try:
+            for i in range(total):
+                await arrived[i].wait()
+                filepath, _, success, _ = results[i]
+                if success:
+                    if episode is None:
+                        episode = await loop.run_in_executor(
+                            merge_executor, merge_step, open_episode,
+                            output_file, filepath, intro_file, mode, temp_dir, jobs
+                        )
+                        if intro_file:
+                            await loop.run_in_executor(merge_executor, merge_step, episode.add_intro, intro_file)
+                    if await loop.run_in_executor(merge_executor, merge_step, episode.add_brief, filepath, i):
+                        merged_files.append(filepath)
+                state["merged"] = i + 1
+                wakeup.set()
+            if episode is None or not await loop.run_in_executor(merge_executor, merge_step,
+                                                                 finish_episode, episode, placements):
+                return []
+            return merged_files
+        except BaseException:
+            if episode is not None:
+                episode.abort()
+            raise
+
+    try:
+        _, merged_files = await asyncio.gather(produce(), consume())
+    finally:
+        merge_executor.shutdown(wait=True)
+    return merged_files
+
+
+def rolling_episode_key(start_epoch, end_epoch):
+    """滚动节目的目录名，由时间窗口决定"""
+    return f"{int(start_epoch)}-{int(end_epoch)}"
+
+
+def update_rolling_episode(episode, briefs, temp_dir, use_cache=True, engine=None):
+    """
+    把还不在滚动节目中的简报下载并追加到 body，已包含的简报不再下载或处理
+    返回新追加的条数
+    """
+    new_briefs = [b for b in briefs if b.id not in episode]
+    logger.info(f"[滚动合并] 节目中已有{len(episode)}条，新增{len(new_briefs)}条")
+    if not new_briefs:
+        return 0
+    engine = engine or get_download_engine()
+    cache = get_brief_cache() if use_cache else None
+    results = engine.map(
+        lambda job: download_mp3_file(job[1], job[0], len(new_briefs), temp_dir, cache, engine),
+        enumerate(new_briefs),
+        ok=lambda result: result[2],
+    )
+    appended = 0
+    # 简报按从新到旧排列，反过来追加使 body 大致保持发布顺序
+    for brief, result in reversed(list(zip(new_briefs, results))):
+        if not result or not result[2]:
+            continue
+        try:
+            info = scan_mp3(result[0])
+        except OSError as e:
+            logger.error(f"[合并] 跳过损坏文件: {result[0]}, 错误: {e}")
+            run_metrics.count("merge_skipped")
+            continue
+        template = episode.template
+        if not info.frame_count or not (template or info.copy_safe):
+            logger.error(f"[合并] 跳过无法帧级拼接的文件: {info}")
+            run_metrics.count("merge_skipped")
+            continue
+        if template and (info.format_key != template.format_key or not info.copy_safe):
+            logger.info(f"[合并] {brief.title} 格式不一致，单独转码后拼接: {info}")
+            run_metrics.count("briefs_conformed")
+            info = conform_to_template(info, template, temp_dir)
+            if info is None:
+                run_metrics.count("merge_skipped")
+                continue
+        # ETag 取自这次下载（或条件请求）的响应，不依赖缓存，--no-cache 时增量更新也能发现音频重新生成
+        episode.append(brief.id, info, audio_url=brief.audio_url, etag=result[3], published_at=brief.published_at)
+        appended += 1
+    episode.save()
+    if cache:
+        cache.save()
+    return appended
+
+
+def reconcile_rolling_episode(episode, briefs, temp_dir, use_cache=True, engine=None):
+    """
+    对比窗口内当前的简报和滚动节目清单：
+    已下线的简报移除；audio_url 变化或远端 ETag 变化（音频重新生成）的简报替换；新简报追加
+    返回 (新增条数, 替换的简报 id 集合, 移除的简报 id 集合)
+    """
+    engine = engine or get_download_engine()
+    current = {b.id for b in briefs}
+    removed_ids = {seg["id"] for seg in episode.segments if seg["id"] not in current}
+    for brief_id in removed_ids:
+        episode.remove(brief_id)
+    existing = [b for b in briefs if b.id in episode]
+
+    def has_changed(brief):
+        segment = episode.segment(brief.id)
+        if segment.get("audio_url") != brief.audio_url:
+            return True
+        if not segment.get("etag"):
+            return False
+        response = engine.head(brief.audio_url)
+        response.raise_for_status()
+        etag = response.headers.get("ETag")
+        return bool(etag) and etag != segment["etag"]
+
+    # 只发 HEAD 请求比较 ETag，不下载未变化的音频
+    flags = engine.map(has_changed, existing, ok=lambda flag: flag is not None)
+    changed_ids = {b.id for b, flag in zip(existing, flags) if flag}
+    for brief_id in changed_ids:
+        episode.remove(brief_id)
+    added = sum(1 for b in briefs if b.id not in episode and b.id not in changed_ids)
+    appended = update_rolling_episode(episode, briefs, temp_dir, use_cache, engine)
+    logger.info(f"[增量更新] 新增{added}条，替换{len(changed_ids)}条，移除{len(removed_ids)}条"
+                f"（实际追加{appended}条）")
+    return added, changed_ids, removed_ids
+
+
+def finalize_rolling_episode(episode, briefs, output_file, intro_file=None):
+    """按简报顺序（从新到旧）把滚动节目拼接成完整输出，插入片头、打字音效和结尾"""
+    template = episode.template
+    if template is None:
+        logger.error("[滚动合并] 节目中没有可用的新闻音频")
+        return None
+    assets = {}
+    for name, path in (("intro", intro_file), ("typing", TYPING_AUDIO_PATH), ("end", END_AUDIO_PATH)):
+        assets[name] = load_asset_frames(path, template, name) if path and os.path.exists(path) else None
+    placed = episode.finalize(output_file, [b.id for b in briefs], **assets)
     logger.info(f"[合并] 已输出: {output_file}")
-    return True
+    return placed
+
+
+def episode_chapters(briefs, placements=None, placed=None):
+    """
+    把合并时记录的位置对应到简报，返回 [{"id", "title", "frame"}]（hls_segmenter 的章节）
+    placements 是完整合并的位置（按下载文件名对应简报），placed 是滚动节目定稿的位置（带简报 id）
+    """
+    if placed:
+        by_id = {b.id: b for b in briefs}
+        return [{"id": p["id"], "title": getattr(by_id.get(p["id"]), "title", None), "frame": p["frame"]}
+                for p in placed]
+    by_name = {f"{i+1}-{b.id}.mp3": b for i, b in enumerate(briefs)}
+    chapters = []
+    for p in placements or []:
+        brief = by_name.get(os.path.basename(p["path"]))
+        if brief is not None:
+            chapters.append({"id": brief.id, "title": brief.title, "frame": p["frame"]})
+    return chapters
 
 
 def generate_summary_text(briefs, output_file):
@@ -505,58 +1920,98 @@ def generate_summary_text(briefs, output_file):
 
 
 # 上传文件到阿里云 OSS
+_oss_uploader = None
+
+
+def get_oss_uploader():
+    """返回进程内共享的 OSS 上传器（复用 Bucket 客户端和分片上传线程池），配置不完整时返回 None"""
+    global _oss_uploader
+    if _oss_uploader is None:
+        from oss_uploader import OssUploader
+        _oss_uploader = OssUploader.from_env() or False
+    return _oss_uploader or None
+
+
 def upload_to_oss(local_file, object_name=None):
     """
     上传本地文件到阿里云 OSS，返回文件的公网URL
     环境变量：
         OSS_ENDPOINT, OSS_ACCESS_KEY_ID, OSS_ACCESS_KEY_SECRET, OSS_BUCKET_NAME, OSS_PUBLIC_URL_PREFIX
     """
-    import os
-    endpoint = os.environ.get("OSS_ENDPOINT")
-    access_key_id = os.environ.get("OSS_ACCESS_KEY_ID")
-    access_key_secret = os.environ.get("OSS_ACCESS_KEY_SECRET")
-    bucket_name = os.environ.get("OSS_BUCKET_NAME")
-    url_prefix = os.environ.get("OSS_PUBLIC_URL_PREFIX")  # 如 https://bucket-name.oss-region.aliyuncs.com/
-
-    if not all([endpoint, access_key_id, access_key_secret, bucket_name, url_prefix]):
-        logger.error("OSS配置不完整，请设置环境变量：OSS_ENDPOINT, OSS_ACCESS_KEY_ID, OSS_ACCESS_KEY_SECRET, OSS_BUCKET_NAME, OSS_PUBLIC_URL_PREFIX")
+    uploader = get_oss_uploader()
+    if uploader is None:
         return None
+    return uploader.upload(local_file, object_name)
+
+
+def run(args):
+    """
+    执行一次完整的获取、过滤、下载、合并和上传（持有合并锁，避免与定时任务或其它手动运行冲突）
+    返回 dict：success、output_file、summary_file、oss_url、briefs（本期简报数），
+    指定了 --rendition 时还有 renditions：{版本名: {file, url}}，指定了 --hls 时还有 hls_dir 和 hls_url（播放列表），
+    指定了 --episode 时还有 episodes：{节目名: {file, summary_file, briefs, url, summary_url}}
+    每次运行的指标写入 args.metrics_dir（JSON 运行记录和 node_exporter textfile）
+    """
+    with file_lock(MERGE_LOCK_PATH):
+        profiler = None
+        if args.profile:
+            from stage_profiler import StageProfiler
+            profiler = StageProfiler(args.profile).start()
+        metrics = run_metrics.RunMetrics(profiler)
+        result = None
+        try:
+            with run_metrics.activate(metrics):
+                result = _run(args)
+        finally:
+            if profiler:
+                profiler.stop()
+            write_run_metrics(metrics, args, result)
+        return result
+
 
-    # 生成object_name
-    import time
-    if object_name is None:
-        # 默认用文件名+时间戳
-        base = os.path.basename(local_file)
-        object_name = f"news-audio/{base}"
+def run_name(result):
+    """本次运行的名称：输出音频文件名中的时间戳"""
+    if result.get("output_file"):
+        return os.path.splitext(os.path.basename(result["output_file"]))[0].replace("news-", "", 1)
+    return datetime.now().strftime("%Y%m%d-%H%M")
 
-    auth = oss2.Auth(access_key_id, access_key_secret)
-    bucket = oss2.Bucket(auth, endpoint, bucket_name)
+
+def write_run_metrics(metrics, args, result):
+    """写入本次运行的指标（和 profile 报告），文件名与输出音频的时间戳一致；写入失败不影响合并结果"""
+    result = result or {}
+    name = run_name(result)
+    if metrics.profiler:
+        output_dir = os.path.dirname(result.get("output_file") or "") or os.getcwd()
+        profile_dir = os.path.join(output_dir, f"profile-{name}")
+        try:
+            written = metrics.profiler.write(profile_dir)
+            logger.info(f"[profile] 已写入 {len(written)} 个报告: {profile_dir}")
+        except OSError as e:
+            logger.warning(f"[profile] 写入报告失败: {e}")
+    metrics.set("output_file", result.get("output_file"))
+    metrics.set("oss_url", result.get("oss_url"))
     try:
-        bucket.put_object_from_file(object_name, local_file)
-        url = url_prefix.rstrip("/") + "/" + object_name
-        logger.info(f"已上传到OSS: {url}")
-        return url
-    except Exception as e:
-        logger.error(f"上传到OSS失败: {e}")
-        return None
+        record = metrics.write(args.metrics_dir or METRICS_DIR, name, result.get("success"))
+    except OSError as e:
+        logger.warning(f"[指标] 写入运行指标失败: {e}")
+        return
+    stages = ", ".join(f"{stage} {info['seconds']:.2f}s" for stage, info in record["stages"].items())
+    logger.info(f"[指标] 总耗时 {record['duration_seconds']:.2f}秒（{stages}），"
+                f"峰值内存 {format_filesize(record['peak_rss_bytes'])}")
 
 
-def main():
-    """主函数"""
-    args = parse_arguments()
-    
-    # 设置日志级别
-    if args.verbose:
-        logger.setLevel(logging.DEBUG)
-    
+def _run(args):
     # 设置输出目录
     output_dir = args.output or os.getcwd()
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
-    # 获取当前时间作为文件名
+    # 获取当前时间作为文件名；指定区间时用区间结束时间，补跑多个窗口时文件名不会冲突
     now = datetime.now()
-    timestamp = now.strftime("%Y%m%d-%H%M")
+    end_epoch = parse_iso_timestamp(args.end) if args.start and args.end else None
+    # 每日介绍按窗口结束时间所在的日期选取，跨零点的窗口或之后重新定稿时不会用成当天的介绍
+    intro_when = datetime.fromtimestamp(end_epoch, timezone.utc) if end_epoch is not None else None
+    timestamp = (datetime.fromtimestamp(end_epoch) if end_epoch is not None else now).strftime("%Y%m%d-%H%M")
     # 强制输出到同级 audio_files 目录
     audio_files_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "audio_files")
     if not os.path.exists(audio_files_dir):
@@ -565,62 +2020,271 @@ def main():
     summary_file = os.path.join(audio_files_dir, f"summary-{timestamp}.md")
     
     # 创建临时目录
-    temp_dir = os.path.join(tempfile.gettempdir(), f"news-audio-merge-{int(time.time())}")
-    os.makedirs(temp_dir, exist_ok=True)
+    temp_dir = tempfile.mkdtemp(prefix=f"news-audio-merge-{int(time.time())}-")
+    result = {"success": False, "output_file": output_file, "summary_file": summary_file, "oss_url": None, "briefs": 0}
+    
+    engine = get_download_engine(args.max_concurrency, parse_rate(args.rate_limit))
+    renditions = [r if isinstance(r, Rendition) else Rendition.parse(r) for r in args.renditions or []]
+    episode_defs = [d if isinstance(d, EpisodeDefinition) else EpisodeDefinition.parse(d) for d in args.episodes or []]
     
     try:
-        # 获取简报数据
-        briefs_data = fetch_briefs_json(args.url)
+        # 获取简报数据，按发布时间建立索引（只解析一次时间戳）
+        with run_metrics.stage("fetch"):
+            feed_index = get_feed_index(args.url, use_snapshot=not args.no_cache)
         
-        if briefs_data is None:
+        if feed_index is None:
             logger.error("获取简报数据失败")
-            return
+            return result
         
         # 新增：支持按时间区间过滤
-        if args.start and args.end:
-            filtered_briefs = filter_briefs_by_time_range(briefs_data, args.start, args.end)
-        elif args.hours:
-            filtered_briefs = filter_briefs_by_time(briefs_data, args.hours)
-        else:
-            logger.error("请指定 --hours 或 --start 和 --end")
-            return
+        with run_metrics.stage("filter"):
+            if args.start and args.end:
+                filtered_briefs = filter_briefs_by_time_range(feed_index, args.start, args.end)
+            elif args.hours:
+                filtered_briefs = filter_briefs_by_time(feed_index, args.hours)
+            else:
+                logger.error("请指定 --hours 或 --start 和 --end")
+                return result
+        run_metrics.set_value("feed_briefs", len(feed_index))
+        run_metrics.set_value("briefs_in_window", len(filtered_briefs))
         
         if not filtered_briefs:
             logger.warning("未找到指定时间范围内的MP3文件，退出")
-            return
+            return result
         
         # 确保所有brief都是Brief对象（修复dict属性访问错误）
         filtered_briefs = [Brief(b) if not isinstance(b, Brief) else b for b in filtered_briefs]
         
+        # 去掉音频重复的简报，重复的音频不下载、不合并，也不出现在摘要中
+        if not args.no_dedup:
+            with run_metrics.stage("dedup"):
+                filtered_briefs, duplicates = dedup_briefs(
+                    filtered_briefs, engine, cache=None if args.no_cache else get_brief_cache(),
+                    index=get_duplicate_index(),
+                )
+            run_metrics.set_value("briefs_duplicates", len(duplicates))
+            result["duplicates"] = duplicates
+        
         # 生成简报摘要文本文件
         generate_summary_text(filtered_briefs, summary_file)
         
-        # 下载MP3文件
-        mp3_files = download_mp3_files(filtered_briefs, temp_dir)
-        
-        if not mp3_files:
-            logger.warning("没有成功下载的文件，退出")
-            return
-        
-        # 下载每日介绍音频（如果不跳过）
-        intro_file = None
-        if not args.skip_intro:
-            intro_file = download_daily_intro(temp_dir)
-        
-        # 合并MP3文件
-        success = merge_mp3_files(mp3_files, output_file, intro_file)
+        oss_url = None
+        streaming_upload = None
+        episode = None
+        splice = None
+        placed = None  # 滚动节目定稿时每条简报的位置
+        placements = []  # 完整合并时每条简报的位置
+        category_outputs = {}  # 分类节目：{节目名: (输出文件, 简报列表)}
+        if args.rolling or args.delta:
+            if args.start and args.end:
+                episode = RollingEpisode(rolling_episode_key(parse_iso_timestamp(args.start), end_epoch))
+            else:
+                logger.warning("--rolling/--delta 需要 --start 和 --end，本次完整合并")
+        if episode is not None and episode_defs:
+            logger.warning("--episode 不支持滚动合并，本次只生成完整节目")
+        published = (episode.manifest.get("published") or {}) if episode is not None else {}
+        delta = bool(args.delta and episode is not None and published.get("object_name"))
+        if args.delta and episode is not None and not delta:
+            logger.warning("[增量更新] 该窗口没有已发布的滚动节目，按滚动合并处理")
+        if delta:
+            # 增量更新已发布的节目：只替换有变化的片段，未变化的字节在 OSS 服务端复制
+            old_segments = {seg["id"]: seg for seg in published.get("segments", [])}
+            with run_metrics.stage("download"):
+                added, changed_ids, removed_ids = reconcile_rolling_episode(
+                    episode, filtered_briefs, temp_dir, use_cache=not args.no_cache, engine=engine
+                )
+            run_metrics.set_value("briefs_added", added)
+            run_metrics.set_value("briefs_replaced", len(changed_ids))
+            run_metrics.set_value("briefs_removed", len(removed_ids))
+            # 上次定稿后上传失败时，片段已经更新但已发布的对象还是旧的，仍需发布
+            current_layout = {b.id: episode.segment(b.id).get("seq") for b in filtered_briefs if b.id in episode}
+            if not (added or changed_ids or removed_ids) and current_layout == episode.published_layout():
+                logger.info("[增量更新] 节目内容没有变化，无需重新发布")
+                result["briefs"] = len(filtered_briefs)
+                result["success"] = True
+                result["oss_url"] = published.get("url")
+                return result
+            # 沿用已发布节目的文件名和对象名
+            output_file = os.path.join(audio_files_dir, os.path.basename(published["object_name"]))
+            if published.get("summary_object_name"):
+                new_summary_file = os.path.join(audio_files_dir, os.path.basename(published["summary_object_name"]))
+                os.replace(summary_file, new_summary_file)
+                summary_file = new_summary_file
+            result.update(output_file=output_file, summary_file=summary_file)
+            intro_file = None if args.skip_intro else download_daily_intro(temp_dir, engine, when=intro_when)
+            with run_metrics.stage("merge"):
+                placed = finalize_rolling_episode(episode, filtered_briefs, output_file, intro_file)
+            success = bool(placed)
+            run_metrics.set_value("briefs_merged", len(placed or []))
+            splice = {
+                "object_name": published["object_name"],
+                "summary_object_name": published.get("summary_object_name"),
+                "source_size": published.get("size"),
+                # 只复制与已发布对象中同一版本（seq 相同）的片段
+                "copy_ranges": [
+                    (seg["offset"], old_segments[seg["id"]]["offset"], seg["size"])
+                    for seg in placed or []
+                    if seg["id"] in old_segments and seg["id"] not in changed_ids
+                    and seg.get("seq") == old_segments[seg["id"]].get("seq")
+                    and seg["size"] == old_segments[seg["id"]]["size"]
+                ],
+            }
+        elif episode is not None:
+            # 滚动合并：只追加新简报，再按节目顺序拼接
+            with run_metrics.stage("download"):
+                appended = update_rolling_episode(episode, filtered_briefs, temp_dir,
+                                                  use_cache=not args.no_cache, engine=engine)
+            run_metrics.set_value("briefs_added", appended)
+            intro_file = None if args.skip_intro else download_daily_intro(temp_dir, engine, when=intro_when)
+            with run_metrics.stage("merge"):
+                placed = finalize_rolling_episode(episode, filtered_briefs, output_file, intro_file)
+            success = bool(placed)
+            run_metrics.set_value("briefs_merged", len(placed or []))
+        elif episode_defs:
+            # 分类节目：窗口内的简报只下载一次，完整节目和各分类节目用同一批片段并发生成
+            with run_metrics.stage("download"):
+                mp3_files = download_mp3_files(filtered_briefs, temp_dir, use_cache=not args.no_cache, engine=engine)
+            if not mp3_files:
+                logger.warning("没有成功下载的文件，退出")
+                return result
+            intro_file = None if args.skip_intro else download_daily_intro(temp_dir, engine, when=intro_when)
+            with run_metrics.stage("merge"):
+                success, category_outputs = merge_episodes(
+                    filtered_briefs, mp3_files, output_file, episode_defs, intro_file,
+                    mode=args.merge_mode, jobs=args.jobs, placements=placements,
+                )
+            run_metrics.set_value("briefs_merged", len(mp3_files) if success else 0)
+            run_metrics.set_value("category_episodes", len(category_outputs))
+        elif args.no_pipeline:
+            # 下载MP3文件
+            with run_metrics.stage("download"):
+                mp3_files = download_mp3_files(filtered_briefs, temp_dir, use_cache=not args.no_cache, engine=engine)
+            
+            if not mp3_files:
+                logger.warning("没有成功下载的文件，退出")
+                return result
+            
+            # 下载每日介绍音频（如果不跳过）
+            intro_file = None
+            if not args.skip_intro:
+                intro_file = download_daily_intro(temp_dir, engine, when=intro_when)
+            
+            # 合并MP3文件
+            with run_metrics.stage("merge"):
+                success = merge_mp3_files(mp3_files, output_file, intro_file, mode=args.merge_mode, jobs=args.jobs,
+                                          placements=placements)
+            run_metrics.set_value("briefs_merged", len(mp3_files) if success else 0)
+        else:
+            # 边下载边合并，合并的同时把已写好的分片上传到OSS
+            uploader = get_oss_uploader()
+            if uploader and os.path.exists(output_file):
+                # 重跑同一时间窗口时上一次的成品还在，先删掉，免得边写边传读到旧文件的内容
+                os.remove(output_file)
+            streaming_upload = uploader.streaming_upload(output_file) if uploader else None
+            merged_files = []
+            try:
+                # 下载和合并重叠进行，download_merge 是两者合计的耗时，merge 单独累计合并线程上的耗时
+                with run_metrics.stage("download_merge"):
+                    merged_files = download_and_merge(
+                        filtered_briefs, temp_dir, output_file,
+                        with_intro=not args.skip_intro, mode=args.merge_mode,
+                        use_cache=not args.no_cache, engine=engine, jobs=args.jobs, placements=placements,
+                        intro_when=intro_when,
+                    )
+            finally:
+                if streaming_upload:
+                    with run_metrics.stage("upload"):
+                        oss_url = streaming_upload.finish(success=bool(merged_files))
+            success = bool(merged_files)
+            run_metrics.set_value("briefs_merged", len(merged_files))
 
+        result["briefs"] = len(filtered_briefs)
         if success:
             logger.info(f"处理完成！最终文件：{output_file}")
             logger.info(f"简报摘要文件：{summary_file}")
-            # === 新增：自动上传OSS ===
-            oss_url = upload_to_oss(output_file)
+            run_metrics.set_value("output_bytes", os.path.getsize(output_file))
+            # 其它版本（码率、声道、容器）从成品只解码一次，同时编码
+            rendition_files = {}
+            if renditions:
+                with run_metrics.stage("renditions"):
+                    rendition_files = encode_renditions(output_file, renditions)
+                result["renditions"] = {name: {"file": path, "url": None} for name, path in rendition_files.items()}
+            category_summaries = {}
+            if category_outputs:
+                result["episodes"] = {}
+                for name, (path, briefs) in category_outputs.items():
+                    category_summaries[name] = os.path.splitext(summary_file)[0] + f"-{name}.md"
+                    generate_summary_text(briefs, category_summaries[name])
+                    result["episodes"][name] = {"file": path, "summary_file": category_summaries[name],
+                                                "briefs": len(briefs), "url": None, "summary_url": None}
+            # HLS 分段按合并时记录的简报位置切分，不需要再次解码
+            hls_files = []
+            if args.hls:
+                hls_dir = os.path.join(audio_files_dir, f"{os.path.splitext(os.path.basename(output_file))[0]}-hls")
+                with run_metrics.stage("hls"):
+                    hls_files = write_hls(output_file, hls_dir, episode_chapters(filtered_briefs, placements, placed))
+                result["hls_dir"] = hls_dir
+                logger.info(f"[HLS] {len(hls_files) - 2}个分段: {hls_dir}")
+            # === 新增：自动上传OSS（音频、摘要和其它版本并发上传） ===
+            uploader = get_oss_uploader()
+            from oss_uploader import default_object_name
+            hls_prefix = f"{default_object_name(hls_dir)}/" if hls_files else None
+            extra_files = list(rendition_files.values()) + [(path, hls_prefix + os.path.basename(path))
+                                                            for path in hls_files]
+            for name, (path, _) in category_outputs.items():
+                extra_files += [path, category_summaries[name]]
+            extra_urls = []
+            with run_metrics.stage("upload"):
+                if uploader is None:
+                    md_oss_url = None
+                elif streaming_upload:
+                    md_oss_url, *extra_urls = uploader.upload_many([summary_file] + extra_files)
+                elif splice:
+                    oss_url = uploader.upload_spliced(output_file, splice["object_name"], splice["copy_ranges"],
+                                                      source_size=splice["source_size"])
+                    md_oss_url, *extra_urls = uploader.upload_many(
+                        [(summary_file, splice["summary_object_name"])] + extra_files
+                    )
+                else:
+                    oss_url, md_oss_url, *extra_urls = uploader.upload_many([output_file, summary_file] + extra_files)
+            extra_urls += [None] * (len(extra_files) - len(extra_urls))
+            if category_outputs:
+                category_urls = extra_urls[len(extra_urls) - 2 * len(category_outputs):]
+                for name, url, md_url in zip(category_outputs, category_urls[::2], category_urls[1::2]):
+                    result["episodes"][name].update(url=url, summary_url=md_url)
+                    if url:
+                        logger.info(f"OSS文件地址（{name}）：{url}")
+                    elif uploader is not None:
+                        logger.warning(f"OSS上传失败: {name}")
+            if hls_files:
+                hls_urls = extra_urls[len(rendition_files):len(rendition_files) + len(hls_files)]
+                result["hls_url"] = hls_urls[0] if hls_urls and all(hls_urls) else None
+                if result["hls_url"]:
+                    logger.info(f"OSS HLS播放列表：{result['hls_url']}")
+                elif uploader is not None:
+                    logger.warning("OSS上传HLS分段失败")
+            for name, url in zip(rendition_files, extra_urls):
+                result["renditions"][name]["url"] = url
+                if url:
+                    logger.info(f"OSS文件地址（{name}）：{url}")
+                else:
+                    logger.warning(f"OSS上传失败: {name}")
+            if episode is not None and episode.pending and oss_url:
+                # 上传成功后才记录发布信息和新的布局，之后可以用 --delta 增量更新这个对象
+                episode.publish(
+                    object_name=splice["object_name"] if splice else default_object_name(output_file),
+                    summary_object_name=(splice or {}).get("summary_object_name") or default_object_name(summary_file),
+                    url=oss_url,
+                    size=os.path.getsize(output_file),
+                )
+                episode.save()
+            result["success"] = True
+            result["oss_url"] = oss_url
             if oss_url:
                 logger.info(f"OSS文件地址：{oss_url}")
             else:
                 logger.warning("OSS上传失败")
             # === 新增：上传摘要markdown文件 ===
-            md_oss_url = upload_to_oss(summary_file)
             if md_oss_url:
                 logger.info(f"OSS摘要文件地址：{md_oss_url}")
             else:
@@ -705,7 +2369,9 @@ def main():
                 audio_files_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "audio_files")
                 if os.path.exists(audio_files_dir):
                     for f in os.listdir(audio_files_dir):
-                        if f.endswith('.mp3') or f.endswith('.md'):
+                        if f.endswith(('.mp3', '.md', '.m4a', '.opus')):
+                            cleanup_info["files_to_clean"].append(f)
+                        elif f.endswith('-hls') and os.path.isdir(os.path.join(audio_files_dir, f)):
                             cleanup_info["files_to_clean"].append(f)
                 
                 # 写入定时器文件
@@ -721,6 +2387,7 @@ import os
 import json
 import time
 import sys
+import shutil
 
 timer_file = "{timer_file}"
 
@@ -739,7 +2406,10 @@ if os.path.exists(timer_file):
     removed_count = 0
     for f in cleanup_info["files_to_clean"]:
         file_path = os.path.join(audio_files_dir, f)
-        if os.path.exists(file_path):
+        if os.path.isdir(file_path):
+            shutil.rmtree(file_path)
+            removed_count += 1
+        elif os.path.exists(file_path):
             os.remove(file_path)
             removed_count += 1
     
@@ -761,6 +2431,33 @@ if os.path.exists(timer_file):
                 
             except Exception as e:
                 logger.warning(f"设置定时清空时出错: {str(e)}")
+    return result
+
+
+def run_merge(start=None, end=None, hours=None, **options):
+    """
+    进程内调用的合并入口，可在常驻进程中反复调用
+    下载连接池、简报缓存、素材缓存、briefs.json 快照和时间索引、OSS 客户端都保存在模块中，跨调用复用
+    options 与命令行参数同名（如 skip_intro=True、merge_mode="copy"）
+    """
+    args = parse_arguments([])
+    for key, value in options.items():
+        if not hasattr(args, key):
+            raise TypeError(f"未知参数: {key}")
+        setattr(args, key, value)
+    args.start, args.end, args.hours = start, end, hours
+    return run(args)
+
+
+def main(argv=None):
+    """主函数"""
+    args = parse_arguments(argv)
+    
+    # 设置日志级别
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+    
+    return run(args)
 
 
 if __name__ == "__main__":
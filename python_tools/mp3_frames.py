@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+MP3 frame utilities
+
+Parses MPEG audio frame headers, strips ID3/APE tags and Xing/Info/VBRI
+header frames, and concatenates the raw frames of several MP3 files into a
+single stream with a freshly written Xing/Info header, without decoding.
+validate_mp3() uses the same header scan to reject truncated or corrupt
+files before they reach a merge.
+"""
+
+import os
+import struct
+from array import array
+from collections import namedtuple
+
+# MPEG 版本 -> 采样率表
+SAMPLE_RATES = {
+    "1": (44100, 48000, 32000),
+    "2": (22050, 24000, 16000),
+    "2.5": (11025, 12000, 8000),
+}
+
+# (版本族, layer) -> 码率表（kbps），下标即 header 中的 bitrate index
+BITRATES = {
+    ("1", 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    ("1", 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    ("1", 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    ("2", 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    ("2", 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    ("2", 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+_VERSIONS = {0: "2.5", 2: "2", 3: "1"}
+_LAYERS = {1: 3, 2: 2, 3: 1}
+
+# Xing/Info 标签：标识(4) + flags(4) + 帧数(4) + 字节数(4) + TOC(100) + 质量(4)
+XING_TAG_SIZE = 120
+XING_FLAGS = 0x0F
+
+MAX_JUNK_BYTES = 4096  # 校验时允许的无法解析字节数（未知标签等）
+MAX_JUNK_RATIO = 0.01  # 或占文件大小的比例，取较大者
+
+FrameHeader = namedtuple(
+    "FrameHeader",
+    "version layer bitrate sample_rate padding channels channel_mode "
+    "protected frame_length samples",
+)
+
+
+def parse_frame_header(data, offset=0):
+    """解析 offset 处的4字节帧头，非法时返回 None"""
+    if len(data) - offset < 4:
+        return None
+    b0, b1, b2, b3 = data[offset], data[offset + 1], data[offset + 2], data[offset + 3]
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = _VERSIONS.get((b1 >> 3) & 0x03)
+    layer = _LAYERS.get((b1 >> 1) & 0x03)
+    bitrate_index = (b2 >> 4) & 0x0F
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version is None or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    family = "1" if version == "1" else "2"
+    bitrate = BITRATES[(family, layer)][bitrate_index]
+    sample_rate = SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+    channel_mode = (b3 >> 6) & 0x03
+    if layer == 1:
+        frame_length = (12 * bitrate * 1000 // sample_rate + padding) * 4
+        samples = 384
+    elif layer == 2 or version == "1":
+        frame_length = 144 * bitrate * 1000 // sample_rate + padding
+        samples = 1152
+    else:
+        frame_length = 72 * bitrate * 1000 // sample_rate + padding
+        samples = 576
+    return FrameHeader(
+        version=version,
+        layer=layer,
+        bitrate=bitrate,
+        sample_rate=sample_rate,
+        padding=padding,
+        channels=1 if channel_mode == 3 else 2,
+        channel_mode=channel_mode,
+        protected=not (b1 & 0x01),
+        frame_length=frame_length,
+        samples=samples,
+    )
+
+
+def side_info_size(header):
+    """Layer III 侧信息长度（Xing 标签紧随其后）"""
+    if header.version == "1":
+        return 17 if header.channels == 1 else 32
+    return 9 if header.channels == 1 else 17
+
+
+def _id3v2_size(data, offset):
+    """返回 offset 处 ID3v2 标签的总长度，不是标签时返回 0"""
+    if data[offset:offset + 3] != b"ID3" or len(data) - offset < 10:
+        return 0
+    size_bytes = data[offset + 6:offset + 10]
+    if any(b & 0x80 for b in size_bytes):
+        return 0
+    size = 0
+    for b in size_bytes:
+        size = (size << 7) | b
+    footer = 10 if data[offset + 5] & 0x10 else 0
+    return 10 + size + footer
+
+
+def _trailing_tag_size(data, offset):
+    """识别文件尾部的 ID3v1 / APE 标签，返回应跳过的长度"""
+    if data[offset:offset + 3] == b"TAG" and len(data) - offset == 128:
+        return 128
+    if data[offset:offset + 8] == b"APETAGEX":
+        return len(data) - offset
+    if data[offset:offset + 9] == b"LYRICSBEG":
+        return len(data) - offset
+    return 0
+
+
+def _compatible(a, b):
+    return a.version == b.version and a.layer == b.layer and a.sample_rate == b.sample_rate
+
+
+class Mp3Info:
+    """一个MP3文件的帧索引（只解析帧头，不解码）"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file_size = 0
+        self.header = None  # 第一个音频帧的帧头
+        self.frame_offsets = array("L")
+        self.frame_sizes = array("H")
+        self.bitrates = set()
+        self.junk_bytes = 0
+        self.truncated = False
+        self.has_xing = False
+        self.encoder_delay = None
+        self.encoder_padding = None
+        self.xing_frames = None  # Xing/Info 头记录的音频帧数
+        self.format_changes = 0  # 与首帧格式不同的帧数（流中途改变采样率、版本或声道数）
+
+    @property
+    def frame_count(self):
+        return len(self.frame_offsets)
+
+    @property
+    def sample_rate(self):
+        return self.header.sample_rate if self.header else None
+
+    @property
+    def channels(self):
+        return self.header.channels if self.header else None
+
+    @property
+    def format_key(self):
+        """可直接拼接帧的格式标识：(版本, layer, 采样率, 声道数)"""
+        if not self.header:
+            return None
+        h = self.header
+        return (h.version, h.layer, h.sample_rate, h.channels)
+
+    @property
+    def samples(self):
+        return self.frame_count * self.header.samples if self.header else 0
+
+    @property
+    def duration(self):
+        """时长（秒），由帧数推算"""
+        return self.samples / self.header.sample_rate if self.header else 0.0
+
+    @property
+    def audio_bytes(self):
+        return sum(self.frame_sizes)
+
+    @property
+    def is_contiguous(self):
+        """音频帧之间没有夹杂其它字节"""
+        if not self.frame_offsets:
+            return True
+        span = self.frame_offsets[-1] + self.frame_sizes[-1] - self.frame_offsets[0]
+        return span == self.audio_bytes
+
+    @property
+    def is_cbr(self):
+        return len(self.bitrates) <= 1
+
+    @property
+    def copy_safe(self):
+        """可以直接复制帧拼接：Layer III，且整个流的格式不变"""
+        return bool(self.frame_offsets) and self.header.layer == 3 and not self.format_changes
+
+    def to_dict(self):
+        """序列化帧索引，便于缓存"""
+        return {
+            "file_size": self.file_size,
+            "header": list(self.header) if self.header else None,
+            "frame_offsets": self.frame_offsets.tolist(),
+            "frame_sizes": self.frame_sizes.tolist(),
+            "bitrates": sorted(self.bitrates),
+            "junk_bytes": self.junk_bytes,
+            "truncated": self.truncated,
+            "has_xing": self.has_xing,
+            "encoder_delay": self.encoder_delay,
+            "encoder_padding": self.encoder_padding,
+            "xing_frames": self.xing_frames,
+            "format_changes": self.format_changes,
+        }
+
+    @classmethod
+    def from_dict(cls, path, data):
+        """从 to_dict() 的结果恢复帧索引，path 指向内容相同的文件"""
+        info = cls(path)
+        info.file_size = data["file_size"]
+        info.header = FrameHeader(*data["header"]) if data["header"] else None
+        info.frame_offsets = array("L", data["frame_offsets"])
+        info.frame_sizes = array("H", data["frame_sizes"])
+        info.bitrates = set(data["bitrates"])
+        info.junk_bytes = data["junk_bytes"]
+        info.truncated = data["truncated"]
+        info.has_xing = data["has_xing"]
+        info.encoder_delay = data["encoder_delay"]
+        info.encoder_padding = data["encoder_padding"]
+        info.xing_frames = data.get("xing_frames")
+        info.format_changes = data.get("format_changes", 0)
+        return info
+
+    def __str__(self):
+        if not self.header:
+            return f"{os.path.basename(self.path)} (无有效帧)"
+        return (f"{os.path.basename(self.path)} (MPEG{self.header.version} L{self.header.layer}, "
+                f"{self.sample_rate}Hz, {self.channels}ch, {self.frame_count}帧, {self.duration:.2f}秒)")
+
+
+def _parse_xing(data, offset, header, info):
+    """检测首帧中的 Xing/Info/VBRI 标签，并读取 LAME 编码延迟"""
+    xing_at = offset + 4 + (2 if header.protected else 0) + side_info_size(header)
+    tag = data[xing_at:xing_at + 4]
+    if tag in (b"Xing", b"Info"):
+        flags = struct.unpack(">I", data[xing_at + 4:xing_at + 8])[0]
+        if flags & 0x1 and len(data) >= xing_at + 12:
+            info.xing_frames = struct.unpack(">I", data[xing_at + 8:xing_at + 12])[0]
+        lame_at = xing_at + 8
+        for bit, size in ((0x1, 4), (0x2, 4), (0x4, 100), (0x8, 4)):
+            if flags & bit:
+                lame_at += size
+        if data[lame_at:lame_at + 4] == b"LAME" or data[lame_at:lame_at + 4] == b"Lavc":
+            raw = data[lame_at + 21:lame_at + 24]
+            if len(raw) == 3:
+                info.encoder_delay = (raw[0] << 4) | (raw[1] >> 4)
+                info.encoder_padding = ((raw[1] & 0x0F) << 8) | raw[2]
+        return True
+    return data[offset + 36:offset + 40] == b"VBRI"
+
+
+def scan_mp3(path):
+    """扫描MP3文件的帧结构，返回 Mp3Info；跳过 ID3/APE 标签与 Xing/Info/VBRI 头帧"""
+    info = Mp3Info(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    info.file_size = n = len(data)
+
+    pos = 0
+    while True:
+        size = _id3v2_size(data, pos)
+        if not size:
+            break
+        pos += size
+
+    first = True
+    while pos + 4 <= n:
+        header = parse_frame_header(data, pos)
+        if header and info.header and not _compatible(header, info.header):
+            # 后面紧跟同格式的帧时是真正的格式变化，否则只是碰巧像帧头的数据
+            nxt = parse_frame_header(data, pos + header.frame_length)
+            if nxt and _compatible(header, nxt):
+                # 无法与首帧拼接，跳过整帧（不计入无法解析的字节）
+                info.format_changes += 1
+                pos += header.frame_length
+                continue
+            header = None
+        elif header and info.header and header.channels != info.header.channels:
+            info.format_changes += 1
+        if header and first:
+            # 首帧需要下一帧确认，避免把随机数据误判为帧同步
+            nxt = parse_frame_header(data, pos + header.frame_length)
+            if pos + header.frame_length < n and not (nxt and _compatible(header, nxt)):
+                header = None
+        if header is None:
+            tail = _trailing_tag_size(data, pos)
+            if tail:
+                break
+            pos += 1
+            info.junk_bytes += 1
+            continue
+        if pos + header.frame_length > n:
+            info.truncated = True
+            break
+        if first:
+            first = False
+            info.header = header
+            if header.layer == 3 and _parse_xing(data, pos, header, info):
+                info.has_xing = True
+                pos += header.frame_length
+                continue
+        info.frame_offsets.append(pos)
+        info.frame_sizes.append(header.frame_length)
+        info.bitrates.add(header.bitrate)
+        pos += header.frame_length
+    return info
+
+
+def validate_mp3(path, expected_size=None):
+    """
+    只解析帧头检查MP3是否完整（不解码），返回 (Mp3Info, 问题列表)，列表为空表示通过
+    检查：有可用的音频帧；最后一帧完整；帧数不少于 Xing/Info 头记录的帧数（即时长不短于编码时的时长）；
+    文件大小与 expected_size（Content-Length 或缓存记录）一致；帧之间没有大段无法解析的数据
+    流中途改变格式不算损坏，但 copy_safe 为 False，合并时不走帧级拼接
+    """
+    try:
+        info = scan_mp3(path)
+    except OSError as e:
+        return Mp3Info(path), [f"无法读取: {e}"]
+    problems = []
+    if not info.frame_count:
+        problems.append("没有有效的MP3帧")
+        return info, problems
+    if info.truncated:
+        problems.append("最后一帧不完整，文件被截断")
+    if info.xing_frames and info.frame_count < info.xing_frames - 1:
+        missing = (info.xing_frames - info.frame_count) * info.header.samples / info.sample_rate
+        problems.append(f"帧数少于头部记录 ({info.frame_count} < {info.xing_frames})，缺少 {missing:.1f} 秒")
+    if expected_size is not None and info.file_size != expected_size:
+        problems.append(f"文件大小 {info.file_size} 与预期的 {expected_size} 不一致")
+    if info.junk_bytes > max(MAX_JUNK_BYTES, info.file_size * MAX_JUNK_RATIO):
+        problems.append(f"有 {info.junk_bytes} 字节无法解析为MP3帧")
+    return info, problems
+
+
+def _build_header_bytes(template, bitrate_index):
+    """以模板帧头为基础构造一个不带CRC、无填充的帧头"""
+    version_bits = {"2.5": 0, "2": 2, "1": 3}[template.version]
+    layer_bits = {3: 1, 2: 2, 1: 3}[template.layer]
+    sample_rate_index = SAMPLE_RATES[template.version].index(template.sample_rate)
+    b1 = 0xE0 | (version_bits << 3) | (layer_bits << 1) | 0x01
+    b2 = (bitrate_index << 4) | (sample_rate_index << 2)
+    b3 = (template.channel_mode << 6)
+    return bytes((0xFF, b1, b2, b3))
+
+
+def _xing_frame_layout(template, preferred_bitrate=None):
+    """选择能容纳 Xing 标签的码率，返回 (帧头字节, 帧长)"""
+    family = "1" if template.version == "1" else "2"
+    table = BITRATES[(family, 3)]
+    need = 4 + side_info_size(template) + XING_TAG_SIZE
+    candidates = list(range(1, 15))
+    if preferred_bitrate in table:
+        candidates.insert(0, table.index(preferred_bitrate))
+    for index in candidates:
+        header = parse_frame_header(_build_header_bytes(template, index))
+        if header.frame_length >= need:
+            return _build_header_bytes(template, index), header.frame_length
+    raise ValueError("无法构造 Xing 头帧")
+
+
+class Mp3FrameWriter:
+    """
+    把多个同格式MP3文件的音频帧依次写入输出文件
+    先写入占位头帧，close() 时回填 Xing/Info 标签（帧数、字节数、TOC）
+    """
+
+    def __init__(self, output_file, template):
+        if template.header is None or template.header.layer != 3:
+            raise ValueError(f"不支持的帧格式: {template}")
+        self.output_file = output_file
+        self.header = template.header
+        self.format_key = template.format_key
+        preferred = next(iter(template.bitrates)) if template.is_cbr and template.bitrates else None
+        self._xing_header, self._xing_length = _xing_frame_layout(self.header, preferred)
+        self._fh = open(output_file, "wb")
+        self._fh.write(b"\x00" * self._xing_length)
+        self._frame_positions = array("L")
+        self.bitrates = set()
+        self.audio_bytes = 0
+
+    @property
+    def frame_count(self):
+        return len(self._frame_positions)
+
+    @property
+    def samples(self):
+        return self.frame_count * self.header.samples
+
+    @property
+    def duration(self):
+        return self.samples / self.header.sample_rate
+
+    def byte_offset(self, frame_index):
+        """第 frame_index 帧在输出文件中的字节偏移（含开头的 Xing/Info 头帧）"""
+        if frame_index >= self.frame_count:
+            return self._xing_length + self.audio_bytes
+        return self._xing_length + self._frame_positions[frame_index]
+
+    def append(self, info, start=0, end=None):
+        """追加 info 中 [start, end) 范围的帧，返回 (起始帧号, 写入帧数)"""
+        if info.format_key != self.format_key:
+            raise ValueError(f"帧格式不一致，无法直接拼接: {info}")
+        end = info.frame_count if end is None else end
+        first_frame = self.frame_count
+        if end <= start:
+            return first_frame, 0
+        for i in range(start, end):
+            self._frame_positions.append(self.audio_bytes)
+            self.audio_bytes += info.frame_sizes[i]
+        self.bitrates.update(info.bitrates)
+        with open(info.path, "rb") as src:
+            if info.is_contiguous:
+                src.seek(info.frame_offsets[start])
+                remaining = info.frame_offsets[end - 1] + info.frame_sizes[end - 1] - info.frame_offsets[start]
+                while remaining > 0:
+                    chunk = src.read(min(1024 * 1024, remaining))
+                    if not chunk:
+                        raise IOError(f"读取帧数据失败: {info.path}")
+                    self._fh.write(chunk)
+                    remaining -= len(chunk)
+            else:
+                for i in range(start, end):
+                    src.seek(info.frame_offsets[i])
+                    self._fh.write(src.read(info.frame_sizes[i]))
+        return first_frame, end - start
+
+    def _xing_frame(self):
+        total_bytes = self._xing_length + self.audio_bytes
+        frames = self.frame_count
+        toc = bytearray(100)
+        for i in range(100):
+            if frames:
+                pos = self._xing_length + self._frame_positions[min(frames - 1, i * frames // 100)]
+                toc[i] = min(255, pos * 256 // total_bytes)
+        tag = b"Info" if len(self.bitrates) <= 1 else b"Xing"
+        body = tag + struct.pack(">III", XING_FLAGS, frames, total_bytes) + bytes(toc) + struct.pack(">I", 0)
+        frame = bytearray(self._xing_length)
+        frame[0:4] = self._xing_header
+        offset = 4 + side_info_size(self.header)
+        frame[offset:offset + len(body)] = body
+        return bytes(frame)
+
+    def close(self):
+        """回填 Xing/Info 头帧并关闭文件"""
+        if self._fh.closed:
+            return
+        self._fh.seek(0)
+        self._fh.write(self._xing_frame())
+        self._fh.close()
+
+    def abort(self):
+        """放弃输出并删除文件"""
+        if not self._fh.closed:
+            self._fh.close()
+        if os.path.exists(self.output_file):
+            os.remove(self.output_file)
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+OSS uploader
+
+A reusable Aliyun OSS client for the merge scripts. One oss2.Bucket is shared
+by every upload; large files go up as multipart uploads with parts sent in
+parallel and a JSON checkpoint, so an interrupted upload resumes with the
+parts that are still missing. StreamingUpload tails a file that is still being
+written and uploads finished parts while the merge runs; the first part, which
+holds the header rewritten when the writer closes, is sent last, and before
+the upload is completed every streamed part is checked against the finished
+file and sent again if it no longer matches.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import oss2  # 阿里云 OSS Python SDK
+
+import run_metrics
+from audio_cache import CACHE_DIR, _atomic_write
+
+logger = logging.getLogger("news-audio")
+
+PART_SIZE = 1024 * 1024  # 分片大小 1MB
+MIN_PART_SIZE = 100 * 1024  # OSS 要求除最后一片外每片不小于 100KB
+MULTIPART_THRESHOLD = 4 * 1024 * 1024  # 超过 4MB 的文件使用分片上传
+UPLOAD_WORKERS = 4  # 并行上传的分片数
+POLL_INTERVAL = 0.5  # 流式上传检查文件增长的间隔（秒）
+ENV_KEYS = ("OSS_ENDPOINT", "OSS_ACCESS_KEY_ID", "OSS_ACCESS_KEY_SECRET", "OSS_BUCKET_NAME", "OSS_PUBLIC_URL_PREFIX")
+
+
+def plan_splice_parts(size, copy_ranges, part_size=PART_SIZE, min_part=MIN_PART_SIZE):
+    """
+    为增量更新规划分片：返回 [(起始, 结束, 旧对象偏移或 None)]，None 表示从本地上传
+    copy_ranges: [(本地偏移, 旧对象偏移, 长度)]，本地文件中与旧对象内容相同的区间
+    除最后一片外每片不小于 min_part；太短的本地片从相邻的复制区间借字节，借不到时整个并入本地上传
+    """
+    parts = []
+    pos = 0
+    for dst, src, length in sorted(copy_ranges):
+        if dst < pos or dst + length > size or length < min_part:
+            continue
+        if dst > pos:
+            parts.append([pos, dst, None])
+        last = parts[-1] if parts else None
+        if last and last[2] is not None and last[1] == dst and last[2] + (last[1] - last[0]) == src:
+            # 与上一个复制区间首尾相接，合并成一片
+            last[1] = dst + length
+        else:
+            parts.append([dst, dst + length, src])
+        pos = dst + length
+    if pos < size:
+        parts.append([pos, size, None])
+    i = 0
+    while i < len(parts):
+        start, end, src = parts[i]
+        if src is None and i + 1 < len(parts) and parts[i + 1][2] is None:
+            parts[i][1] = parts[i + 1][1]
+            del parts[i + 1]
+            continue
+        if src is None and end - start < min_part and i + 1 < len(parts):
+            nxt = parts[i + 1]
+            borrow = min_part - (end - start)
+            if nxt[1] - nxt[0] - borrow >= min_part or i + 2 == len(parts) and nxt[1] - nxt[0] > borrow:
+                parts[i][1] += borrow
+                nxt[0] += borrow
+                nxt[2] += borrow
+            else:
+                parts[i][1] = nxt[1]
+                del parts[i + 1]
+                continue
+        i += 1
+    # 本地上传的部分按分片大小切开
+    planned = []
+    for start, end, src in parts:
+        if src is not None:
+            planned.append((start, end, src))
+            continue
+        count = max(1, -(-(end - start) // part_size))
+        step = -(-(end - start) // count)
+        for offset in range(start, end, step):
+            planned.append((offset, min(end, offset + step), None))
+    return planned
+
+
+def _results(futures):
+    """按顺序取回各分片的结果；有一片失败时取消还没开始的分片、等正在上传的结束后再抛出异常"""
+    try:
+        return [future.result() for future in futures]
+    except Exception:
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        raise
+
+
+def default_object_name(local_file):
+    """默认的对象名：news-audio/<文件名>"""
+    return f"news-audio/{os.path.basename(local_file)}"
+
+
+class OssUploader:
+    """共享 Bucket 客户端的 OSS 上传器，可在多次上传之间复用"""
+
+    def __init__(self, endpoint, access_key_id, access_key_secret, bucket_name, url_prefix,
+                 part_size=PART_SIZE, workers=UPLOAD_WORKERS, checkpoint_dir=None, bucket=None):
+        self.url_prefix = url_prefix.rstrip("/")
+        self.part_size = part_size
+        self.bucket = bucket or oss2.Bucket(oss2.Auth(access_key_id, access_key_secret), endpoint, bucket_name)
+        self.checkpoint_dir = checkpoint_dir or os.path.join(CACHE_DIR, "uploads")
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="oss-part")
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """
+        根据环境变量创建上传器，配置不完整时返回 None
+        环境变量：
+            OSS_ENDPOINT, OSS_ACCESS_KEY_ID, OSS_ACCESS_KEY_SECRET, OSS_BUCKET_NAME, OSS_PUBLIC_URL_PREFIX
+        """
+        values = [os.environ.get(key) for key in ENV_KEYS]
+        if not all(values):
+            logger.error(f"OSS配置不完整，请设置环境变量：{', '.join(ENV_KEYS)}")
+            return None
+        return cls(*values, **kwargs)
+
+    def public_url(self, object_name):
+        return self.url_prefix + "/" + object_name
+
+    # ---- 分片上传 ----
+
+    def _checkpoint_path(self, local_file, object_name):
+        key = hashlib.sha1(f"{os.path.abspath(local_file)}\n{object_name}".encode("utf-8")).hexdigest()
+        return os.path.join(self.checkpoint_dir, f"{key}.json")
+
+    def _load_checkpoint(self, path, local_file, object_name):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return None
+        st = os.stat(local_file)
+        if (checkpoint.get("object_name") != object_name or checkpoint.get("size") != st.st_size
+                or checkpoint.get("mtime") != st.st_mtime or checkpoint.get("part_size") != self.part_size):
+            # 文件已变化，旧的分片不能再用
+            self._abort_quietly(object_name, checkpoint.get("upload_id"))
+            return None
+        return checkpoint
+
+    def _abort_quietly(self, object_name, upload_id):
+        if not upload_id:
+            return
+        try:
+            self.bucket.abort_multipart_upload(object_name, upload_id)
+        except Exception as e:
+            logger.debug(f"[上传] 取消分片上传失败: {e}")
+
+    def _upload_part(self, object_name, upload_id, part_number, local_file, offset, size):
+        with open(local_file, "rb") as f:
+            f.seek(offset)
+            data = f.read(size)
+        result = self.bucket.upload_part(object_name, upload_id, part_number, data)
+        run_metrics.count("upload_bytes", len(data))
+        return part_number, result.etag
+
+    def _complete(self, object_name, upload_id, parts):
+        part_infos = [oss2.models.PartInfo(number, parts[number]) for number in sorted(parts)]
+        self.bucket.complete_multipart_upload(object_name, upload_id, part_infos)
+
+    def _multipart_upload(self, local_file, object_name):
+        checkpoint_file = self._checkpoint_path(local_file, object_name)
+        checkpoint = self._load_checkpoint(checkpoint_file, local_file, object_name)
+        st = os.stat(local_file)
+        if checkpoint:
+            logger.info(f"[上传] 续传 {object_name}，已完成 {len(checkpoint['parts'])} 个分片")
+        else:
+            upload_id = self.bucket.init_multipart_upload(object_name).upload_id
+            checkpoint = {
+                "object_name": object_name,
+                "upload_id": upload_id,
+                "size": st.st_size,
+                "mtime": st.st_mtime,
+                "part_size": self.part_size,
+                "parts": {},
+            }
+            _atomic_write(checkpoint_file, json.dumps(checkpoint).encode("utf-8"))
+        upload_id = checkpoint["upload_id"]
+        parts = {int(k): v for k, v in checkpoint["parts"].items()}
+        lock = threading.Lock()
+
+        def upload_one(part_number):
+            offset = (part_number - 1) * self.part_size
+            number, etag = self._upload_part(object_name, upload_id, part_number, local_file,
+                                             offset, min(self.part_size, st.st_size - offset))
+            with lock:
+                parts[number] = etag
+                checkpoint["parts"] = {str(k): v for k, v in parts.items()}
+                _atomic_write(checkpoint_file, json.dumps(checkpoint).encode("utf-8"))
+
+        total_parts = max(1, -(-st.st_size // self.part_size))
+        missing = [n for n in range(1, total_parts + 1) if n not in parts]
+        _results([self._executor.submit(upload_one, n) for n in missing])
+        self._complete(object_name, upload_id, parts)
+        os.remove(checkpoint_file)
+
+    def upload(self, local_file, object_name=None):
+        """上传本地文件，返回公网URL，失败返回 None；大文件使用可续传的并行分片上传"""
+        object_name = object_name or default_object_name(local_file)
+        start_time = time.time()
+        try:
+            size = os.path.getsize(local_file)
+            if size > MULTIPART_THRESHOLD:
+                try:
+                    self._multipart_upload(local_file, object_name)
+                except oss2.exceptions.NoSuchUpload:
+                    # 检查点对应的上传已过期，重新开始
+                    os.remove(self._checkpoint_path(local_file, object_name))
+                    self._multipart_upload(local_file, object_name)
+            else:
+                self.bucket.put_object_from_file(object_name, local_file)
+                run_metrics.count("upload_bytes", size)
+        except Exception as e:
+            logger.error(f"上传到OSS失败: {e}")
+            return None
+        url = self.public_url(object_name)
+        logger.info(f"已上传到OSS: {url}，耗时 {time.time() - start_time:.2f}秒")
+        return url
+
+    def _copy_part(self, object_name, upload_id, part_number, source_offset, size):
+        result = self.bucket.upload_part_copy(
+            self.bucket.bucket_name, object_name, (source_offset, source_offset + size - 1),
+            object_name, upload_id, part_number,
+        )
+        run_metrics.count("upload_copied_bytes", size)
+        return part_number, result.etag
+
+    def upload_spliced(self, local_file, object_name, copy_ranges, source_size=None):
+        """
+        更新 OSS 上已存在的对象：与旧对象内容相同的字节区间用服务端复制（UploadPartCopy），
+        只上传变化的部分；旧对象大小与 source_size 不符或出错时整个文件重新上传
+        copy_ranges: [(本地偏移, 旧对象偏移, 长度)]
+        """
+        start_time = time.time()
+        upload_id = None
+        try:
+            if source_size is not None:
+                current = self.bucket.head_object(object_name).content_length
+                if current != source_size:
+                    raise ValueError(f"线上对象大小 {current} 与记录的 {source_size} 不一致")
+            size = os.path.getsize(local_file)
+            plan = plan_splice_parts(size, copy_ranges, self.part_size)
+            upload_id = self.bucket.init_multipart_upload(object_name).upload_id
+            futures = []
+            for number, (start, end, src) in enumerate(plan, 1):
+                if src is None:
+                    futures.append(self._executor.submit(
+                        self._upload_part, object_name, upload_id, number, local_file, start, end - start))
+                else:
+                    futures.append(self._executor.submit(
+                        self._copy_part, object_name, upload_id, number, src, end - start))
+            parts = dict(_results(futures))
+            self._complete(object_name, upload_id, parts)
+        except Exception as e:
+            logger.warning(f"[上传] 增量更新失败，重新上传整个文件: {e}")
+            self._abort_quietly(object_name, upload_id)
+            return self.upload(local_file, object_name)
+        uploaded = sum(end - start for start, end, src in plan if src is None)
+        url = self.public_url(object_name)
+        logger.info(f"已增量更新OSS对象: {url}，上传 {uploaded}/{size} 字节，其余服务端复制，"
+                    f"耗时 {time.time() - start_time:.2f}秒")
+        return url
+
+    def upload_many(self, files):
+        """
+        并发上传多个互不依赖的文件
+        files: 本地路径列表，或 (本地路径, 对象名) 列表
+        返回与输入顺序一致的URL列表（失败的为 None）
+        """
+        jobs = [f if isinstance(f, tuple) else (f, None) for f in files]
+        if not jobs:
+            return []
+        with ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="oss-upload") as executor:
+            return list(executor.map(lambda job: self.upload(*job), jobs))
+
+    def streaming_upload(self, local_file, object_name=None):
+        """开始边写边传，返回已启动的 StreamingUpload"""
+        upload = StreamingUpload(self, local_file, object_name)
+        upload.start()
+        return upload
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class StreamingUpload:
+    """
+    边写边传：文件还在写入时，把已经写满的分片先上传
+    输出文件只会在末尾追加，只有开头的 Xing/Info 头会在写入结束时回填，
+    所以第 1 个分片留到 finish() 时最后上传
+    文件若被截断重写（或开始时还是上一次的旧文件），已传的分片可能与成品不一致：
+    finish() 按分片的 MD5（OSS 分片的 ETag）逐片核对成品，不一致或缺少的分片重新上传
+    """
+
+    def __init__(self, uploader, local_file, object_name=None):
+        self.uploader = uploader
+        self.local_file = local_file
+        self.object_name = object_name or default_object_name(local_file)
+        self.part_size = uploader.part_size
+        self.upload_id = None
+        self.parts = {}
+        self.error = None
+        self._futures = []
+        self._next_part = 2
+        self._done = threading.Event()
+        self._thread = None
+
+    def start(self):
+        try:
+            self.upload_id = self.uploader.bucket.init_multipart_upload(self.object_name).upload_id
+        except Exception as e:
+            self.error = e
+            logger.warning(f"[上传] 无法开始边写边传，将在合并完成后上传: {e}")
+            return
+        self._thread = threading.Thread(target=self._tail, name="oss-tail", daemon=True)
+        self._thread.start()
+
+    def _submit_ready(self, size, final=False):
+        """提交所有已写满的分片；final 时连同最后不满一片的部分一起提交"""
+        while True:
+            offset = (self._next_part - 1) * self.part_size
+            if offset >= size or (not final and offset + self.part_size > size):
+                return
+            part_size = min(self.part_size, size - offset)
+            future = self.uploader._executor.submit(
+                self.uploader._upload_part, self.object_name, self.upload_id,
+                self._next_part, self.local_file, offset, part_size,
+            )
+            self._futures.append(future)
+            self._next_part += 1
+
+    def _tail(self):
+        # 留一片余量：ffmpeg 写入时可能还在缓冲区里，已写满下一片才认为上一片稳定
+        while not self._done.wait(POLL_INTERVAL):
+            try:
+                size = os.path.getsize(self.local_file)
+            except OSError:
+                continue
+            self._submit_ready(max(0, size - self.part_size))
+
+    def finish(self, success=True):
+        """写入结束后调用：上传剩余分片和第 1 个分片并合并，返回公网URL；失败时返回 None"""
+        self._done.set()
+        if self._thread:
+            self._thread.join()
+        if not success or self.error or not self.upload_id:
+            self._abort()
+            if success:
+                return self.uploader.upload(self.local_file, self.object_name)
+            return None
+        start_time = time.time()
+        try:
+            size = os.path.getsize(self.local_file)
+            self._submit_ready(size, final=True)
+            first = self.uploader._executor.submit(
+                self.uploader._upload_part, self.object_name, self.upload_id,
+                1, self.local_file, 0, min(self.part_size, size),
+            )
+            for future in self._futures + [first]:
+                number, etag = future.result()
+                self.parts[number] = etag
+            stale = self._stale_parts(size)
+            if stale:
+                logger.info(f"[上传] {len(stale)}个分片与写完的文件不一致，重新上传")
+                run_metrics.count("upload_stale_parts", len(stale))
+                futures = [self.uploader._executor.submit(
+                    self.uploader._upload_part, self.object_name, self.upload_id,
+                    number, self.local_file, (number - 1) * self.part_size,
+                    min(self.part_size, size - (number - 1) * self.part_size),
+                ) for number in stale]
+                for future in futures:
+                    number, etag = future.result()
+                    self.parts[number] = etag
+            self.uploader._complete(self.object_name, self.upload_id, self.parts)
+        except Exception as e:
+            logger.warning(f"[上传] 边写边传失败，重新上传整个文件: {e}")
+            self._abort()
+            return self.uploader.upload(self.local_file, self.object_name)
+        url = self.uploader.public_url(self.object_name)
+        logger.info(f"已上传到OSS: {url}（{len(self.parts)}个分片，写入结束后耗时 {time.time() - start_time:.2f}秒）")
+        return url
+
+    def _stale_parts(self, size):
+        """返回需要重新上传的分片号：缺少的，或 ETag 与成品中对应区间的 MD5 不一致的；多出的分片直接丢弃"""
+        total = max(1, -(-size // self.part_size))
+        for number in [n for n in self.parts if n > total]:
+            del self.parts[number]
+        stale = []
+        with open(self.local_file, "rb") as f:
+            for number in range(2, total + 1):
+                f.seek((number - 1) * self.part_size)
+                digest = hashlib.md5(f.read(self.part_size)).hexdigest()
+                etag = self.parts.get(number)
+                if not etag or etag.strip('"').lower() != digest:
+                    stale.append(number)
+        return stale
+
+    def _abort(self):
+        for future in self._futures:
+            future.cancel()
+        for future in self._futures:
+            try:
+                future.result()
+            except Exception:
+                pass
+        self.uploader._abort_quietly(self.object_name, self.upload_id)
@@ -0,0 +1,444 @@
+#!/usr/bin/env python3
+"""
+On-demand episode rendering service
+
+A small local HTTP service around the merge pipeline that renders an episode
+for any time range or "last N hours":
+
+    GET /episode.mp3?start=2025-04-26T06:50:00%2B08:00&end=2025-04-26T16:50:00%2B08:00
+    GET /episode.mp3?hours=12[&skip_intro=1]
+    GET /healthz
+
+The window is resolved against the shared briefs.json index to a set of
+briefs; the rendered MP3 is cached on disk under a hash of that brief set
+(ids and audio URLs plus the merge settings), so different ranges that cover
+the same briefs share one file, and the cache is evicted least recently used
+once it exceeds its size limit. Concurrent identical requests wait for a
+single render instead of starting their own. Responses carry an ETag and
+honour HTTP Range, so players can start playback and seek immediately.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from merge_mp3_briefs import (
+    CACHE_DIR, DEFAULT_BRIEFS_JSON_URL, MAX_DOWNLOAD_CONCURRENCY, download_daily_intro, download_mp3_files,
+    filter_briefs_by_time_range, get_brief_cache, get_download_engine, get_duplicate_index, get_feed_index, logger,
+    merge_mp3_files, parse_iso_timestamp,
+)
+from brief_dedup import dedup_briefs
+from audio_cache import _atomic_write
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8790
+RENDER_CACHE_MAX_BYTES = 2 * 1024 * 1024 * 1024  # 渲染结果缓存上限 2GB
+FEED_REFRESH_SECONDS = 60  # 两次请求 briefs.json 的最短间隔
+MAX_WINDOW_HOURS = 7 * 24  # 单次渲染的最长时间窗口
+MAX_CONCURRENT_RENDERS = 2  # 同时进行的渲染数
+SERVE_CHUNK = 256 * 1024  # 输出响应时每次读取的字节数
+RANGE_PATTERN = re.compile(r"bytes=(\d*)-(\d*)", re.ASCII)
+
+
+class RenderCache:
+    """渲染好的节目的磁盘缓存，以简报集合的哈希为键，总大小超过上限时按最近使用时间淘汰"""
+
+    def __init__(self, cache_dir=None, max_bytes=RENDER_CACHE_MAX_BYTES):
+        self.cache_dir = os.path.join(cache_dir or CACHE_DIR, "rendered")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def get(self, key):
+        """命中时返回文件路径并刷新使用时间，否则返回 None"""
+        path = self.path(key)
+        try:
+            os.utime(path, None)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, src, meta=None):
+        """把渲染好的 src 移入缓存（meta 写入同名 .json），返回缓存路径"""
+        path = self.path(key)
+        os.replace(src, path)
+        if meta is not None:
+            _atomic_write(f"{path[:-4]}.json", json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        """
+        总大小超过上限时按最近使用时间从旧到新删除
+        正在发送的文件被删除后，已打开的文件句柄仍可读完
+        """
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.cache_dir):
+                if not name.endswith(".mp3"):
+                    continue
+                full = os.path.join(self.cache_dir, name)
+                try:
+                    st = os.stat(full)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, full))
+                total += st.st_size
+            entries.sort()
+            for _, size, full in entries:
+                if total <= self.max_bytes:
+                    break
+                if full == keep:
+                    continue
+                for victim in (full, f"{full[:-4]}.json"):
+                    try:
+                        os.remove(victim)
+                    except OSError:
+                        pass
+                total -= size
+                logger.debug(f"[渲染] 淘汰缓存: {os.path.basename(full)}")
+
+
+class SingleFlight:
+    """相同 key 的并发调用只执行一次，其余调用等待并共享结果（或异常）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> [完成事件, 结果, 异常]
+
+    def do(self, key, fn):
+        """返回 (结果, 是否与其它调用共享了结果)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = [threading.Event(), None, None]
+        if not leader:
+            call[0].wait()
+            if call[2] is not None:
+                raise call[2]
+            return call[1], True
+        try:
+            call[1] = fn()
+        except BaseException as e:
+            call[2] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call[0].set()
+        return call[1], False
+
+
+def brief_set_key(briefs, skip_intro=False, intro_date=None, merge_mode="auto"):
+    """简报集合（id 和音频地址，按节目顺序）加上合并设置的哈希，作为渲染缓存的键"""
+    digest = hashlib.sha256()
+    digest.update(json.dumps({
+        "briefs": [[b.id, b.audio_url] for b in briefs],
+        "intro": None if skip_intro else intro_date,
+        "merge_mode": merge_mode,
+    }, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+class EpisodeRenderer:
+    """按时间区间渲染节目：共享 briefs.json 索引、下载引擎和简报缓存，结果进入 RenderCache"""
+
+    def __init__(self, url=DEFAULT_BRIEFS_JSON_URL, cache=None, merge_mode="auto",
+                 max_renders=MAX_CONCURRENT_RENDERS, use_cache=True):
+        self.url = url
+        self.cache = cache or RenderCache()
+        self.merge_mode = merge_mode
+        self.use_cache = use_cache
+        self.flight = SingleFlight()
+        self._renders = threading.BoundedSemaphore(max_renders)
+        self._feed_lock = threading.Lock()
+        self._feed_index = None
+        self._feed_checked = 0.0
+        self.stats = {"requests": 0, "cache_hits": 0, "shared": 0, "renders": 0, "failures": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def feed_index(self):
+        """briefs.json 的时间索引，最多每 FEED_REFRESH_SECONDS 秒条件请求一次"""
+        with self._feed_lock:
+            if self._feed_index is None or time.monotonic() - self._feed_checked > FEED_REFRESH_SECONDS:
+                index = get_feed_index(self.url, use_snapshot=self.use_cache)
+                if index is not None:
+                    self._feed_index = index
+                    self._feed_checked = time.monotonic()
+            return self._feed_index
+
+    def render(self, start_epoch, end_epoch, skip_intro=False):
+        """
+        渲染 [start, end) 的节目，返回 dict：path、key、briefs（简报数）、source（cache/shared/render）
+        窗口内没有简报时返回 None
+        """
+        self._count("requests")
+        index = self.feed_index()
+        if index is None:
+            raise RuntimeError("获取简报数据失败")
+        start_iso = datetime.fromtimestamp(start_epoch, timezone.utc).isoformat()
+        end_iso = datetime.fromtimestamp(end_epoch, timezone.utc).isoformat()
+        briefs = filter_briefs_by_time_range(index, start_iso, end_iso)
+        if not briefs:
+            return None
+        intro_date = (datetime.now(timezone.utc) + timedelta(hours=8)).strftime("%Y%m%d")
+        key = brief_set_key(briefs, skip_intro, intro_date, self.merge_mode)
+        path = self.cache.get(key)
+        if path:
+            self._count("cache_hits")
+            return {"path": path, "key": key, "briefs": len(briefs), "source": "cache"}
+        path, shared = self.flight.do(key, lambda: self._render(key, briefs, skip_intro))
+        self._count("shared" if shared else "renders")
+        return {"path": path, "key": key, "briefs": len(briefs), "source": "shared" if shared else "render"}
+
+    def _render(self, key, briefs, skip_intro):
+        # 等待期间可能已有同一简报集合的渲染完成
+        path = self.cache.get(key)
+        if path:
+            return path
+        with self._renders:
+            temp_dir = tempfile.mkdtemp(prefix="news-audio-render-")
+            try:
+                started = time.time()
+                engine = get_download_engine(MAX_DOWNLOAD_CONCURRENCY)
+                # 缓存键按去重前的简报集合计算，命中缓存时不必再发 HEAD 请求
+                briefs, _ = dedup_briefs(briefs, engine, cache=get_brief_cache() if self.use_cache else None,
+                                         index=get_duplicate_index())
+                mp3_files = download_mp3_files(briefs, temp_dir, use_cache=self.use_cache, engine=engine)
+                if not mp3_files:
+                    raise RuntimeError("没有成功下载的简报")
+                intro_file = None if skip_intro else download_daily_intro(temp_dir, engine)
+                output = os.path.join(temp_dir, "episode.mp3")
+                if not merge_mp3_files(mp3_files, output, intro_file, mode=self.merge_mode):
+                    raise RuntimeError("合并失败")
+                path = self.cache.put(key, output, meta={
+                    "briefs": [b.id for b in briefs], "merged": len(mp3_files), "rendered_at": time.time(),
+                })
+                logger.info(f"[渲染] {key}: {len(mp3_files)}/{len(briefs)}条简报，耗时 {time.time() - started:.2f}秒")
+                return path
+            except Exception:
+                self._count("failures")
+                raise
+            finally:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def parse_range(header, size):
+    """
+    解析单个 Range（bytes=a-b、bytes=a-、bytes=-n），返回 (start, end) 闭区间
+    没有 Range、格式不合法或有多个区间时返回 None（按整个文件响应），无法满足时抛出 ValueError
+    """
+    match = RANGE_PATTERN.fullmatch(header.strip()) if header else None
+    if not match or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if not first:
+        # 最后 n 个字节
+        if int(last) == 0 or size == 0:
+            raise ValueError(header)
+        return max(0, size - int(last)), size - 1
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    if start >= size:
+        raise ValueError(header)
+    return start, min(int(last), size - 1) if last else size - 1
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    server_version = "news-audio-render/1.0"
+    renderer = None  # EpisodeRenderer，由 make_server 设置
+
+    def log_message(self, fmt, *args):
+        logger.info(f"[渲染] {self.address_string()} {fmt % args}")
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def _handle(self, send_body):
+        url = urlparse(self.path)
+        if url.path == "/healthz":
+            return self._send_json(200, dict(self.renderer.stats), send_body)
+        if url.path != "/episode.mp3":
+            return self._send_json(404, {"error": "not found"}, send_body)
+        try:
+            start_epoch, end_epoch, skip_intro = self._parse_window(parse_qs(url.query))
+        except ValueError as e:
+            return self._send_json(400, {"error": str(e)}, send_body)
+        try:
+            rendered = self.renderer.render(start_epoch, end_epoch, skip_intro)
+        except Exception as e:
+            logger.error(f"[渲染] 渲染失败: {e}")
+            return self._send_json(502, {"error": str(e)}, send_body)
+        if rendered is None:
+            return self._send_json(404, {"error": "no briefs in window"}, send_body)
+        self._send_file(rendered, send_body)
+
+    def _parse_window(self, query):
+        def value(name):
+            values = query.get(name)
+            return values[-1] if values else None
+
+        skip_intro = (value("skip_intro") or "").lower() in ("1", "true", "yes")
+        if value("hours"):
+            try:
+                hours = float(value("hours"))
+            except ValueError:
+                raise ValueError("hours 必须是数字")
+            end_epoch = time.time()
+            start_epoch = end_epoch - hours * 3600
+        elif value("start") and value("end"):
+            start_epoch = parse_iso_timestamp(value("start"))
+            end_epoch = parse_iso_timestamp(value("end"))
+            if start_epoch is None or end_epoch is None:
+                raise ValueError("start/end 必须是带时区的 ISO8601 时间")
+        else:
+            raise ValueError("需要 hours 或 start 和 end")
+        if not 0 < end_epoch - start_epoch <= MAX_WINDOW_HOURS * 3600:
+            raise ValueError(f"时间窗口必须大于 0 且不超过 {MAX_WINDOW_HOURS} 小时")
+        return start_epoch, end_epoch, skip_intro
+
+    def _send_json(self, status, body, send_body=True):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    def _send_file(self, rendered, send_body):
+        etag = f'"{rendered["key"]}"'
+        try:
+            f = open(rendered["path"], "rb")
+        except OSError:
+            # 刚好被淘汰：下次请求会重新渲染
+            return self._send_json(503, {"error": "rendered file evicted, retry"}, send_body)
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+            byte_range = None
+            if not self.headers.get("If-Range") or self.headers.get("If-Range") == etag:
+                try:
+                    byte_range = parse_range(self.headers.get("Range"), size)
+                except ValueError:
+                    self.send_response(416)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+            start, end = byte_range or (0, size - 1)
+            self.send_response(206 if byte_range else 200)
+            self.send_header("Content-Type", "audio/mpeg")
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            # 同一个 URL（如 hours=6）的内容会随时间变化，每次都用 ETag 重新验证
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Content-Length", str(end - start + 1))
+            if byte_range:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.send_header("X-Briefs", str(rendered["briefs"]))
+            self.send_header("X-Render-Source", rendered["source"])
+            self.end_headers()
+            if not send_body:
+                return
+            f.seek(start)
+            remaining = end - start + 1
+            try:
+                while remaining > 0:
+                    chunk = f.read(min(SERVE_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+                    remaining -= len(chunk)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # 播放器在拖动进度时会中断连接
+
+
+def make_server(host=DEFAULT_HOST, port=DEFAULT_PORT, renderer=None):
+    """创建渲染服务（不启动），renderer 默认使用 DEFAULT_BRIEFS_JSON_URL"""
+    handler = type("BoundRenderHandler", (RenderHandler,), {"renderer": renderer or EpisodeRenderer()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Render news episodes for any time range on demand.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on (default: {DEFAULT_HOST})")
+    parser.add_argument("--port", "-p", type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT})")
+    parser.add_argument(
+        "--url", "-u",
+        default=DEFAULT_BRIEFS_JSON_URL,
+        help=f"URL of the briefs.json file (default: {DEFAULT_BRIEFS_JSON_URL})"
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=RENDER_CACHE_MAX_BYTES // (1024 * 1024),
+        help=f"Rendered episode cache size in MB (default: {RENDER_CACHE_MAX_BYTES // (1024 * 1024)})"
+    )
+    parser.add_argument(
+        "--merge-mode",
+        choices=["auto", "copy", "reencode", "parallel"],
+        default="auto",
+        help="Merge mode, as in merge_mp3_briefs.py (default: auto)"
+    )
+    parser.add_argument(
+        "--max-renders",
+        type=int,
+        default=MAX_CONCURRENT_RENDERS,
+        help=f"Renders running at the same time (default: {MAX_CONCURRENT_RENDERS})"
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the brief audio cache and feed snapshot")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    renderer = EpisodeRenderer(
+        url=args.url,
+        cache=RenderCache(max_bytes=args.cache_size * 1024 * 1024),
+        merge_mode=args.merge_mode,
+        max_renders=args.max_renders,
+        use_cache=not args.no_cache,
+    )
+    server = make_server(args.host, args.port, renderer)
+    logger.info(f"[渲染] 服务已启动: http://{args.host}:{server.server_port}/episode.mp3?hours=6")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
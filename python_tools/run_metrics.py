@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Per-run metrics
+
+Collects structured metrics for one merge run: wall and CPU time per stage
+(including ffmpeg child processes), byte and cache counters, counts of
+briefs, skips and failures, output duration and peak RSS. At the end of the
+run they are written as a JSON run record and as a Prometheus textfile for
+node_exporter's textfile collector.
+
+Code deep inside the pipeline reports through the module-level stage() and
+count() helpers, which do nothing when no run is active (prefetch, bench,
+direct function calls).
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import resource
+import threading
+from contextlib import contextmanager
+
+from audio_cache import _atomic_write
+
+PROM_FILE = "news_audio.prom"
+PROM_PREFIX = "news_audio"
+KEEP_RECORDS = 200  # metrics 目录中最多保留的运行记录数
+
+
+def _rss_bytes(who):
+    """ru_maxrss 在 Linux 上以 KB 为单位，macOS 上以字节为单位"""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class RunMetrics:
+    """一次合并运行的指标：阶段耗时、计数器和取值"""
+
+    def __init__(self, profiler=None):
+        self.profiler = profiler
+        self.started_at = time.time()
+        self._wall_start = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.values = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name):
+        """
+        计时一个阶段；同名阶段多次进入时累加（流水线中逐条合并）
+        CPU 时间是阶段期间整个进程的 CPU 时间，children_cpu 是期间结束的子进程（ffmpeg）的 CPU 时间
+        设置了 profiler（stage_profiler.StageProfiler）时同时交给它分析
+        """
+        profile_state = self.profiler.enter(name) if self.profiler else None
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        children = _children_cpu()
+        try:
+            yield
+        finally:
+            if self.profiler:
+                self.profiler.exit(profile_state)
+            with self._lock:
+                stage = self.stages.setdefault(name, {"seconds": 0.0, "cpu_seconds": 0.0,
+                                                      "children_cpu_seconds": 0.0, "calls": 0})
+                stage["seconds"] += time.perf_counter() - wall
+                stage["cpu_seconds"] += time.process_time() - cpu
+                stage["children_cpu_seconds"] += _children_cpu() - children
+                stage["calls"] += 1
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set(self, name, value):
+        with self._lock:
+            self.values[name] = value
+
+    def record(self, success):
+        """生成运行记录（dict）"""
+        hits = self.counters.get("cache_hits", 0)
+        lookups = hits + self.counters.get("cache_misses", 0)
+        return {
+            "started_at": self.started_at,
+            "host": socket.gethostname(),
+            "success": bool(success),
+            "duration_seconds": round(time.perf_counter() - self._wall_start, 4),
+            "cpu_seconds": round(time.process_time(), 4),
+            "children_cpu_seconds": round(_children_cpu(), 4),
+            "peak_rss_bytes": _rss_bytes(resource.RUSAGE_SELF),
+            "children_peak_rss_bytes": _rss_bytes(resource.RUSAGE_CHILDREN),
+            "cache_hit_ratio": round(hits / lookups, 4) if lookups else None,
+            "stages": {name: {k: round(v, 4) if isinstance(v, float) else v for k, v in stage.items()}
+                       for name, stage in self.stages.items()},
+            "counters": dict(self.counters),
+            "values": dict(self.values),
+        }
+
+    def write(self, metrics_dir, name, success):
+        """
+        写入 <metrics_dir>/run-<name>.json 和 node_exporter textfile（news_audio.prom，原子替换）
+        返回运行记录
+        """
+        record = self.record(success)
+        os.makedirs(metrics_dir, exist_ok=True)
+        _atomic_write(os.path.join(metrics_dir, f"run-{name}.json"),
+                      json.dumps(record, ensure_ascii=False, indent=2).encode("utf-8"))
+        _atomic_write(os.path.join(metrics_dir, PROM_FILE), format_prometheus(record).encode("utf-8"))
+        records = sorted(f for f in os.listdir(metrics_dir) if f.startswith("run-") and f.endswith(".json"))
+        for old in records[:-KEEP_RECORDS]:
+            os.remove(os.path.join(metrics_dir, old))
+        return record
+
+
+def format_prometheus(record):
+    """把运行记录转换成 Prometheus 文本格式（textfile collector 读取）"""
+    lines = []
+
+    def gauge(name, help_text, samples):
+        lines.append(f"# HELP {PROM_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PROM_PREFIX}_{name} gauge")
+        for labels, value in samples:
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{PROM_PREFIX}_{name}{{{label_text}}} {value}" if label_text
+                         else f"{PROM_PREFIX}_{name} {value}")
+
+    gauge("last_run_timestamp_seconds", "Start time of the last merge run.", [({}, record["started_at"])])
+    gauge("last_run_success", "Whether the last merge run succeeded.", [({}, int(record["success"]))])
+    gauge("last_run_duration_seconds", "Wall time of the last merge run.", [({}, record["duration_seconds"])])
+    stages = record["stages"]
+    gauge("stage_duration_seconds", "Wall time per stage of the last run.",
+          [({"stage": name}, stage["seconds"]) for name, stage in stages.items()])
+    gauge("stage_cpu_seconds", "Process CPU time per stage of the last run.",
+          [({"stage": name}, stage["cpu_seconds"]) for name, stage in stages.items()])
+    gauge("stage_children_cpu_seconds", "CPU time of child processes (ffmpeg) per stage of the last run.",
+          [({"stage": name}, stage["children_cpu_seconds"]) for name, stage in stages.items()])
+    gauge("peak_rss_bytes", "Peak resident set size during the last run.",
+          [({"process": "self"}, record["peak_rss_bytes"]),
+           ({"process": "children"}, record["children_peak_rss_bytes"])])
+    if record["cache_hit_ratio"] is not None:
+        gauge("cache_hit_ratio", "Brief audio cache hit ratio of the last run.", [({}, record["cache_hit_ratio"])])
+    for name, value in sorted(record["counters"].items()):
+        gauge(name, f"Counter {name} of the last run.", [({}, value)])
+    for name, value in sorted(record["values"].items()):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            gauge(name, f"Value {name} of the last run.", [({}, value)])
+    return "\n".join(lines) + "\n"
+
+
+_active = None
+
+
+def get_active():
+    """当前运行的 RunMetrics，没有运行时返回 None"""
+    return _active
+
+
+@contextmanager
+def activate(metrics):
+    """在 with 块内把 metrics 设为当前运行的指标"""
+    global _active
+    previous, _active = _active, metrics
+    try:
+        yield metrics
+    finally:
+        _active = previous
+
+
+@contextmanager
+def stage(name):
+    """计时当前运行的一个阶段，没有运行时不做任何事"""
+    metrics = _active
+    if metrics is None:
+        yield
+        return
+    with metrics.stage(name):
+        yield
+
+
+def count(name, amount=1):
+    metrics = _active
+    if metrics is not None:
+        metrics.count(name, amount)
+
+
+def set_value(name, value):
+    metrics = _active
+    if metrics is not None:
+        metrics.set(name, value)
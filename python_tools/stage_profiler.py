@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Stage profiler
+
+Profiling hooks for the stages recorded by run_metrics. Two modes:
+
+- full: each stage runs under cProfile and is bracketed by tracemalloc
+  snapshots. Every thread that enters a stage gets its own profile (a
+  cProfile.Profile must not be shared between threads); finished profiles
+  are merged per stage with pstats.Stats.add. Per stage a .pstats file, a
+  text summary of the hottest functions and a report of the source lines
+  that allocated the most memory are written.
+- sample: a background thread samples the stacks of every thread at a fixed
+  interval and attributes them to the active stage. Overhead stays well
+  under one percent, so it can be left enabled in production. Stacks are
+  written in the collapsed format read by flamegraph.pl and speedscope.
+"""
+
+import os
+import sys
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+
+logger = logging.getLogger("news-audio")
+
+PROFILE_MODES = ("full", "sample")
+SAMPLE_INTERVAL = 0.02  # 采样间隔（秒）
+IDLE_FRAMES = {"thread.py:_worker"}  # 空闲的线程池线程，不计入样本
+TRACEMALLOC_FRAMES = 8  # tracemalloc 记录的调用栈深度
+TOP_FUNCTIONS = 40  # 文本报告中列出的函数数
+TOP_ALLOCATIONS = 25  # 分配报告中列出的代码行数
+
+
+def _snapshot():
+    """tracemalloc 快照，去掉 profiler 自身和 tracemalloc 的分配"""
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ))
+
+
+def _stage_filename(name):
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in name)
+
+
+class StageProfiler:
+    """按阶段收集 cProfile/tracemalloc 数据（full）或调用栈采样（sample）"""
+
+    def __init__(self, mode="sample", interval=SAMPLE_INTERVAL):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"未知的 profile 模式: {mode}")
+        self.mode = mode
+        self.interval = interval
+        self.profiles = {}  # 阶段 -> pstats.Stats（各线程、各次进入的 profile 合并）
+        self.allocations = {}  # 阶段 -> Counter(代码行 -> 净分配字节)
+        self.samples = Counter()  # "阶段;栈帧;..." -> 次数
+        self.sample_count = 0
+        self._local = threading.local()
+        self._thread_stages = {}  # 线程 id -> 当前阶段栈（采样时使用）
+        self._main_thread = threading.get_ident()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started_tracemalloc = False
+
+    def start(self):
+        if self.mode == "full":
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+                self._started_tracemalloc = True
+        else:
+            self._sampler = threading.Thread(target=self._sample_loop, name="stage-sampler", daemon=True)
+            self._sampler.start()
+        return self
+
+    def stop(self):
+        if self._sampler:
+            self._stop.set()
+            self._sampler.join()
+            self._sampler = None
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def enter(self, name):
+        """阶段开始时调用，返回交给 exit() 的状态"""
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._thread_stages.setdefault(thread_id, []).append(name)
+        if self.mode != "full":
+            return None
+        # 同一线程中嵌套的阶段（如 merge 中的 export）已包含在外层的 profile 中
+        if getattr(self._local, "profiling", False):
+            return (name, None, None)
+        # 每次进入都用新的 Profile：下载线程会同时进入同一阶段（如 validate），共用一个会得到错乱的数据
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError as e:
+            # Python 3.12 起同一时间只能有一个 profiler（另一个线程的阶段正在 profile）
+            logger.debug(f"[profile] 阶段 {name} 无法启用 cProfile: {e}")
+            profile = None
+        else:
+            self._local.profiling = True
+        return (name, profile, _snapshot())
+
+    def exit(self, state):
+        thread_id = threading.get_ident()
+        with self._lock:
+            stack = self._thread_stages.get(thread_id)
+            if stack:
+                stack.pop()
+                if not stack:
+                    del self._thread_stages[thread_id]
+        if not state:
+            return
+        name, profile, before = state
+        if profile is not None:
+            profile.disable()
+            self._local.profiling = False
+            with self._lock:
+                if name in self.profiles:
+                    self.profiles[name].add(profile)
+                else:
+                    self.profiles[name] = pstats.Stats(profile)
+        if before is None:
+            return
+        diff = _snapshot().compare_to(before, "lineno")
+        with self._lock:
+            totals = self.allocations.setdefault(name, Counter())
+            for stat in diff:
+                if stat.size_diff > 0:
+                    frame = stat.traceback[0]
+                    totals[f"{frame.filename}:{frame.lineno}"] += stat.size_diff
+
+    def _current_stage(self, thread_id):
+        with self._lock:
+            stack = self._thread_stages.get(thread_id) or self._thread_stages.get(self._main_thread)
+            return stack[-1] if stack else "-"
+
+    def _sample_loop(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                code = frame.f_code
+                if f"{os.path.basename(code.co_filename)}:{code.co_name}" in IDLE_FRAMES:
+                    continue
+                stage = self._current_stage(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                stack.append(stage)
+                self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def write(self, directory):
+        """把收集的数据写入 directory，返回写入的文件列表"""
+        os.makedirs(directory, exist_ok=True)
+        written = []
+        for name, merged in self.profiles.items():
+            base = os.path.join(directory, _stage_filename(name))
+            merged.dump_stats(f"{base}.pstats")
+            with open(f"{base}.txt", "w", encoding="utf-8") as f:
+                stats = pstats.Stats(f"{base}.pstats", stream=f)
+                stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+                stats.sort_stats("tottime").print_stats(TOP_FUNCTIONS)
+            written += [f"{base}.pstats", f"{base}.txt"]
+        for name, totals in self.allocations.items():
+            path = os.path.join(directory, f"{_stage_filename(name)}.alloc.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"# 阶段 {name} 中净分配最多的代码行（tracemalloc）\n")
+                for line, size in totals.most_common(TOP_ALLOCATIONS):
+                    f.write(f"{size / 1024:>12.1f} KiB  {line}\n")
+            written.append(path)
+        if self.samples:
+            path = os.path.join(directory, "samples.folded")
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in sorted(self.samples.items()):
+                    f.write(f"{stack} {count}\n")
+            written.append(path)
+            path = os.path.join(directory, "samples.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.sample_report())
+            written.append(path)
+        return written
+
+    def sample_report(self):
+        """按阶段列出采样中出现最多的栈顶函数（self 时间）"""
+        by_stage = {}
+        for stack, count in self.samples.items():
+            frames = stack.split(";")
+            by_stage.setdefault(frames[0], Counter())[frames[-1]] += count
+        lines = [f"# 采样 {self.sample_count} 次，间隔 {self.interval * 1000:.0f}ms（所有线程）"]
+        for stage, functions in sorted(by_stage.items()):
+            total = sum(functions.values())
+            lines.append(f"\n## {stage}（{total} 个样本）")
+            for function, count in functions.most_common(15):
+                lines.append(f"{count / total:>7.1%}  {function}")
+        return "\n".join(lines) + "\n"
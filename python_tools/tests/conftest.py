@@ -0,0 +1,8 @@
+"""pytest 配置：脚本按平铺模块导入，缓存目录指向临时目录"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("NEWS_AUDIO_CACHE_DIR", tempfile.mkdtemp(prefix="news-audio-test-"))
@@ -0,0 +1,207 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from brief_dedup import DuplicateIndex, dedup_briefs, normalize_audio_url, normalize_etag
+
+T0 = datetime(2026, 10, 18, tzinfo=timezone.utc)
+
+
+def brief(brief_id, audio_url, minutes=0):
+    return SimpleNamespace(id=brief_id, title=f"title {brief_id}", audio_url=audio_url,
+                           published_date=T0 + timedelta(minutes=minutes))
+
+
+class FakeEngine:
+    """HEAD 请求返回 heads 中登记的响应头，记录请求过的地址"""
+
+    def __init__(self, heads=None, status=200):
+        self.heads = heads or {}
+        self.status = status
+        self.requested = []
+
+    def head(self, url):
+        self.requested.append(url)
+        if url not in self.heads:
+            raise IOError("timeout")
+        return SimpleNamespace(status_code=self.status, headers=self.heads[url], close=lambda: None)
+
+    def map(self, fn, items, ok=bool):
+        return [fn(item) for item in items]
+
+
+class FakeCache:
+    def __init__(self, entries):
+        self.entries = entries
+
+    def lookup(self, brief_id):
+        entry = self.entries.get(brief_id)
+        return dict(entry) if entry else None
+
+    def content_hash(self, brief_id):
+        return self.entries.get(brief_id, {}).get("sha256")
+
+
+def ids(briefs):
+    return [b.id for b in briefs]
+
+
+# ---- 地址与 ETag 规范化 ----
+
+@pytest.mark.parametrize("a, b", [
+    ("https://cdn.example.com/a.mp3", "HTTPS://CDN.Example.com:443/a.mp3#t=10"),
+    ("http://cdn.example.com/a.mp3", "http://cdn.example.com:80/a.mp3"),
+    ("https://cdn.example.com/a.mp3?v=1&lang=zh", "https://cdn.example.com/a.mp3?lang=zh&v=1"),
+    ("https://b.oss-cn-hangzhou.aliyuncs.com/a.mp3?Expires=1&OSSAccessKeyId=k&Signature=s",
+     "https://b.oss-cn-hangzhou.aliyuncs.com/a.mp3?Expires=2&OSSAccessKeyId=k&Signature=t&security-token=x"),
+    ("https://b.oss-cn-hangzhou.aliyuncs.com/a.mp3?x-oss-signature-version=OSS4-HMAC-SHA256"
+     "&x-oss-credential=c&x-oss-date=20261018T000000Z&x-oss-expires=3600&x-oss-signature=s",
+     "https://b.oss-cn-hangzhou.aliyuncs.com/a.mp3"),
+    ("https://cdn.example.com", "https://cdn.example.com/"),
+])
+def test_normalize_audio_url_same_object(a, b):
+    assert normalize_audio_url(a) == normalize_audio_url(b)
+
+
+@pytest.mark.parametrize("a, b", [
+    ("https://cdn.example.com/a.mp3", "https://cdn.example.com/A.mp3"),
+    ("https://cdn.example.com/a.mp3", "http://cdn.example.com/a.mp3"),
+    ("https://cdn.example.com/a.mp3", "https://cdn.example.com:8443/a.mp3"),
+    ("https://cdn.example.com/audio?file=a.mp3", "https://cdn.example.com/audio?file=b.mp3"),
+    ("https://cdn.example.com/a.mp3?auth_key=1-0-0-abc", "https://cdn.example.com/a.mp3?auth_key=1-0-0-abd"),
+    ("https://b.oss-cn-hangzhou.aliyuncs.com/a.mp3",
+     "https://b.oss-cn-hangzhou.aliyuncs.com/a.mp3?x-oss-process=audio/convert,f_mp3,ab_64000"),
+])
+def test_normalize_audio_url_different_objects(a, b):
+    assert normalize_audio_url(a) != normalize_audio_url(b)
+
+
+@pytest.mark.parametrize("value, expected", [
+    ('"5d41402abc4b2a76b9719d911017c592"', "5D41402ABC4B2A76B9719D911017C592"),
+    ('W/"abc"', "ABC"),
+    (" abc-2 ", "ABC-2"),
+    ('""', None),
+    ("", None),
+    (None, None),
+])
+def test_normalize_etag(value, expected):
+    assert normalize_etag(value) == expected
+
+
+# ---- dedup_briefs ----
+
+def test_dedup_by_normalized_url_keeps_earliest():
+    briefs = [
+        brief("new", "https://CDN.example.com/a.mp3?Expires=2&Signature=y", minutes=30),
+        brief("other", "https://cdn.example.com/b.mp3", minutes=20),
+        brief("old", "https://cdn.example.com/a.mp3?Expires=1&Signature=x", minutes=10),
+    ]
+    engine = FakeEngine()
+    kept, duplicates = dedup_briefs(briefs, engine, probe=False)
+    assert ids(kept) == ["other", "old"]
+    assert duplicates == {"new": "old"}
+    assert engine.requested == []
+
+
+def test_distinct_briefs_sharing_a_cdn_query_string_are_kept():
+    query = "?auth_key=1760745600-0-0-9f86d081&v=2"
+    briefs = [brief(f"b{i}", f"https://cdn.example.com/briefs/{i}.mp3{query}", minutes=i) for i in range(4)]
+    briefs.append(brief("p", "https://cdn.example.com/play?id=1&v=2", minutes=5))
+    briefs.append(brief("q", "https://cdn.example.com/play?id=2&v=2", minutes=6))
+    engine = FakeEngine({b.audio_url: {} for b in briefs})
+    kept, duplicates = dedup_briefs(briefs, engine)
+    assert ids(kept) == ids(briefs) and duplicates == {}
+
+
+def test_dedup_by_head_etag():
+    briefs = [
+        brief("a", "https://cdn.example.com/a.mp3", minutes=1),
+        brief("a-mirror", "https://mirror.example.com/a.mp3", minutes=2),
+        brief("a-copy", "https://cdn.example.com/a.mp3?Signature=z", minutes=3),
+        brief("b", "https://cdn.example.com/b.mp3", minutes=4),
+        brief("c", "https://cdn.example.com/c.mp3", minutes=5),
+    ]
+    engine = FakeEngine({
+        "https://cdn.example.com/a.mp3": {"ETag": '"ABC"'},
+        "https://mirror.example.com/a.mp3": {"ETag": 'W/"abc"'},
+        "https://cdn.example.com/b.mp3": {"ETag": '"DEF"'},
+        # c 的 HEAD 失败：不能判断，保留
+    })
+    kept, duplicates = dedup_briefs(briefs, engine)
+    assert ids(kept) == ["a", "b", "c"]
+    assert duplicates == {"a-mirror": "a", "a-copy": "a"}
+    # 同一地址（去掉签名后）只请求一次
+    assert sorted(engine.requested) == sorted([
+        "https://cdn.example.com/a.mp3", "https://mirror.example.com/a.mp3",
+        "https://cdn.example.com/b.mp3", "https://cdn.example.com/c.mp3",
+    ])
+
+
+def test_dedup_by_content_md5_and_ignores_error_status():
+    briefs = [brief("a", "https://x.example.com/a.mp3"), brief("b", "https://y.example.com/b.mp3", 1)]
+    engine = FakeEngine({b.audio_url: {"Content-MD5": "XUFAKrxLKna5cZ2REBfFkg=="} for b in briefs})
+    assert dedup_briefs(briefs, engine)[1] == {"b": "a"}
+    engine = FakeEngine({b.audio_url: {"ETag": '"same"'} for b in briefs}, status=404)
+    assert dedup_briefs(briefs, engine)[1] == {}
+
+
+def test_dedup_by_cached_etag_and_hash_without_head():
+    briefs = [
+        brief("a", "https://cdn.example.com/a.mp3", minutes=1),
+        brief("a-etag", "https://cdn.example.com/a-v2.mp3", minutes=2),
+        brief("a-hash", "https://cdn.example.com/a-v3.mp3", minutes=3),
+        brief("d", "https://cdn.example.com/d.mp3", minutes=4),
+    ]
+    cache = FakeCache({
+        "a": {"etag": '"E1"', "sha256": "h1"},
+        "a-etag": {"etag": "e1", "sha256": "h2"},
+        "a-hash": {"etag": '"E3"', "sha256": "h1"},
+        "d": {"etag": '"E4"', "sha256": "h4"},
+    })
+    engine = FakeEngine()
+    kept, duplicates = dedup_briefs(briefs, engine, cache=cache)
+    assert ids(kept) == ["a", "d"]
+    assert duplicates == {"a-etag": "a", "a-hash": "a"}
+    assert engine.requested == []
+
+
+def test_dedup_records_and_reuses_known_duplicates(tmp_path):
+    path = str(tmp_path / "duplicates.json")
+    briefs = [brief("a", "https://x.example.com/a.mp3"), brief("b", "https://y.example.com/b.mp3", 1)]
+    engine = FakeEngine({b.audio_url: {"ETag": '"same"'} for b in briefs})
+    assert dedup_briefs(briefs, engine, index=DuplicateIndex(path))[1] == {"b": "a"}
+
+    index = DuplicateIndex(path)
+    assert index.get("b")["of"] == "a" and index.get("b")["by"] == "etag"
+    engine = FakeEngine()
+    assert dedup_briefs(briefs, engine, index=index)[1] == {"b": "a"}
+    assert engine.requested == []
+    # 原简报不在本次列表中时，已知的重复不起作用
+    kept, duplicates = dedup_briefs([briefs[1], brief("c", "https://z.example.com/c.mp3")], engine, index=index,
+                                    probe=False)
+    assert ids(kept) == ["b", "c"] and duplicates == {}
+
+
+def test_dedup_probe_disabled_keeps_unknown_briefs():
+    briefs = [brief("a", "https://x.example.com/a.mp3"), brief("b", "https://y.example.com/b.mp3", 1)]
+    engine = FakeEngine({b.audio_url: {"ETag": '"same"'} for b in briefs})
+    assert dedup_briefs(briefs, engine, probe=False) == (briefs, {})
+    assert engine.requested == []
+
+
+def test_dedup_single_brief():
+    only = [brief("a", "https://x.example.com/a.mp3")]
+    assert dedup_briefs(only, FakeEngine()) == (only, {})
+
+
+def test_duplicate_index_merges_concurrent_writers(tmp_path):
+    path = str(tmp_path / "duplicates.json")
+    first, second = DuplicateIndex(path), DuplicateIndex(path)
+    first.record("b", "a", "url")
+    second.record("d", "c", "etag")
+    first.save()
+    second.save()
+    assert DuplicateIndex(path).get("b")["of"] == "a"
+    assert DuplicateIndex(path).get("d")["of"] == "c"
+    assert len(second) == 2
@@ -0,0 +1,178 @@
+import sqlite3
+from datetime import timezone
+
+import pytest
+from dateutil import parser as dtparser
+
+from briefs_feed import BriefIndex, BriefsSnapshot, _parse_iso_fallback, parse_iso_timestamp
+
+
+def brief(brief_id, published, **extra):
+    return dict(extra, id=brief_id, publishedAt=published, audioUrl=f"https://cdn.example.com/{brief_id}.mp3")
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    snapshot = BriefsSnapshot("https://example.com/briefs.json", str(tmp_path))
+    yield snapshot
+    snapshot.close()
+
+
+# ---- BriefsSnapshot ----
+
+def test_snapshot_skips_non_dict_entries(snapshot):
+    items = [brief("a", "2026-10-18T08:00:00Z"), "junk", None, 3, ["x"], brief("b", "2026-10-18T09:00:00Z")]
+    assert snapshot.update(items) == (2, 0, 0)
+    assert [b["id"] for b in snapshot.load()] == ["b", "a"]
+    # BriefIndex 同样跳过这些条目
+    assert len(BriefIndex(items)) == 2
+
+
+def test_snapshot_updates_incrementally(snapshot):
+    items = [brief(f"b{i}", f"2026-10-18T{i:02d}:00:00Z") for i in range(5)]
+    assert snapshot.update(items, etag='"v1"', last_modified="Sun, 18 Oct 2026 08:00:00 GMT") == (5, 0, 0)
+    assert snapshot.update(items) == (0, 0, 0)
+    items[1] = brief("b1", "2026-10-18T01:00:00Z", title="changed")
+    assert snapshot.update(items[1:] + [brief("b9", "2026-10-18T20:00:00Z")]) == (1, 1, 1)
+    assert [b["id"] for b in snapshot.load()] == ["b9", "b4", "b3", "b2", "b1"]
+    assert snapshot.load()[-1]["title"] == "changed"
+
+
+def test_snapshot_order_by_publish_time_then_id(snapshot):
+    items = [brief("c", "2026-10-18T08:00:00Z"), {"id": "n", "title": "no time"},
+             brief("b", "2026-10-18T08:00:00+00:00"), brief("a", "2026-10-18T10:00:00+08:00"),
+             brief("d", "2026-10-18T09:00:00Z")]
+    snapshot.update(items)
+    assert [b["id"] for b in snapshot.load()] == ["d", "b", "c", "a", "n"]
+
+
+def test_snapshot_keys_numeric_ids_and_duplicates(snapshot):
+    items = [{"id": 7, "publishedAt": "2026-10-18T08:00:00Z"}, {"id": 7, "publishedAt": "2026-10-18T07:00:00Z"},
+             {"title": "no id", "publishedAt": "2026-10-18T06:00:00Z"}]
+    assert snapshot.update(items) == (3, 0, 0)
+    assert snapshot.update(items) == (0, 0, 0)
+    assert snapshot.load() == items
+
+
+def test_snapshot_validators(snapshot, tmp_path):
+    assert snapshot.validators() == {}
+    snapshot.update([brief("a", "2026-10-18T08:00:00Z")], etag='"v1"', last_modified="Sun, 18 Oct 2026 08:00:00 GMT")
+    assert snapshot.validators() == {"If-None-Match": '"v1"', "If-Modified-Since": "Sun, 18 Oct 2026 08:00:00 GMT"}
+    assert snapshot.etag == '"v1"'
+    reopened = BriefsSnapshot(snapshot.url, str(tmp_path))
+    assert reopened.etag == '"v1"' and len(reopened.load()) == 1
+    reopened.close()
+
+
+def test_snapshot_drops_old_schema(tmp_path):
+    path = BriefsSnapshot("https://example.com/old.json", str(tmp_path)).path
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute("DROP TABLE briefs")
+        conn.execute("CREATE TABLE briefs (pos INTEGER PRIMARY KEY, id TEXT, data TEXT)")
+        conn.execute("INSERT INTO briefs VALUES (0, 'a', '{}')")
+        conn.execute("UPDATE meta SET value = '1' WHERE key = 'schema'")
+        conn.execute("INSERT INTO meta VALUES ('etag', '\"old\"')")
+    conn.close()
+    snapshot = BriefsSnapshot("https://example.com/old.json", str(tmp_path))
+    assert snapshot.load() == [] and snapshot.validators() == {}
+    assert snapshot.update([brief("a", "2026-10-18T08:00:00Z")]) == (1, 0, 0)
+    snapshot.close()
+
+
+# ---- BriefIndex ----
+
+def test_brief_index_queries_by_time():
+    items = [brief("c", "2026-10-18T03:00:00Z"), brief("b2", "2026-10-18T02:00:00Z"), "junk",
+             brief("b1", "2026-10-18T02:00:00Z"), brief("a", "2026-10-18T01:00:00Z"), {"id": "bad"}]
+    index = BriefIndex(items)
+    assert (len(index), index.invalid, index.total) == (4, 2, 6)
+    start, end = 1792288800, 1792292400  # 02:00 - 03:00
+    assert [b["id"] for _, b in index.query(start, end)] == ["b2", "b1"]
+    assert [b["id"] for _, b in index.query(start, end, include_end=True)] == ["c", "b2", "b1"]
+    assert index.query(end + 1, end + 2) == []
+
+
+# ---- parse_iso_timestamp ----
+
+def dateutil_epoch(value):
+    """参照实现：dateutil 解析，无时区按 UTC"""
+    try:
+        dt = dtparser.isoparse(value)
+    except (ValueError, TypeError, OverflowError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+BASE = 1792310400  # 2026-10-18T08:00:00Z
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2026-10-18T08:00:00Z", BASE),
+    ("2026-10-18T08:00:00z", BASE),
+    ("2026-10-18t08:00:00Z", BASE),
+    ("2026-10-18 08:00:00Z", BASE),
+    ("2026-10-18T08:00:00", BASE),
+    ("2026-10-18 08:00:00", BASE),
+    ("2026-10-18T16:00:00+08", BASE),
+    ("2026-10-18T16:00:00+0800", BASE),
+    ("2026-10-18T16:00:00+08:00", BASE),
+    ("2026-10-18T02:30:00-05:30", BASE),
+    ("2026-10-18T02:30:00-0530", BASE),
+    ("2026-10-18T03:00:00-05", BASE),
+    ("2026-10-18T08:00:00+00:00", BASE),
+    ("2026-10-18T08:00:00-00:00", BASE),
+    ("2026-10-18T08:00:00.5Z", BASE + 0.5),
+    ("2026-10-18T08:00:00,25Z", BASE + 0.25),
+    ("2026-10-18T08:00:00.123456Z", BASE + 0.123456),
+    ("2026-10-18T16:00:00.750+08:00", BASE + 0.75),
+    ("2026-10-18T08:00:00.5", BASE + 0.5),
+    ("2024-02-29T00:00:00Z", 1709164800),
+    ("1970-01-01T00:00:00Z", 0),
+])
+def test_parse_iso_timestamp_matches_dateutil(value, expected):
+    assert parse_iso_timestamp(value) == pytest.approx(expected, abs=1e-6)
+    assert parse_iso_timestamp(value) == pytest.approx(dateutil_epoch(value), abs=1e-6)
+
+
+@pytest.mark.parametrize("value", [
+    "2026-02-30T08:00:00Z",  # 不存在的日期
+    "2025-02-29T08:00:00Z",  # 非闰年
+    "2026-13-01T08:00:00Z",
+    "2026-10-32T08:00:00Z",
+    "2026-10-18T25:00:00Z",
+    "2026-10-18T08:60:00Z",
+    "2026-10-18T08:00:61Z",
+    "2026-10-18T08:00:00.Z",
+    "2026-10-18T08:00:00+2400",  # 偏移超出 ±24 小时，dateutil 也无法转换
+    "2026-10-18 08:00:00 -24:00",
+    "2026-10-18T08:00:00 UTC+",
+    "2026-1x-18T08:00:00Z",
+    "not a date",
+    "",
+    None,
+    1792310400,
+])
+def test_parse_iso_timestamp_rejects_invalid(value):
+    assert parse_iso_timestamp(value) is None
+
+
+@pytest.mark.parametrize("value", [
+    "2026-10-18",
+    "2026-10-18T08:00Z",
+    "20261018T080000Z",
+    "Sun, 18 Oct 2026 08:00:00 GMT",
+    "2026-10-18T08:00:00 +0800",
+    "2026-10-18T08:00:00.5 Z",
+    # 切片解析不接受、交给 dateutil 宽松解析的偏移写法
+    "2026-10-18T08:00:00+8",
+    "2026-10-18T08:00:00+08:0",
+    "2026-10-18T08:00:00+08-00",
+    "2026-10-18T08:00:00+05:99",
+])
+def test_parse_iso_timestamp_falls_back_for_other_formats(value):
+    reference = _parse_iso_fallback(value)
+    assert reference is not None
+    assert parse_iso_timestamp(value) == pytest.approx(reference, abs=1e-6)
@@ -0,0 +1,184 @@
+import json
+import os
+
+import pytest
+
+from bench_merge_mp3_briefs import silent_frame
+from episode_store import RollingEpisode
+from mp3_frames import scan_mp3
+
+
+def brief_mp3(tmp_path, name, fill, count=5, **kwargs):
+    """count 帧的简报音频，帧内容用 fill 填充，便于在输出中辨认"""
+    frame = silent_frame(**kwargs)
+    path = tmp_path / f"{name}.mp3"
+    path.write_bytes((frame[:4] + bytes([fill]) * (len(frame) - 4)) * count)
+    return scan_mp3(str(path))
+
+
+def audio_of(info):
+    with open(info.path, "rb") as f:
+        data = f.read()
+    return data[info.frame_offsets[0]:]
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def store(tmp_path):
+    return str(tmp_path / "episodes")
+
+
+def test_append_save_reload(tmp_path, store):
+    a, b = brief_mp3(tmp_path, "a", 1, 4), brief_mp3(tmp_path, "b", 2, 6)
+    episode = RollingEpisode("2026-10-18", store)
+    first = episode.append("a", a, audio_url="https://x/a.mp3", etag="EA")
+    second = episode.append("b", b)
+    assert (first["seq"], first["first_frame"], first["offset"]) == (0, 0, 0)
+    assert (second["seq"], second["first_frame"], second["offset"]) == (1, 4, first["size"])
+    episode.save()
+
+    reloaded = RollingEpisode("2026-10-18", store)
+    assert reloaded.segments == episode.segments
+    assert "a" in reloaded and len(reloaded) == 2
+    assert reloaded.segment("a")["etag"] == "EA"
+    assert reloaded.template.format_key == a.format_key
+    assert reloaded.body.frame_count == 10
+    assert read(reloaded.body_path) == audio_of(a) + audio_of(b)
+    assert reloaded.append("c", brief_mp3(tmp_path, "c", 3))["seq"] == 2
+
+
+def test_append_rejects_other_formats(tmp_path, store):
+    episode = RollingEpisode("k", store)
+    episode.append("a", brief_mp3(tmp_path, "a", 1))
+    with pytest.raises(ValueError):
+        episode.append("b", brief_mp3(tmp_path, "b", 2, sample_rate=48000))
+
+
+def test_append_replaces_existing_segment(tmp_path, store):
+    episode = RollingEpisode("k", store)
+    old = episode.append("a", brief_mp3(tmp_path, "a", 1))
+    new = episode.append("a", brief_mp3(tmp_path, "a2", 9, 3))
+    assert len(episode) == 1
+    assert new["seq"] != old["seq"] and new["frame_count"] == 3
+
+
+def test_finalize_orders_segments_with_assets(tmp_path, store):
+    briefs = {name: brief_mp3(tmp_path, name, fill) for name, fill in (("a", 1), ("b", 2), ("c", 3))}
+    intro, typing, end = (brief_mp3(tmp_path, name, fill, 2) for name, fill in (("intro", 7), ("typing", 8), ("end", 9)))
+    episode = RollingEpisode("k", store)
+    for name, info in briefs.items():
+        episode.append(name, info)
+    out = str(tmp_path / "out.mp3")
+    placed = episode.finalize(out, ["c", "missing", "a"], intro=intro, typing=typing, end=end)
+
+    data = read(out)
+    assert [p["id"] for p in placed] == ["c", "a"]
+    for p in placed:
+        assert data[p["offset"]:p["offset"] + p["size"]] == audio_of(briefs[p["id"]])
+    info = scan_mp3(out)
+    assert info.xing_frames == info.frame_count == 2 + 5 + 2 + 5 + 2
+    assert data[info.frame_offsets[0]:] == b"".join(
+        audio_of(x) for x in (intro, briefs["c"], typing, briefs["a"], end))
+
+
+def test_compact_keeps_the_same_audio(tmp_path, store):
+    briefs = {name: brief_mp3(tmp_path, name, fill, 3 + fill) for name, fill in (("a", 1), ("b", 2), ("c", 3))}
+    episode = RollingEpisode("k", store)
+    for name, info in briefs.items():
+        episode.append(name, info)
+    before = str(tmp_path / "before.mp3")
+    episode.finalize(before, ["c", "a"])
+
+    episode.remove("b")
+    episode.compact()
+    assert episode.manifest["body_size"] == briefs["a"].audio_bytes + briefs["c"].audio_bytes
+    assert episode.segment("c")["first_frame"] == briefs["a"].frame_count
+    assert episode.segment("c")["offset"] == briefs["a"].audio_bytes
+    after = str(tmp_path / "after.mp3")
+    episode.finalize(after, ["c", "a"])
+    assert read(after) == read(before)
+
+
+def test_save_compacts_mostly_removed_body(tmp_path, store):
+    episode = RollingEpisode("k", store)
+    for name, fill in (("a", 1), ("b", 2), ("c", 3)):
+        episode.append(name, brief_mp3(tmp_path, name, fill))
+    episode.remove("a")
+    episode.remove("b")
+    episode.save()
+    assert os.path.getsize(episode.body_path) == episode.segment("c")["size"]
+
+    reloaded = RollingEpisode("k", store)
+    out = str(tmp_path / "out.mp3")
+    reloaded.finalize(out, ["c"])
+    assert read(out)[scan_mp3(out).frame_offsets[0]:] == audio_of(brief_mp3(tmp_path, "c", 3))
+
+
+def test_load_truncates_unsaved_body_tail(tmp_path, store):
+    a = brief_mp3(tmp_path, "a", 1)
+    episode = RollingEpisode("k", store)
+    episode.append("a", a)
+    episode.save()
+    # 追加后没来得及保存清单（进程被杀）
+    episode.append("b", brief_mp3(tmp_path, "b", 2))
+    assert os.path.getsize(episode.body_path) > a.audio_bytes
+
+    reloaded = RollingEpisode("k", store)
+    assert "b" not in reloaded
+    assert os.path.getsize(reloaded.body_path) == a.audio_bytes
+    c = brief_mp3(tmp_path, "c", 3)
+    assert reloaded.append("c", c)["offset"] == a.audio_bytes
+    out = str(tmp_path / "out.mp3")
+    reloaded.finalize(out, ["c", "a"])
+    assert read(out)[scan_mp3(out).frame_offsets[0]:] == audio_of(c) + audio_of(a)
+
+
+def test_corrupt_manifest_starts_over(tmp_path, store):
+    episode = RollingEpisode("k", store)
+    episode.append("a", brief_mp3(tmp_path, "a", 1))
+    episode.save()
+    with open(episode.manifest_path, "w") as f:
+        f.write("{")
+    reloaded = RollingEpisode("k", store)
+    assert len(reloaded) == 0 and reloaded.template is None
+    assert os.path.getsize(reloaded.body_path) == 0
+    with pytest.raises(ValueError):
+        reloaded.finalize(str(tmp_path / "out.mp3"), ["a"])
+
+
+def test_publish_records_layout_only_after_upload(tmp_path, store):
+    episode = RollingEpisode("k", store)
+    episode.append("a", brief_mp3(tmp_path, "a", 1))
+    episode.append("b", brief_mp3(tmp_path, "b", 2))
+    episode.finalize(str(tmp_path / "out.mp3"), ["b", "a"])
+    assert episode.pending and episode.published_layout() == {}
+    episode.save()
+    # 上传失败：没有 publish，重新加载后也没有已发布的布局
+    assert RollingEpisode("k", store).published_layout() == {}
+
+    episode.publish(object_name="news-audio/out.mp3", size=123)
+    episode.save()
+    reloaded = RollingEpisode("k", store)
+    assert reloaded.published_layout() == {"b": 1, "a": 0}
+    assert reloaded.manifest["published"]["object_name"] == "news-audio/out.mp3"
+    with pytest.raises(ValueError):
+        reloaded.publish(object_name="again")
+
+    # 替换音频后 seq 变化，与已发布的布局不同
+    reloaded.append("a", brief_mp3(tmp_path, "a2", 5))
+    assert reloaded.segment("a")["seq"] == 2
+    assert reloaded.published_layout()["a"] == 0
+    with open(reloaded.manifest_path, encoding="utf-8") as f:
+        assert json.load(f)["next_seq"] == 2
+
+
+def test_discard_removes_directory(tmp_path, store):
+    episode = RollingEpisode("k", store)
+    episode.append("a", brief_mp3(tmp_path, "a", 1))
+    episode.save()
+    episode.discard()
+    assert not os.path.exists(episode.dir)
@@ -0,0 +1,236 @@
+import struct
+
+import pytest
+
+from mp3_frames import (BITRATES, SAMPLE_RATES, Mp3FrameWriter, Mp3Info, parse_frame_header, scan_mp3,
+                        side_info_size, validate_mp3)
+
+VERSION_BITS = {"1": 3, "2": 2, "2.5": 0}
+LAYER_BITS = {3: 1, 2: 2, 1: 3}
+
+
+def header_bytes(version="1", layer=3, bitrate=128, sample_rate=44100, padding=0, channels=1, crc=False):
+    family = "1" if version == "1" else "2"
+    bitrate_index = BITRATES[(family, layer)].index(bitrate)
+    sample_rate_index = SAMPLE_RATES[version].index(sample_rate)
+    b1 = 0xE0 | (VERSION_BITS[version] << 3) | (LAYER_BITS[layer] << 1) | (0 if crc else 1)
+    b2 = (bitrate_index << 4) | (sample_rate_index << 2) | (padding << 1)
+    b3 = (3 if channels == 1 else 0) << 6
+    return bytes((0xFF, b1, b2, b3))
+
+
+def frame(fill=1, **kwargs):
+    """一个完整的帧：帧头后用 fill 填满（不含 0xFF，不会被误认为帧同步）"""
+    header = header_bytes(**kwargs)
+    return header + bytes([fill]) * (parse_frame_header(header).frame_length - 4)
+
+
+def frames(count, **kwargs):
+    return [frame(fill=i % 200 + 1, **kwargs) for i in range(count)]
+
+
+def id3v2(body_size):
+    size = bytes((body_size >> 21 & 0x7F, body_size >> 14 & 0x7F, body_size >> 7 & 0x7F, body_size & 0x7F))
+    return b"ID3\x04\x00\x00" + size + b"\x00" * body_size
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+
+# ---- 帧头 ----
+
+@pytest.mark.parametrize("kwargs, frame_length, samples", [
+    (dict(version="1", bitrate=128, sample_rate=44100), 417, 1152),
+    (dict(version="1", bitrate=128, sample_rate=44100, padding=1), 418, 1152),
+    (dict(version="1", bitrate=128, sample_rate=48000), 384, 1152),
+    (dict(version="1", bitrate=320, sample_rate=32000, padding=1), 1441, 1152),
+    (dict(version="2", bitrate=64, sample_rate=22050), 208, 576),
+    (dict(version="2", bitrate=64, sample_rate=22050, padding=1), 209, 576),
+    (dict(version="2", bitrate=8, sample_rate=16000), 36, 576),
+    (dict(version="2.5", bitrate=32, sample_rate=11025), 208, 576),
+    (dict(version="2.5", bitrate=8, sample_rate=8000, padding=1), 73, 576),
+    (dict(version="1", layer=2, bitrate=128, sample_rate=44100), 417, 1152),
+    (dict(version="1", layer=1, bitrate=32, sample_rate=44100, padding=1), 36, 384),
+])
+def test_parse_frame_header_sizes(kwargs, frame_length, samples):
+    header = parse_frame_header(header_bytes(**kwargs))
+    assert header.frame_length == frame_length
+    assert header.samples == samples
+    assert header.version == kwargs["version"]
+    assert header.sample_rate == kwargs["sample_rate"]
+    assert header.padding == kwargs.get("padding", 0)
+
+
+def test_parse_frame_header_fields():
+    header = parse_frame_header(b"\x00\x00" + header_bytes(channels=2, crc=True), 2)
+    assert header.channels == 2 and header.protected
+    assert side_info_size(header) == 32
+    assert side_info_size(parse_frame_header(header_bytes(version="2", bitrate=64, sample_rate=22050))) == 9
+
+
+@pytest.mark.parametrize("data", [
+    b"\xff\xfb\x90",  # 不足4字节
+    b"\xfe\xfb\x90\xc0",  # 没有帧同步
+    b"\xff\xfb\xf0\xc0",  # 码率下标 15
+    b"\xff\xfb\x00\xc0",  # 自由码率
+    b"\xff\xfb\x9c\xc0",  # 采样率下标 3
+    b"\xff\xe9\x90\xc0",  # 保留的 layer
+    b"\xff\xeb\x90\xc0",  # 保留的版本
+])
+def test_parse_frame_header_rejects_invalid(data):
+    assert parse_frame_header(data) is None
+
+
+# ---- 扫描 ----
+
+def test_scan_mp3_skips_id3_tags(tmp_path):
+    audio = frames(10)
+    tag = id3v2(300)
+    id3v1 = b"TAG" + b"\x00" * 125
+    info = scan_mp3(write(tmp_path / "a.mp3", tag + b"".join(audio) + id3v1))
+    assert info.frame_count == 10
+    assert info.frame_offsets[0] == len(tag)
+    assert list(info.frame_sizes) == [len(f) for f in audio]
+    assert info.junk_bytes == 0 and not info.truncated and info.is_contiguous
+    assert info.duration == pytest.approx(10 * 1152 / 44100)
+    assert validate_mp3(info.path)[1] == []
+
+
+@pytest.mark.parametrize("version, bitrate, sample_rate", [("1", 128, 44100), ("2", 64, 22050), ("2.5", 32, 11025)])
+def test_scan_mp3_versions(tmp_path, version, bitrate, sample_rate):
+    audio = frames(6, version=version, bitrate=bitrate, sample_rate=sample_rate)
+    # 带填充位的帧长一字节，扫描要按各帧自己的长度前进
+    audio[2] = frame(version=version, bitrate=bitrate, sample_rate=sample_rate, padding=1)
+    info = scan_mp3(write(tmp_path / "a.mp3", b"".join(audio)))
+    assert info.frame_count == 6
+    assert info.format_key == (version, 3, sample_rate, 1)
+    assert info.frame_sizes[2] == info.frame_sizes[1] + 1
+
+
+def test_scan_mp3_counts_junk_between_frames(tmp_path):
+    audio = frames(8)
+    data = b"".join(audio[:4]) + b"\x11" * 50 + b"".join(audio[4:])
+    info = scan_mp3(write(tmp_path / "a.mp3", data))
+    assert info.frame_count == 8
+    assert info.junk_bytes == 50
+    assert not info.is_contiguous
+    assert info.frame_offsets[4] == 4 * len(audio[0]) + 50
+    assert validate_mp3(info.path)[1] == []
+
+
+def test_scan_mp3_junk_before_first_frame(tmp_path):
+    info = scan_mp3(write(tmp_path / "a.mp3", b"\x00\x01" * 20 + b"".join(frames(5))))
+    assert info.frame_count == 5
+    assert info.frame_offsets[0] == 40
+
+
+def test_validate_mp3_rejects_truncated_last_frame(tmp_path):
+    data = b"".join(frames(6))
+    path = write(tmp_path / "a.mp3", data[:-100])
+    info, problems = validate_mp3(path)
+    assert info.truncated and info.frame_count == 5
+    assert any("截断" in p for p in problems)
+
+
+def test_validate_mp3_rejects_size_mismatch_and_junk(tmp_path):
+    data = b"".join(frames(6))
+    path = write(tmp_path / "a.mp3", data)
+    assert validate_mp3(path, expected_size=len(data))[1] == []
+    assert len(validate_mp3(path, expected_size=len(data) + 1)[1]) == 1
+    junk = write(tmp_path / "junk.mp3", data[:1000] + b"\x11" * 5000 + data[1000:])
+    assert any("无法解析" in p for p in validate_mp3(junk)[1])
+    empty = write(tmp_path / "empty.mp3", b"\x00" * 100)
+    assert validate_mp3(empty)[1] == ["没有有效的MP3帧"]
+
+
+def test_mp3_info_round_trip(tmp_path):
+    info = scan_mp3(write(tmp_path / "a.mp3", id3v2(20) + b"".join(frames(4))))
+    restored = Mp3Info.from_dict(info.path, info.to_dict())
+    assert restored.to_dict() == info.to_dict()
+    assert restored.header == info.header
+
+
+# ---- 帧级拼接 ----
+
+def test_writer_appends_frames_and_backfills_xing(tmp_path):
+    first = frames(5)
+    second = frames(7, bitrate=128, padding=1)
+    a = scan_mp3(write(tmp_path / "a.mp3", id3v2(64) + b"".join(first)))
+    b = scan_mp3(write(tmp_path / "b.mp3", b"".join(second) + b"TAG" + b"\x00" * 125))
+    out = str(tmp_path / "out.mp3")
+    writer = Mp3FrameWriter(out, a)
+    assert writer.append(a) == (0, 5)
+    assert writer.append(b, 2, 6) == (5, 4)
+    assert writer.append(b, 3, 3) == (9, 0)
+    assert writer.frame_count == 9
+    offsets = [writer.byte_offset(i) for i in range(10)]
+    writer.close()
+
+    with open(out, "rb") as f:
+        data = f.read()
+    expected = first + second[2:6]
+    assert data[offsets[0]:] == b"".join(expected)
+    for i, audio in enumerate(expected):
+        assert data[offsets[i]:offsets[i] + len(audio)] == audio
+    assert offsets[9] == len(data)
+
+    info = scan_mp3(out)
+    assert info.has_xing and info.xing_frames == 9
+    assert info.frame_count == 9 and info.frame_offsets[0] == offsets[0]
+    xing_at = 4 + side_info_size(info.header)
+    assert data[xing_at:xing_at + 4] == b"Info"
+    assert struct.unpack(">III", data[xing_at + 4:xing_at + 16]) == (0x0F, 9, len(data))
+    assert validate_mp3(out)[1] == []
+
+
+def test_writer_marks_mixed_bitrates_as_xing(tmp_path):
+    a = scan_mp3(write(tmp_path / "a.mp3", b"".join(frames(3, bitrate=128))))
+    b = scan_mp3(write(tmp_path / "b.mp3", b"".join(frames(3, bitrate=64))))
+    out = str(tmp_path / "out.mp3")
+    writer = Mp3FrameWriter(out, a)
+    writer.append(a)
+    writer.append(b)
+    writer.close()
+    info = scan_mp3(out)
+    assert info.bitrates == {64, 128}
+    with open(out, "rb") as f:
+        assert f.read()[4 + side_info_size(info.header):][:4] == b"Xing"
+
+
+def test_writer_copies_non_contiguous_frames(tmp_path):
+    audio = frames(4)
+    # 首帧要由紧随的下一帧确认，杂数据放在第 2 帧之后
+    src = scan_mp3(write(tmp_path / "a.mp3", b"".join(audio[:2]) + b"\x11" * 30 + b"".join(audio[2:])))
+    assert not src.is_contiguous
+    out = str(tmp_path / "out.mp3")
+    writer = Mp3FrameWriter(out, src)
+    writer.append(src, 0, 3)
+    writer.close()
+    with open(out, "rb") as f:
+        assert f.read()[writer.byte_offset(0):] == b"".join(audio[:3])
+
+
+def test_writer_rejects_other_formats(tmp_path):
+    a = scan_mp3(write(tmp_path / "a.mp3", b"".join(frames(3))))
+    b = scan_mp3(write(tmp_path / "b.mp3", b"".join(frames(3, sample_rate=48000))))
+    writer = Mp3FrameWriter(str(tmp_path / "out.mp3"), a)
+    with pytest.raises(ValueError):
+        writer.append(b)
+    writer.abort()
+    layer2 = scan_mp3(write(tmp_path / "l2.mp3", b"".join(frames(3, layer=2))))
+    with pytest.raises(ValueError):
+        Mp3FrameWriter(str(tmp_path / "out2.mp3"), layer2)
+
+
+def test_writer_abort_removes_output(tmp_path):
+    a = scan_mp3(write(tmp_path / "a.mp3", b"".join(frames(3))))
+    out = tmp_path / "out.mp3"
+    writer = Mp3FrameWriter(str(out), a)
+    writer.append(a)
+    assert out.exists()
+    writer.abort()
+    assert not out.exists()
+    writer.abort()
@@ -0,0 +1,263 @@
+import os
+import time
+
+import pytest
+
+import oss_uploader
+from bench_merge_mp3_briefs import FakeBucket
+from oss_uploader import OssUploader, plan_splice_parts
+
+PART = 1000
+
+
+class FlakyBucket(FakeBucket):
+    """上传 fail_after 个分片后开始失败的 Bucket，模拟中断的上传"""
+
+    def __init__(self, fail_after=None):
+        super().__init__()
+        self.fail_after = fail_after
+        self.parts_uploaded = 0
+        self.aborted = []
+
+    def upload_part(self, key, upload_id, part_number, data):
+        with self._lock:
+            if self.fail_after is not None and self.parts_uploaded >= self.fail_after:
+                raise IOError("connection reset")
+            self.parts_uploaded += 1
+        return super().upload_part(key, upload_id, part_number, data)
+
+    def abort_multipart_upload(self, key, upload_id):
+        self.aborted.append(upload_id)
+        super().abort_multipart_upload(key, upload_id)
+
+
+@pytest.fixture
+def uploader(tmp_path):
+    uploader = OssUploader("endpoint", "id", "secret", "bench", "https://cdn.example.com/",
+                           part_size=PART, checkpoint_dir=str(tmp_path / "uploads"), bucket=FlakyBucket())
+    yield uploader
+    uploader.close()
+
+
+@pytest.fixture
+def fast_poll(monkeypatch):
+    monkeypatch.setattr(oss_uploader, "POLL_INTERVAL", 0.01)
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def pattern(size, seed=0):
+    return bytes((i * 7 + seed) % 251 for i in range(size))
+
+
+def wait_for_parts(bucket, count, timeout=5):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        with bucket._lock:
+            if sum(len(parts) for parts in bucket.uploads.values()) >= count:
+                return
+        time.sleep(0.01)
+    raise AssertionError(f"expected {count} streamed parts")
+
+
+# ---- StreamingUpload ----
+
+def test_streaming_upload_sends_parts_while_writing(uploader, fast_poll, tmp_path):
+    path = str(tmp_path / "news.mp3")
+    data = pattern(4500)
+    write(path, b"")
+    upload = uploader.streaming_upload(path, "news-audio/news.mp3")
+    with open(path, "ab") as f:
+        f.write(data[:3500])
+    # 留一片余量：写到 3500 字节时第 2 个分片（1000-2000）已稳定
+    wait_for_parts(uploader.bucket, 1)
+    assert 1 not in uploader.bucket.uploads[upload.upload_id]
+    with open(path, "ab") as f:
+        f.write(data[3500:])
+    # 写入结束时回填开头的头部
+    with open(path, "r+b") as f:
+        f.write(b"XING")
+    assert upload.finish() == "https://cdn.example.com/news-audio/news.mp3"
+    assert uploader.bucket.objects["news-audio/news.mp3"] == b"XING" + data[4:]
+
+
+def test_streaming_upload_ignores_stale_output(uploader, fast_poll, tmp_path):
+    path = str(tmp_path / "news.mp3")
+    write(path, pattern(6000, seed=1))  # 上一次运行留下的成品
+    upload = uploader.streaming_upload(path, "news.mp3")
+    wait_for_parts(uploader.bucket, 4)
+    data = pattern(2500, seed=2)
+    write(path, data)
+    assert upload.finish()
+    assert uploader.bucket.objects["news.mp3"] == data
+
+
+def test_streaming_upload_survives_truncate_and_rewrite(uploader, fast_poll, tmp_path):
+    path = str(tmp_path / "news.mp3")
+    write(path, b"")
+    upload = uploader.streaming_upload(path, "news.mp3")
+    write(path, pattern(5000, seed=3))
+    wait_for_parts(uploader.bucket, 3)
+    # 合并失败后换一种方式重写，内容和长度都不同
+    data = pattern(4200, seed=4)
+    write(path, data)
+    assert upload.finish()
+    assert uploader.bucket.objects["news.mp3"] == data
+
+
+def test_streaming_upload_abort_on_failure(uploader, fast_poll, tmp_path):
+    path = str(tmp_path / "news.mp3")
+    write(path, pattern(3000))
+    upload = uploader.streaming_upload(path, "news.mp3")
+    assert upload.finish(success=False) is None
+    assert "news.mp3" not in uploader.bucket.objects
+    assert upload.upload_id in uploader.bucket.aborted
+
+
+# ---- plan_splice_parts ----
+
+def check_plan(plan, size, copy_ranges, part_size=PART, min_part=100):
+    assert plan[0][0] == 0 and plan[-1][1] == size
+    for (_, end, _), (start, _, _) in zip(plan, plan[1:]):
+        assert end == start
+    for start, end, src in plan[:-1]:
+        assert end - start >= min_part
+    for start, end, src in plan:
+        if src is None:
+            assert end - start <= part_size
+        else:
+            # 复制的片段必须落在某个相同内容的区间内
+            assert any(dst <= start and end <= dst + length and src - start == old - dst
+                       for dst, old, length in copy_ranges)
+
+
+def test_plan_splice_parts_without_copies_splits_evenly():
+    plan = plan_splice_parts(2500, [], part_size=PART, min_part=100)
+    assert plan == [(0, 834, None), (834, 1668, None), (1668, 2500, None)]
+
+
+def test_plan_splice_parts_uses_copy_ranges():
+    copy_ranges = [(0, 0, 1500), (2000, 1800, 3000)]
+    plan = plan_splice_parts(5500, copy_ranges, part_size=PART, min_part=100)
+    check_plan(plan, 5500, copy_ranges)
+    assert plan == [(0, 1500, 0), (1500, 2000, None), (2000, 5000, 1800), (5000, 5500, None)]
+
+
+def test_plan_splice_parts_merges_adjacent_copies():
+    copy_ranges = [(0, 0, 1000), (1000, 1000, 1000)]
+    plan = plan_splice_parts(2600, copy_ranges, part_size=PART, min_part=100)
+    assert plan == [(0, 2000, 0), (2000, 2600, None)]
+
+
+def test_plan_splice_parts_short_local_part_borrows_from_copy():
+    copy_ranges = [(0, 0, 1000), (1030, 900, 1000)]
+    plan = plan_splice_parts(2030, copy_ranges, part_size=PART, min_part=100)
+    check_plan(plan, 2030, copy_ranges)
+    assert plan == [(0, 1000, 0), (1000, 1100, None), (1100, 2030, 970)]
+
+
+def test_plan_splice_parts_short_local_part_absorbs_small_copy():
+    # 后面的复制区间借出字节后会不足最小分片（且不是最后一片），整个并入本地上传
+    copy_ranges = [(0, 0, 1000), (1030, 900, 150)]
+    plan = plan_splice_parts(1300, copy_ranges, part_size=PART, min_part=100)
+    check_plan(plan, 1300, copy_ranges)
+    assert plan == [(0, 1000, 0), (1000, 1300, None)]
+
+
+def test_plan_splice_parts_last_copy_may_be_short():
+    copy_ranges = [(0, 0, 1000), (1030, 900, 150)]
+    plan = plan_splice_parts(1180, copy_ranges, part_size=PART, min_part=100)
+    check_plan(plan, 1180, copy_ranges)
+    assert plan == [(0, 1000, 0), (1000, 1100, None), (1100, 1180, 970)]
+
+
+def test_plan_splice_parts_drops_invalid_ranges():
+    copy_ranges = [(0, 0, 50), (500, 0, 2000), (200, 200, 400), (400, 100, 300)]
+    plan = plan_splice_parts(1500, copy_ranges, part_size=PART, min_part=100)
+    # 太短的、超出文件的、与前一段重叠的区间都被忽略
+    check_plan(plan, 1500, [(200, 200, 400)])
+    assert [p for p in plan if p[2] is not None] == [(200, 600, 200)]
+
+
+def test_upload_spliced_matches_local_file(uploader, tmp_path):
+    # 真实的最小分片（100KB）下，只有替换的片段（借够最小分片）从本地上传
+    uploader.part_size = oss_uploader.PART_SIZE
+    old = pattern(500 * 1024, seed=5)
+    uploader.bucket.objects["news.mp3"] = old
+    new = old[:200 * 1024] + pattern(700, seed=6) + old[201 * 1024:]
+    path = str(tmp_path / "news.mp3")
+    write(path, new)
+    copy_ranges = [(0, 0, 200 * 1024), (200 * 1024 + 700, 201 * 1024, 299 * 1024)]
+    url = uploader.upload_spliced(path, "news.mp3", copy_ranges, source_size=len(old))
+    assert url == "https://cdn.example.com/news.mp3"
+    assert uploader.bucket.objects["news.mp3"] == new
+    assert uploader.bucket.parts_uploaded == 1
+    assert uploader.bucket.bytes_received == oss_uploader.MIN_PART_SIZE
+
+
+def test_upload_spliced_falls_back_when_object_changed(uploader, tmp_path):
+    uploader.bucket.objects["news.mp3"] = pattern(4000)
+    path = str(tmp_path / "news.mp3")
+    write(path, pattern(3000, seed=7))
+    assert uploader.upload_spliced(path, "news.mp3", [(0, 0, 2000)], source_size=5000)
+    assert uploader.bucket.objects["news.mp3"] == pattern(3000, seed=7)
+
+
+# ---- 可续传的分片上传 ----
+
+@pytest.fixture
+def multipart(monkeypatch):
+    monkeypatch.setattr(oss_uploader, "MULTIPART_THRESHOLD", 0)
+
+
+def checkpoint_files(uploader):
+    return os.listdir(uploader.checkpoint_dir)
+
+
+def test_multipart_upload_resumes_missing_parts(uploader, multipart, tmp_path):
+    path = str(tmp_path / "news.mp3")
+    data = pattern(9500)
+    write(path, data)
+    uploader.bucket.fail_after = 4
+    assert uploader.upload(path, "news.mp3") is None
+    assert len(checkpoint_files(uploader)) == 1
+
+    uploader.bucket.fail_after = None
+    uploader.bucket.parts_uploaded = 0
+    assert uploader.upload(path, "news.mp3")
+    assert uploader.bucket.objects["news.mp3"] == data
+    assert uploader.bucket.parts_uploaded == 10 - 4
+    assert checkpoint_files(uploader) == []
+
+
+def test_multipart_upload_restarts_when_local_file_changed(uploader, multipart, tmp_path):
+    path = str(tmp_path / "news.mp3")
+    write(path, pattern(9500))
+    uploader.bucket.fail_after = 4
+    assert uploader.upload(path, "news.mp3") is None
+    upload_id = next(iter(uploader.bucket.uploads))
+
+    # 同样大小、内容不同的新文件：检查点中的分片不能再用
+    data = pattern(9500, seed=8)
+    write(path, data)
+    st = os.stat(path)
+    os.utime(path, (st.st_atime, st.st_mtime + 10))
+    uploader.bucket.fail_after = None
+    uploader.bucket.parts_uploaded = 0
+    assert uploader.upload(path, "news.mp3")
+    assert uploader.bucket.objects["news.mp3"] == data
+    assert uploader.bucket.parts_uploaded == 10
+    assert upload_id in uploader.bucket.aborted
+
+
+def test_upload_many_keeps_order(uploader, tmp_path):
+    paths = []
+    for i in range(3):
+        paths.append(str(tmp_path / f"{i}.md"))
+        write(paths[-1], pattern(10, seed=i))
+    urls = uploader.upload_many([paths[0], (paths[1], "x/1.md"), paths[2]])
+    assert urls == ["https://cdn.example.com/news-audio/0.md", "https://cdn.example.com/x/1.md",
+                    "https://cdn.example.com/news-audio/2.md"]
@@ -0,0 +1,285 @@
+import http.client
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from render_service import RenderCache, SingleFlight, brief_set_key, make_server, parse_range
+
+
+# ---- parse_range ----
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-199", (100, 199)),
+    ("bytes=900-", (900, 999)),
+    ("bytes=0-", (0, 999)),
+    ("bytes=990-5000", (990, 999)),  # 结束位置超出文件时截到末尾
+    ("bytes=999-999", (999, 999)),
+    ("bytes=-100", (900, 999)),  # 最后 100 字节
+    ("bytes=-5000", (0, 999)),
+    (" bytes=10-20 ", (10, 20)),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [
+    None,
+    "",
+    "bytes=0-10,20-30",  # 多个区间：按整个文件响应
+    "bytes=abc",
+    "bytes=-",
+    "bytes=5-3",
+    "bytes=1-2-3",
+    "bytes=+1-2",
+    "bytes=0x10-",
+    "bytes=١-٢",
+    "items=0-10",
+    "0-10",
+])
+def test_parse_range_ignores_unsupported(header):
+    assert parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=1000-", 1000),
+    ("bytes=1000-2000", 1000),
+    ("bytes=-0", 1000),
+    ("bytes=-10", 0),
+    ("bytes=0-", 0),
+])
+def test_parse_range_unsatisfiable(header, size):
+    with pytest.raises(ValueError):
+        parse_range(header, size)
+
+
+# ---- SingleFlight ----
+
+def test_single_flight_shares_result():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "episode.mp3"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("k", work)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do("k", work))) for _ in range(3)]
+    for t in followers:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in [leader] + followers:
+        t.join(5)
+    assert len(calls) == 1
+    assert sorted(results) == [("episode.mp3", False)] + [("episode.mp3", True)] * 3
+    # 完成后同一个 key 会重新执行
+    assert flight.do("k", lambda: "again") == ("again", False)
+
+
+def test_single_flight_propagates_errors_to_waiters():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("合并失败")
+
+    errors = []
+
+    def call():
+        try:
+            flight.do("k", fail)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    time.sleep(0.05)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert errors == ["合并失败", "合并失败"]
+    # 失败不会留在表中，下一次调用重新执行
+    assert flight.do("k", lambda: 1) == (1, False)
+
+
+def test_single_flight_keys_are_independent():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == (1, False)
+    assert flight.do("b", lambda: 2) == (2, False)
+
+
+# ---- RenderCache ----
+
+def put(cache, tmp_path, key, size, mtime=None):
+    src = tmp_path / f"{key}.src"
+    src.write_bytes(b"\x00" * size)
+    path = cache.put(key, str(src), meta={"briefs": [key]})
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_render_cache_put_and_get(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"))
+    assert cache.get("k") is None
+    path = put(cache, tmp_path, "k", 10, mtime=1000)
+    assert cache.get("k") == path
+    assert os.path.getmtime(path) > 1000  # 命中时刷新使用时间
+    assert os.path.exists(path[:-4] + ".json")
+
+
+def test_render_cache_evicts_least_recently_used(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"), max_bytes=250)
+    old = put(cache, tmp_path, "old", 100, mtime=1000)
+    used = put(cache, tmp_path, "used", 100, mtime=2000)
+    os.utime(old, (3000, 3000))  # old 最近被读取过
+    new = put(cache, tmp_path, "new", 100)
+    assert os.path.exists(old) and os.path.exists(new)
+    assert not os.path.exists(used) and not os.path.exists(used[:-4] + ".json")
+
+
+def test_render_cache_keeps_the_new_entry(tmp_path):
+    cache = RenderCache(str(tmp_path / "cache"), max_bytes=50)
+    old = put(cache, tmp_path, "old", 40, mtime=1000)
+    new = put(cache, tmp_path, "new", 100, mtime=500)
+    assert os.path.exists(new) and not os.path.exists(old)
+
+
+def test_brief_set_key_depends_on_briefs_and_settings():
+    briefs = [SimpleNamespace(id="a", audio_url="https://x/a.mp3"), SimpleNamespace(id="b", audio_url="https://x/b.mp3")]
+    key = brief_set_key(briefs, intro_date="20261018")
+    assert key == brief_set_key(list(briefs), intro_date="20261018")
+    assert key != brief_set_key(briefs[::-1], intro_date="20261018")
+    assert key != brief_set_key(briefs, intro_date="20261019")
+    assert brief_set_key(briefs, True, "20261018") == brief_set_key(briefs, True, "20261019")
+    assert key != brief_set_key(briefs, intro_date="20261018", merge_mode="reencode")
+
+
+# ---- HTTP ----
+
+class FakeRenderer:
+    def __init__(self, path):
+        self.path = path
+        self.stats = {"requests": 0}
+        self.error = None
+        self.windows = []
+
+    def render(self, start_epoch, end_epoch, skip_intro=False):
+        self.windows.append((start_epoch, end_epoch, skip_intro))
+        if self.error:
+            raise self.error
+        return {"path": self.path, "key": "abc", "briefs": 3, "source": "cache"}
+
+
+@pytest.fixture
+def service(tmp_path):
+    episode = tmp_path / "episode.mp3"
+    episode.write_bytes(bytes(range(256)) * 4)
+    renderer = FakeRenderer(str(episode))
+    server = make_server("127.0.0.1", 0, renderer)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+
+    def request(path, headers=None, method="GET"):
+        conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=5)
+        conn.request(method, path, headers=headers or {})
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        return response, body
+
+    yield SimpleNamespace(request=request, renderer=renderer, data=episode.read_bytes())
+    server.shutdown()
+    server.server_close()
+
+
+WINDOW = "/episode.mp3?start=2026-10-18T00:00:00Z&end=2026-10-18T12:00:00%2B08:00"
+
+
+def test_http_full_response(service):
+    response, body = service.request(WINDOW + "&skip_intro=1")
+    assert response.status == 200 and body == service.data
+    assert response.getheader("ETag") == '"abc"'
+    assert response.getheader("Accept-Ranges") == "bytes"
+    assert response.getheader("X-Briefs") == "3"
+    assert service.renderer.windows == [(1792281600, 1792296000, True)]
+
+
+def test_http_range_responses(service):
+    response, body = service.request(WINDOW, {"Range": "bytes=100-199"})
+    assert response.status == 206 and body == service.data[100:200]
+    assert response.getheader("Content-Range") == "bytes 100-199/1024"
+    response, body = service.request(WINDOW, {"Range": "bytes=-24"})
+    assert response.status == 206 and body == service.data[-24:]
+    response, body = service.request(WINDOW, {"Range": "bytes=1000-"})
+    assert response.status == 206 and body == service.data[1000:]
+    # 多个区间或格式不合法：整个文件
+    response, body = service.request(WINDOW, {"Range": "bytes=0-1,5-6"})
+    assert response.status == 200 and body == service.data
+    response, body = service.request(WINDOW, {"Range": "bytes=9-3"})
+    assert response.status == 200 and body == service.data
+
+
+def test_http_unsatisfiable_range(service):
+    response, body = service.request(WINDOW, {"Range": "bytes=2000-"})
+    assert response.status == 416 and body == b""
+    assert response.getheader("Content-Range") == "bytes */1024"
+
+
+def test_http_conditional_requests(service):
+    response, body = service.request(WINDOW, {"If-None-Match": '"abc"'})
+    assert response.status == 304 and body == b""
+    response, body = service.request(WINDOW, {"If-Range": '"old"', "Range": "bytes=0-9"})
+    assert response.status == 200 and body == service.data
+    response, body = service.request(WINDOW, {"If-Range": '"abc"', "Range": "bytes=0-9"})
+    assert response.status == 206 and body == service.data[:10]
+
+
+def test_http_head_has_no_body(service):
+    response, body = service.request(WINDOW, method="HEAD")
+    assert response.status == 200 and body == b""
+    assert response.getheader("Content-Length") == "1024"
+
+
+@pytest.mark.parametrize("path, status", [
+    ("/episode.mp3", 400),
+    ("/episode.mp3?hours=abc", 400),
+    ("/episode.mp3?hours=0", 400),
+    ("/episode.mp3?hours=1000", 400),
+    ("/episode.mp3?start=yesterday&end=today", 400),
+    ("/episode.mp3?start=2026-10-18T12:00:00Z&end=2026-10-18T00:00:00Z", 400),
+    ("/other", 404),
+])
+def test_http_rejects_bad_requests(service, path, status):
+    response, _ = service.request(path)
+    assert response.status == status
+    assert service.renderer.windows == []
+
+
+def test_http_render_failure(service):
+    service.renderer.error = RuntimeError("没有成功下载的简报")
+    response, body = service.request("/episode.mp3?hours=6")
+    assert response.status == 502
+    assert "没有成功下载的简报" in body.decode("utf-8")
+
+
+def test_http_healthz(service):
+    response, body = service.request("/healthz")
+    assert response.status == 200 and body == b'{"requests": 0}'